@@ -1,6 +1,9 @@
+import hashlib
+import json
 import os
 import random
 from collections import defaultdict
+from collections.abc import Sequence
 from enum import Enum
 from typing import Tuple, List
 
@@ -61,8 +64,61 @@ class AgeLabels(int, Enum):
             return cls.OLD
 
 
+class PackedStrings(Sequence):
+    """
+    문자열 목록을 하나의 uint8 버퍼와 offset 배열로 압축해서 저장하는
+    읽기 전용 시퀀스 클래스
+
+    Python str 객체 리스트는 DataLoader worker 를 fork 한 뒤 참조 카운트만 바뀌어도
+    페이지가 worker 마다 복사됩니다.
+    numpy 배열 두 개로만 저장하면 데이터 페이지는 공유된 채로 남습니다.
+    """
+
+    def __init__(self, strings):
+        encoded = [string.encode("utf-8") for string in strings]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=self.offsets[1:])
+        self.buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    @classmethod
+    def from_arrays(cls, buffer, offsets):
+        """`buffer`, `offsets` 배열로부터 (예: manifest 파일에서 읽은 배열) 시퀀스를 만든다."""
+        packed = cls.__new__(cls)
+        packed.buffer = np.asarray(buffer, dtype=np.uint8)
+        packed.offsets = np.asarray(offsets, dtype=np.int64)
+        return packed
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.buffer[start:end].tobytes().decode("utf-8")
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes + self.offsets.nbytes
+
+
 class MaskBaseDataset(Dataset):
-    """마스크 데이터셋의 기본 클래스"""
+    """
+    마스크 데이터셋의 기본 클래스
+
+    샘플 테이블(이미지 경로, 라벨)은 Python 객체 리스트가 아닌 numpy 배열로 저장합니다.
+    라벨은 uint8 컬럼, `encode_multi_class` 결과는 미리 계산한 uint8 컬럼,
+    이미지 경로는 `PackedStrings` 로 저장하여 worker 수가 늘어도 메모리가 복사되지 않습니다.
+
+    `manifest` 가 주어지면 샘플 테이블을 npz 파일로 저장해두고,
+    이후 같은 설정으로 생성할 때 데이터 디렉토리를 다시 순회하지 않고 불러옵니다.
+    `image_cache` 가 주어지면 이미지를 디코딩하지 않고
+    `DecodedImageCache` (디코딩된 uint8 이미지 memmap)에서 읽습니다.
+    """
+
+    manifest_version = 1
 
     num_classes = 3 * 2 * 3
 
@@ -80,11 +136,6 @@ class MaskBaseDataset(Dataset):
     caution_labels =['000214', '000226', '000725', '000736', '000763', '000767', '000773', '000817', 
                      '001049', '001509', '003724', '001200', '005523']
 
-    image_paths = []
-    mask_labels = []
-    gender_labels = []
-    age_labels = []
-
     def __init__(
         self,
         data_dir,
@@ -93,27 +144,216 @@ class MaskBaseDataset(Dataset):
         mean=(0.548, 0.504, 0.479),
         std=(0.237, 0.247, 0.246),
         val_ratio=0.2,
+        manifest=None,
+        image_cache=None,
+        seed=None,
+        n_splits=None,
+        fold=0,
+        split_file=None,
     ):
+        """
+        Args:
+            seed (int): 이미지 단위 random split 에 사용할 seed. None 이면 torch 의 전역 난수 사용
+            n_splits, fold, split_file: 프로필 기준 분할 옵션. 이 클래스는 이미지를 val_ratio 로
+                random 하게 나누므로 기본값이 아니면 ValueError (`MaskSplitByProfileDataset` 사용)
+        """
+        if n_splits is not None or fold != 0 or split_file is not None:
+            raise ValueError(f"{type(self).__name__} splits images at random by val_ratio and supports none of "
+                             "n_splits, fold and split_file, use MaskSplitByProfileDataset")
         self.data_dir = data_dir
         self.multi_head = multi_head
         self.use_caution = use_caution
         self.mean = mean
         self.std = std
         self.val_ratio = val_ratio
+        self.seed = seed
+        self.manifest = manifest
 
         self.transform = None
-        self.setup()  # 데이터셋을 설정
+        if manifest is None or not self.load_manifest(manifest):
+            self.setup()  # 데이터셋을 설정
+            if manifest is not None:
+                self.save_manifest(manifest)
         self.calc_statistics()  # 통계시 계산 (평균 및 표준 편차)
 
+        self.shared_cache = None
+        self.image_cache = None
+        if image_cache is not None:
+            from data_loader.image_cache import DecodedImageCache
+
+            self.image_cache = DecodedImageCache(image_cache)
+            if self.image_cache.sample_key != self.sample_key:
+                raise ValueError(f"{image_cache} was built from a different sample table")
+
     def setup(self):
         """데이터 디렉토리로부터 이미지 경로와 라벨을 설정하는 메서드"""
-        profiles = os.listdir(self.data_dir)
+        profiles = [profile for profile in os.listdir(self.data_dir) if not profile.startswith(".")]
+        samples = list(self._iter_samples(profiles))
+        sample_profiles, *columns = zip(*samples) if samples else ([], [], [], [], [])
+        self.set_samples(*columns, profiles=sample_profiles)
+
+    def set_samples(self, image_paths, mask_labels, gender_labels, age_labels, profiles=None):
+        """
+        샘플 테이블을 numpy 배열로 저장하는 메서드
+
+        Args:
+            image_paths (Sequence[str]): 이미지 경로
+            mask_labels (Sequence[int]): 마스크 라벨
+            gender_labels (Sequence[int]): 성별 라벨
+            age_labels (Sequence[int]): 나이 라벨
+            profiles (Sequence[str]): 샘플별 프로필 이름 (optional)
+        """
+        if profiles is None:
+            self._profile_names, self._profile_ids = PackedStrings([]), None
+        else:
+            profile_names, profile_ids = np.unique(np.asarray(profiles, dtype=str), return_inverse=True)
+            self._profile_names = PackedStrings(profile_names.tolist())
+            self._profile_ids = profile_ids.astype(np.int32)
+        self._image_paths = PackedStrings(image_paths)
+        self._mask_labels = np.asarray(mask_labels, dtype=np.uint8)
+        self._gender_labels = np.asarray(gender_labels, dtype=np.uint8)
+        self._age_labels = np.asarray(age_labels, dtype=np.uint8)
+        self._multi_class_labels = self.encode_multi_class(
+            self._mask_labels, self._gender_labels, self._age_labels
+        ).astype(np.uint8)
+
+    @property
+    def image_paths(self) -> PackedStrings:
+        """이미지 경로 시퀀스"""
+        return self._image_paths
+
+    @property
+    def profile_names(self) -> PackedStrings:
+        """정렬된 프로필 이름 시퀀스"""
+        return self._profile_names
+
+    @property
+    def profile_ids(self) -> np.ndarray:
+        """
+        샘플별 프로필 번호 (`profile_names` 의 인덱스) int32 배열.
+        프로필 정보가 없으면 None
+        """
+        return self._profile_ids
+
+    @property
+    def mask_labels(self) -> np.ndarray:
+        """마스크 라벨 uint8 배열"""
+        return self._mask_labels
+
+    @property
+    def gender_labels(self) -> np.ndarray:
+        """성별 라벨 uint8 배열"""
+        return self._gender_labels
+
+    @property
+    def age_labels(self) -> np.ndarray:
+        """나이 라벨 uint8 배열"""
+        return self._age_labels
+
+    @property
+    def multi_class_labels(self) -> np.ndarray:
+        """미리 인코딩된 18 클래스 라벨 uint8 배열"""
+        return self._multi_class_labels
+
+    @property
+    def nbytes(self) -> int:
+        """샘플 테이블이 차지하는 바이트 수"""
+        columns = [self._mask_labels, self._gender_labels, self._age_labels, self._multi_class_labels]
+        if self._profile_ids is not None:
+            columns.append(self._profile_ids)
+        return self._image_paths.nbytes + self._profile_names.nbytes + sum(column.nbytes for column in columns)
+
+    @property
+    def sample_key(self) -> str:
+        """
+        샘플 테이블(이미지 경로 순서)을 식별하는 해시.
+        이미지 캐시가 같은 순서로 만들어졌는지 확인할 때 사용
+        """
+        digest = hashlib.sha1(self._image_paths.offsets.tobytes())
+        digest.update(self._image_paths.buffer.tobytes())
+        return digest.hexdigest()
+
+    def _manifest_meta(self):
+        """manifest 를 재사용해도 되는지 판단하는 설정값"""
+        return {
+            "version": self.manifest_version,
+            "dataset": type(self).__name__,
+            "data_dir": os.path.abspath(self.data_dir),
+            "use_caution": bool(self.use_caution),
+        }
+
+    def save_manifest(self, path):
+        """
+        샘플 테이블을 npz 파일로 저장하는 메서드
+        여러 프로세스가 동시에 저장해도 깨지지 않도록 임시 파일에 쓴 뒤 교체합니다.
+        """
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        arrays = {
+            "meta": np.array(json.dumps(self._manifest_meta())),
+            "path_buffer": self._image_paths.buffer,
+            "path_offsets": self._image_paths.offsets,
+            "profile_buffer": self._profile_names.buffer,
+            "profile_offsets": self._profile_names.offsets,
+            "mask": self._mask_labels,
+            "gender": self._gender_labels,
+            "age": self._age_labels,
+        }
+        if self._profile_ids is not None:
+            arrays["profile_ids"] = self._profile_ids
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def load_manifest(self, path) -> bool:
+        """
+        npz 파일로 저장된 샘플 테이블을 불러오는 메서드
+
+        Returns:
+            bool: 불러왔으면 True. 파일이 없거나 현재 설정과 다르면 False
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as content:
+            if json.loads(str(content["meta"])) != self._manifest_meta():
+                print(f"[Warning] {path} does not match current dataset settings, rebuilding manifest")
+                return False
+            self._image_paths = PackedStrings.from_arrays(content["path_buffer"], content["path_offsets"])
+            self._profile_names = PackedStrings.from_arrays(content["profile_buffer"], content["profile_offsets"])
+            self._profile_ids = content["profile_ids"] if "profile_ids" in content.files else None
+            self._mask_labels = content["mask"]
+            self._gender_labels = content["gender"]
+            self._age_labels = content["age"]
+        self._multi_class_labels = self.encode_multi_class(
+            self._mask_labels, self._gender_labels, self._age_labels
+        ).astype(np.uint8)
+        return True
+
+    def _iter_samples(self, profiles):
+        """
+        프로필 폴더들을 순회하면서
+        (프로필 이름, 이미지 경로, 마스크 라벨, 성별 라벨, 나이 라벨)을 생성하는 메서드
+        라벨링 오류 데이터의 성별 수정과 주의 데이터 제외도 여기서 처리합니다.
+        """
         for profile in profiles:
             if profile.startswith("."):  # "." 로 시작하는 파일은 무시합니다
                 continue
 
+            id, gender, race, age = profile.split("_")
+
+            if id in self.error_labels:  # 라벨링 오류 데이터 gender 수정
+                gender = 'female' if gender == 'male' else 'male'
+
+            if not self.use_caution and id in self.caution_labels:  # 주의 데이터 사용 여부
+                continue
+
+            gender_label = GenderLabels.from_str(gender)
+            age_label = AgeLabels.from_number(age)
+
             img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
+            for file_name in sorted(os.listdir(img_folder)):
                 _file_name, ext = os.path.splitext(file_name)
                 if (
                     _file_name not in self._file_names
@@ -125,21 +365,7 @@ class MaskBaseDataset(Dataset):
                 )  # (resized_data, 000004_male_Asian_54, mask1.jpg)
                 mask_label = self._file_names[_file_name]
 
-                id, gender, race, age = profile.split("_")
-                
-                if id in self.error_labels:  # 라벨링 오류 데이터 gender 수정
-                    gender = 'female' if gender == 'male' else 'male'
-
-                if not self.use_caution and id in self.caution_labels:  # 주의 데이터 사용 여부
-                    continue
-
-                gender_label = GenderLabels.from_str(gender)
-                age_label = AgeLabels.from_number(age)
-
-                self.image_paths.append(img_path)
-                self.mask_labels.append(mask_label)
-                self.gender_labels.append(gender_label)
-                self.age_labels.append(age_label)
+                yield profile, img_path, mask_label, gender_label, age_label
 
     def calc_statistics(self):
         """데이터셋의 통계치를 계산하는 메서드"""
@@ -167,14 +393,20 @@ class MaskBaseDataset(Dataset):
 
     def __getitem__(self, index):
         """인덱스에 해당하는 데이터를 가져오는 메서드"""
-        assert self.transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
+        return self.get_item(index, self.transform)
+
+    def get_item(self, index, transform):
+        """인덱스에 해당하는 데이터를 주어진 transform 으로 변환해서 가져오는 메서드"""
+        assert transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
 
-        image = self.read_image(index)
         mask_label = self.get_mask_label(index)
         gender_label = self.get_gender_label(index)
         age_label = self.get_age_label(index)
-        image_transform = self.transform(image)
-        multi_class_label = self.encode_multi_class(mask_label, gender_label, age_label)
+        if hasattr(transform, "apply"):  # CachedPipeline: 캐시에 없을 때만 이미지를 읽는다
+            image_transform = transform.apply(index, self.read_image)
+        else:
+            image_transform = transform(self.read_image(index))
+        multi_class_label = self.get_multi_class_label(index)
 
         if self.multi_head:
             return image_transform, multi_class_label, mask_label, gender_label, age_label
@@ -184,25 +416,41 @@ class MaskBaseDataset(Dataset):
 
     def __len__(self):
         """데이터셋의 길이를 반환하는 메서드"""
-        return len(self.image_paths)
+        return len(self._mask_labels)
 
     def get_mask_label(self, index) -> MaskLabels:
         """인덱스에 해당하는 마스크 라벨을 반환하는 메서드"""
-        return self.mask_labels[index]
+        return MaskLabels(int(self._mask_labels[index]))
 
     def get_gender_label(self, index) -> GenderLabels:
         """인덱스에 해당하는 성별 라벨을 반환하는 메서드"""
-        return self.gender_labels[index]
+        return GenderLabels(int(self._gender_labels[index]))
 
     def get_age_label(self, index) -> AgeLabels:
         """인덱스에 해당하는 나이 라벨을 반환하는 메서드"""
-        return self.age_labels[index]
+        return AgeLabels(int(self._age_labels[index]))
+
+    def get_multi_class_label(self, index) -> int:
+        """인덱스에 해당하는 (미리 인코딩된) 다중 클래스 라벨을 반환하는 메서드"""
+        return int(self._multi_class_labels[index])
 
     def read_image(self, index):
         """인덱스에 해당하는 이미지를 읽는 메서드"""
+        if self.image_cache is not None:
+            return Image.fromarray(self.image_cache[index])
+        if self.shared_cache is not None:
+            return self.shared_cache.load(index, self.open_image)
+        return self.open_image(index)
+
+    def open_image(self, index):
+        """인덱스에 해당하는 이미지 파일을 여는 메서드"""
         image_path = self.image_paths[index]
         return Image.open(image_path)
 
+    def set_shared_cache(self, shared_cache):
+        """DataLoader worker 들이 함께 쓰는 `SharedImageCache` 를 설정하는 메서드"""
+        self.shared_cache = shared_cache
+
     @staticmethod
     def encode_multi_class(mask_label, gender_label, age_label) -> int:
         """다중 라벨을 하나의 클래스로 인코딩하는 메서드"""
@@ -228,6 +476,10 @@ class MaskBaseDataset(Dataset):
         img_cp = np.clip(img_cp, 0, 255).astype(np.uint8)
         return img_cp
 
+    def subset(self, indices, transform=None) -> "TransformSubset":
+        """주어진 인덱스의 샘플만 `transform` 으로 변환하는 Subset 을 반환하는 메서드"""
+        return TransformSubset(self, indices, transform)
+
     def split_dataset(self) -> Tuple[Subset, Subset]:
         """데이터셋을 학습과 검증용으로 나누는 메서드
         데이터셋을 train 과 val 로 나눕니다,
@@ -235,10 +487,40 @@ class MaskBaseDataset(Dataset):
         """
         n_val = int(len(self) * self.val_ratio)
         n_train = len(self) - n_val
-        train_set, val_set = random_split(self, [n_train, n_val])
+        generator = torch.Generator().manual_seed(self.seed) if self.seed is not None else None
+        train_set, val_set = random_split(self, [n_train, n_val], generator=generator)
         return train_set, val_set
 
 
+class TransformSubset(Subset):
+    """
+    dataset 의 transform 대신 자신의 transform 을 적용하는 Subset 클래스
+    같은 dataset 에서 나온 train / val Subset 이 서로 다른 transform 을 쓸 수 있습니다.
+    transform 이 None 이면 dataset 의 transform 을 그대로 사용합니다.
+    """
+
+    def __init__(self, dataset, indices, transform=None):
+        super().__init__(dataset, indices)
+        self.transform = transform
+
+    def set_transform(self, transform):
+        """변환(transform)을 설정하는 메서드"""
+        self.transform = transform
+
+    def __getitem__(self, idx):
+        """인덱스에 해당하는 데이터를 가져오는 메서드"""
+        transform = self.transform if self.transform is not None else self.dataset.transform
+        return self.dataset.get_item(self.indices[idx], transform)
+
+    def __getitems__(self, indices):
+        """
+        DataLoader 가 batch 단위로 호출하는 메서드
+        `Subset.__getitems__` 는 dataset 의 `__getitem__` 을 직접 호출해서
+        이 클래스의 transform 을 건너뛰므로 재정의합니다.
+        """
+        return [self[idx] for idx in indices]
+
+
 class TestDataset(Dataset):
     """테스트 데이터셋 클래스"""
 
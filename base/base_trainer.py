@@ -1,5 +1,12 @@
+import copy
+import time
 from abc import abstractmethod
 
+from numpy import inf
+
+from utils import any_process, is_main_process, unwrap_model
+
+
 class BaseTrainer:
     """
     Base class for all trainers
@@ -13,7 +20,41 @@ class BaseTrainer:
 
         self.start_epoch = 1
         self.checkpoint_dir = self.config.model_dir
+        self.is_main = is_main_process()
+
+        # configuration to monitor model performance and save best
+        self.monitor = getattr(self.config, "monitor", "off")
+        if self.monitor == "off":
+            self.mnt_mode = "off"
+            self.mnt_best = 0
+        else:
+            self.mnt_mode, self.mnt_metric = self.monitor.split()
+            assert self.mnt_mode in ["min", "max"]
+            self.mnt_best = inf if self.mnt_mode == "min" else -inf
+
+        # early stopping and training budget
+        self.early_stop = getattr(self.config, "early_stop", 0) or inf
+        self.min_delta = getattr(self.config, "min_delta", 0.0)
+        self.time_budget = getattr(self.config, "time_budget", None)
+        self.sample_budget = getattr(self.config, "sample_budget", None)
+        self.restore_best = getattr(self.config, "restore_best", False)
+        self.samples_seen = 0
+        self.epoch_samples = {}  # epoch -> samples seen at its end
+        self.best_state = None
+        self.not_improved_count = 0
+
+        # BackgroundValidator validating weight snapshots in another process (set by the trainer), or None
+        self.validator = None
 
+        # first epoch at which the monitored metric reaches config.target (to compare samplers / schedules)
+        self.target = getattr(self.config, "target", None)
+        self.epochs_to_target = None
+        self.samples_to_target = None
+
+        # log dicts of the best monitored epoch and the last epoch, kept for the results summary
+        self.best_log = None
+        self.last_log = None
+        self.epochs_run = 0
 
     @abstractmethod
     def _train_epoch(self, epoch):
@@ -21,14 +62,178 @@ class BaseTrainer:
         Training logic for an epoch
 
         :param epoch: Current epoch number
+        :return: A log dict that contains the validation metrics of the epoch
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _save_checkpoint(self, epoch, save_best=False, state_dict=None):
+        """
+        Saving checkpoints
+
+        :param epoch: current epoch number
+        :param save_best: if True, also save the checkpoint as the best model
+        :param state_dict: weights of the epoch if they are no longer the model's (background validation)
         """
         raise NotImplementedError
 
+    def _update_monitor(self, log):
+        """
+        Check whether the monitored metric of this epoch improved, and update the best value
+
+        :param log: A log dict returned from _train_epoch
+        :return: True if the model performance improved
+        """
+        if self.mnt_mode == "off":
+            return False
+
+        try:
+            value = log[self.mnt_metric]
+        except KeyError:
+            print(f"Warning: Metric '{self.mnt_metric}' is not found. "
+                  "Model performance monitoring is disabled.")
+            self.mnt_mode = "off"
+            return False
+
+        improved = (self.mnt_mode == "min" and value < self.mnt_best - self.min_delta) or \
+                   (self.mnt_mode == "max" and value > self.mnt_best + self.min_delta)
+        if improved:
+            self.mnt_best = value
+        return improved
+
+    def _check_target(self, epoch, log):
+        """
+        Record the epoch (counted from start_epoch) and samples seen when the monitored metric first reaches the target
+
+        :param epoch: the epoch that just finished
+        :param log: A log dict returned from _train_epoch
+        """
+        if self.target is None or self.epochs_to_target is not None or self.mnt_mode == "off":
+            return
+        value = log.get(self.mnt_metric)
+        if value is None:
+            return
+        if (self.mnt_mode == "min" and value <= self.target) or (self.mnt_mode == "max" and value >= self.target):
+            self.epochs_to_target = epoch - self.start_epoch + 1
+            self.samples_to_target = self.epoch_samples.get(epoch, self.samples_seen)
+            if self.is_main:
+                print(f"Target {self.mnt_metric} {self.target} reached after {self.epochs_to_target} epochs "
+                      f"({self.samples_to_target} samples).")
+
+    def _budget_exhausted(self, epoch, elapsed):
+        """
+        Check the optional wall-clock / sample budget before starting the next epoch
+
+        :param epoch: the epoch that just finished
+        :param elapsed: seconds spent since training started
+        :return: True if the next epoch should not be started
+        """
+        if self.sample_budget is not None and self.samples_seen >= self.sample_budget:
+            if self.is_main:
+                print(f"Sample budget ({self.sample_budget}) is used up after {self.samples_seen} samples. "
+                      "Training stops.")
+            return True
+        if self.time_budget is not None:
+            epoch_time = elapsed / (epoch - self.start_epoch + 1)
+            # ranks may measure different times, so every rank stops if any of them would exceed the budget
+            if any_process(elapsed + epoch_time > self.time_budget):
+                if self.is_main:
+                    print(f"Time budget ({self.time_budget:.0f}s) would be exceeded by the next epoch "
+                          f"({elapsed:.0f}s elapsed, ~{epoch_time:.0f}s/epoch). Training stops.")
+                return True
+        return False
+
+    def _restore_best_weights(self):
+        """
+        Load the weights of the best monitored epoch back into the model
+        """
+        unwrap_model(self.model).load_state_dict(self.best_state)
+        if self.is_main:
+            print(f"Restored the best model weights ({self.mnt_metric} : {self.mnt_best:4.4}).")
+
+    def _end_epoch(self, epoch, log, state_dict=None):
+        """
+        Monitor, checkpoint and early-stopping bookkeeping of a finished (and validated) epoch
+
+        :param epoch: the finished epoch
+        :param log: A log dict returned from _train_epoch, with the validation metrics
+        :param state_dict: weights of the epoch if they are no longer the model's (background validation)
+        :return: True if training should stop early
+        """
+        best = self._update_monitor(log)
+        self._check_target(epoch, log)
+        self._save_checkpoint(epoch, save_best=best, state_dict=state_dict)
+
+        self.epochs_run = epoch - self.start_epoch + 1
+        self.last_log = dict(log, epoch=epoch)
+        if best or self.mnt_mode == "off":
+            self.best_log = self.last_log
+
+        if best and self.restore_best:
+            if state_dict is None:
+                state_dict = unwrap_model(self.model).state_dict()
+            self.best_state = copy.deepcopy(state_dict)
+
+        if self.mnt_mode != "off":
+            self.not_improved_count = 0 if best else self.not_improved_count + 1
+            if self.not_improved_count >= self.early_stop:
+                if self.is_main and self.not_improved_count == self.early_stop:
+                    print(f"Validation performance didn't improve for {self.early_stop} epochs. "
+                          "Training stops.")
+                return True
+        return False
+
     def train(self):
         """
         Full training logic
+
+        With a background validator, each epoch's weights are validated in another process while the next epoch
+        trains, and the results drive checkpoints, early stopping and logging in epoch order as they arrive.
         """
+        self.not_improved_count = 0
+        start_time = time.time()
+
+        try:
+            for epoch in range(self.start_epoch, self.config.epochs + 1):
+                log = self._train_epoch(epoch)
+                self.epoch_samples[epoch] = self.samples_seen
+                if self.validator is None:
+                    stop = self._end_epoch(epoch, log)
+                else:
+                    self.validator.submit(epoch, log, self.model)
+                    # every finished result is handled even if an earlier one stops training
+                    stop = False
+                    for result in self.validator.collect():
+                        stop = self._end_epoch(*result) or stop
 
-        for epoch in range(self.start_epoch, self.config.epochs + 1):
-            self._train_epoch(epoch)
+                if stop or self._budget_exhausted(epoch, time.time() - start_time):
+                    break
 
+            if self.validator is not None:
+                # the epochs trained after an early stop are still validated, logged and checkpointed
+                for result in self.validator.collect(block=True):
+                    self._end_epoch(*result)
+        finally:
+            if self.validator is not None:
+                self.validator.close()
+
+        if self.best_state is not None:
+            self._restore_best_weights()
+
+    def results(self):
+        """
+        Summary of a finished training run
+
+        :return: A dict with the monitored metric, the log of the best and of the last epoch,
+            the number of epochs run, the training samples seen and the epochs / samples needed to reach the target
+        """
+        return {
+            "monitor": self.monitor,
+            "best": self.best_log,
+            "last": self.last_log,
+            "epochs_run": self.epochs_run,
+            "samples_seen": self.samples_seen,
+            "target": self.target,
+            "epochs_to_target": self.epochs_to_target,
+            "samples_to_target": self.samples_to_target,
+        }
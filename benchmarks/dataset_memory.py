@@ -0,0 +1,138 @@
+"""
+샘플 테이블 저장 방식에 따른 DataLoader worker 메모리 사용량 비교
+
+fork 된 worker 가 한 epoch 동안 모든 샘플의 경로와 라벨을 읽었을 때
+worker 마다 새로 복사된(private dirty) 메모리를 /proc/self/smaps_rollup 으로 측정합니다.
+
+예시:
+    python -m benchmarks.dataset_memory --data_dir /data/ephemeral/maskdata/train/images --num_workers 8
+"""
+import argparse
+import gc
+
+import numpy as np
+from torch.utils.data import DataLoader, Dataset
+
+import data_loader.data_sets as module_data_set
+from base.base_data_set import AgeLabels, GenderLabels, MaskLabels
+
+
+def read_smaps_rollup():
+    """현재 프로세스의 Pss / Private_Dirty (kB) 를 읽는다."""
+    values = {}
+    with open("/proc/self/smaps_rollup", "r") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Pss", "Private_Dirty"):
+                values[key] = int(rest.split()[0])
+    return values
+
+
+def repeat_samples(dataset, repeat):
+    """작은 데이터셋으로도 측정할 수 있도록 경로가 서로 다른 샘플을 repeat 배 만든다."""
+    image_paths = [f"{path}?{r}" for r in range(repeat) for path in dataset.image_paths]
+    labels = [np.tile(column, repeat) for column in (dataset.mask_labels, dataset.gender_labels, dataset.age_labels)]
+    return image_paths, labels
+
+
+class ListTable:
+    """기존처럼 Python 리스트(str, IntEnum)로 샘플 테이블을 들고 있는 비교용 클래스"""
+
+    def __init__(self, dataset, image_paths, labels):
+        mask_labels, gender_labels, age_labels = labels
+        self.image_paths = list(image_paths)
+        self.mask_labels = [MaskLabels(int(v)) for v in mask_labels]
+        self.gender_labels = [GenderLabels(int(v)) for v in gender_labels]
+        self.age_labels = [AgeLabels(int(v)) for v in age_labels]
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def touch(self, index):
+        return (
+            len(self.image_paths[index])
+            + self.mask_labels[index] * 6 + self.gender_labels[index] * 3 + self.age_labels[index]
+        )
+
+
+class ArrayTable:
+    """MaskBaseDataset 의 numpy 기반 샘플 테이블을 그대로 사용하는 클래스"""
+
+    def __init__(self, dataset, image_paths, labels):
+        dataset.set_samples(image_paths, *labels)
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def touch(self, index):
+        return len(self.dataset.image_paths[index]) + self.dataset.get_multi_class_label(index)
+
+
+class TouchAllDataset(Dataset):
+    """worker 하나당 아이템 하나: 테이블 전체를 한 번 읽은 뒤 메모리 사용량을 반환한다."""
+
+    def __init__(self, table, num_workers):
+        self.table = table
+        self.num_workers = num_workers
+
+    def __len__(self):
+        return self.num_workers
+
+    def __getitem__(self, index):
+        gc.collect()
+        before = read_smaps_rollup()
+        checksum = 0
+        for i in range(len(self.table)):
+            checksum += self.table.touch(i)
+        after = read_smaps_rollup()
+        return after["Private_Dirty"] - before["Private_Dirty"], after["Pss"]
+
+
+def measure(table, num_workers):
+    loader = DataLoader(
+        TouchAllDataset(table, num_workers),
+        batch_size=None,
+        num_workers=num_workers,
+        shuffle=False,
+    )
+    results = list(loader)
+    copied = np.array([int(r[0]) for r in results])
+    pss = np.array([int(r[1]) for r in results])
+    return copied, pss
+
+
+def main(config):
+    dataset_module = getattr(module_data_set, config.dataset)
+    dataset = dataset_module(data_dir=config.data_dir, multi_head=True, use_caution=True)
+    image_paths, labels = repeat_samples(dataset, config.repeat)
+    print(f"samples: {len(image_paths)} (repeat x{config.repeat}), workers: {config.num_workers}")
+
+    for name, table_cls in (("list", ListTable), ("array", ArrayTable)):
+        table = table_cls(dataset, image_paths, labels)
+        gc.collect()
+        copied, pss = measure(table, config.num_workers)
+        print(
+            f"[{name:5}] copied per worker: {copied.mean() / 1024:8.2f} MiB "
+            f"(total {copied.sum() / 1024:8.2f} MiB) || mean worker PSS: {pss.mean() / 1024:8.2f} MiB"
+        )
+        del table
+
+    print(f"array sample table size: {dataset.nbytes / 2**20:.2f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="/data/ephemeral/maskdata/train/images")
+    parser.add_argument("--dataset", type=str, default="MaskSplitByProfileDataset")
+    parser.add_argument("--num_workers", type=int, default=8)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="샘플 테이블을 반복해서 크기를 키움 (작은 데이터로 측정할 때)",
+    )
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
@@ -0,0 +1,119 @@
+"""
+teacher 와 distillation 으로 학습한 student 들의 CPU 추론 latency / 정확도 비교
+
+같은 검증 fold 에서 각 모델의 acc / f1 / head 별 f1 과 teacher 예측과의 일치율을 계산하고,
+batch 1 과 batch N 의 CPU forward latency (중앙값) 와 파라미터 수를 표로 보여줍니다.
+
+예시:
+    python -m benchmarks.distillation --data_dir /data/ephemeral/maskdata/train/images \\
+        --teacher EfficientNetB0MultiHead:model/exp/best.pth \\
+        --student SlimCNNMultiHead:model/exp2/best.pth MobileNetV3MultiHead:model/exp3/best.pth
+"""
+import argparse
+import statistics
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+import model.metric as module_metric
+from model.weights import load_trained_model
+from utils.registry import AUGMENTATIONS, DATASETS, MODELS
+
+
+def parse_model(value):
+    name, _, path = value.partition(":")
+    if not path:
+        raise argparse.ArgumentTypeError(f"expected <model>:<checkpoint path>, got {value}")
+    return name, path
+
+
+def measure_latency(model, batch_size, resize, repeat, warmup=3):
+    """median seconds of one forward of a random (batch_size, 3, H, W) batch"""
+    inputs = torch.randn(batch_size, 3, *resize)
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + repeat):
+            start = time.perf_counter()
+            model(inputs)
+            if i >= warmup:
+                times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def evaluate(model, loader):
+    metrics = module_metric.MultiTaskMetrics(num_classes=18, topk=(3,))
+    predictions = []
+    with torch.no_grad():
+        for inputs, labels, *_ in loader:
+            predictions.append(metrics.update(model(inputs), labels))
+    return module_metric.scalar_metrics(metrics.compute()), torch.cat(predictions)
+
+
+def main(config):
+    torch.set_num_threads(config.threads)
+    dataset = DATASETS.get(config.dataset)(
+        data_dir=config.data_dir,
+        multi_head=True,
+        use_caution=True,
+        val_ratio=config.val_ratio,
+        fold=config.fold,
+        seed=config.seed,
+        manifest=config.manifest,
+    )
+    transform = AUGMENTATIONS.get(config.augmentation)(resize=config.resize, mean=dataset.mean, std=dataset.std)
+    _, valid_set = dataset.split_dataset()
+    loader = DataLoader(
+        dataset.subset(valid_set.indices, transform.val_pipeline()),
+        batch_size=config.batch_size,
+        num_workers=config.num_workers,
+    )
+
+    rows = []
+    teacher_preds = None
+    for role, (name, path) in [("teacher", config.teacher)] + [("student", student) for student in config.student]:
+        model = load_trained_model(MODELS.get(name), path, num_classes=18)
+        log, preds = evaluate(model, loader)
+        if teacher_preds is None:
+            teacher_preds = preds
+        rows.append({
+            "model": f"{role}:{name}",
+            "params(M)": sum(p.numel() for p in model.parameters()) / 1e6,
+            "acc": log["acc"],
+            "f1": log["f1"],
+            "mask_f1": log["mask_f1"],
+            "gender_f1": log["gender_f1"],
+            "age_f1": log["age_f1"],
+            "agree": (preds == teacher_preds).float().mean().item(),
+            "ms@1": measure_latency(model, 1, config.resize, config.repeat) * 1e3,
+            f"ms@{config.batch_size}": measure_latency(model, config.batch_size, config.resize, config.repeat) * 1e3,
+        })
+
+    columns = list(rows[0])
+    table = [columns] + [[f"{row[c]:.4g}" if isinstance(row[c], float) else row[c] for c in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    print(f"{len(loader.dataset)} validation samples, resize {config.resize}, {config.threads} threads")
+    for line in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="latency / accuracy of a teacher and its distilled students")
+    parser.add_argument("--data_dir", type=str, required=True)
+    parser.add_argument("--teacher", type=parse_model, required=True, help="<model>:<checkpoint path>")
+    parser.add_argument("--student", type=parse_model, nargs="+", required=True, help="<model>:<checkpoint path>")
+    parser.add_argument("--dataset", type=str, default="MaskSplitByProfileDataset")
+    parser.add_argument("--augmentation", type=str, default="BaseAugmentation")
+    parser.add_argument("--manifest", type=str, default=None)
+    parser.add_argument("--resize", nargs=2, type=int, default=[128, 96])
+    parser.add_argument("--val_ratio", type=float, default=0.2)
+    parser.add_argument("--fold", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--num_workers", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=1, help="torch CPU threads for the latency measurement")
+    parser.add_argument("--repeat", type=int, default=20, help="timed forwards per measurement")
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
@@ -0,0 +1,79 @@
+"""
+train.py / inference.py 의 cold start 시간 측정
+
+각 명령을 새 python 프로세스로 여러 번 실행해서 wall time 의 최솟값과 중앙값을 보고,
+`python -X importtime` 으로 가장 오래 걸린 top-level import 들을 보여줍니다.
+torch import 자체의 시간을 기준선으로 함께 측정하므로
+그 차이가 우리 코드가 더한 시작 비용입니다.
+
+예시:
+    python -m benchmarks.importtime --repeat 5 --top 10
+    python -m benchmarks.importtime --output importtime.jsonl  # 결과를 한 줄씩 추가해서 변화를 추적
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "torch": ["-c", "import torch"],
+    "train --help": ["train.py", "--help"],
+    "inference --help": ["inference.py", "--help"],
+    "model lookup": ["-c", "from utils.registry import MODELS; MODELS.get('EfficientNetB0MultiHead')"],
+}
+
+
+def run(args, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + args
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{process.stderr}")
+    return elapsed, process.stderr
+
+
+def top_level_imports(stderr, top):
+    """-X importtime 출력에서 top-level import 의 누적 시간(초)을 큰 순서로 반환한다."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith(" ") and not name.startswith("  "):
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda item: -item[1])[:top]
+
+
+def main(config):
+    names = config.commands or list(COMMANDS)
+    results = {}
+    for name in names:
+        run(COMMANDS[name])  # 파일 시스템 캐시를 데우기 위한 한 번
+        times = [run(COMMANDS[name])[0] for _ in range(config.repeat)]
+        results[name] = {"min": min(times), "median": statistics.median(times)}
+        print(f"{name:20} min {min(times):6.2f} s, median {statistics.median(times):6.2f} s ({config.repeat} runs)")
+        if config.top > 0:
+            _, stderr = run(COMMANDS[name], importtime=True)
+            for module, seconds in top_level_imports(stderr, config.top):
+                print(f"    {module:40} {seconds:6.3f} s")
+
+    if config.output is not None:
+        with open(config.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="cold start latency of the train.py / inference.py CLIs")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command (default: 5)")
+    parser.add_argument("--top", type=int, default=8, help="slowest top-level imports to show, 0 disables (default: 8)")
+    parser.add_argument(
+        "--commands", nargs="+", default=None, choices=list(COMMANDS), help="commands to measure (default: all)"
+    )
+    parser.add_argument("--output", type=str, default=None, help="jsonl file the results are appended to")
+    main(parser.parse_args())
@@ -0,0 +1,211 @@
+"""
+fused 손실 함수 (model.loss) 와 이전 구현의 값 / gradient 일치 확인과
+step 당 할당 횟수, 속도 비교
+
+이전 구현은 아래 Reference* 클래스로 그대로 옮겨 두었습니다.
+각 손실에 대해 여러 batch / 클래스 수, weight, smoothing 설정에서
+loss 값과 logit gradient 가 허용 오차 안에서 같은지 확인하고 (다르면 종료 코드 1),
+forward + backward 한 step 에서 새로 할당된 Tensor 수와 바이트 수 (ATen 연산의 출력 기준),
+중앙값 시간을 보여줍니다.
+batch 가 model.loss._FUSED_MIN_BATCH 보다 작으면 세 손실 모두 같은 식
+(정답 클래스 항 gather, closed form smoothing, one-hot 없는 F1) 을 autograd 로 계산하므로
+"fused" 열도 그 경로의 결과입니다.
+
+예시:
+    python -m benchmarks.losses --batch_size 64 --classes 3 18
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+from model.loss import F1Loss, FocalLoss, LabelSmoothingLoss
+
+
+class ReferenceFocalLoss(nn.Module):
+    """이전 FocalLoss: (N, C) log_softmax, exp, (1 - p) ^ gamma * log p 를 모두 만든 뒤 nll_loss"""
+
+    def __init__(self, weight=None, gamma=2.0, reduction="mean"):
+        nn.Module.__init__(self)
+        self.weight = weight
+        self.gamma = gamma
+        self.reduction = reduction
+
+    def forward(self, input_tensor, target_tensor):
+        log_prob = F.log_softmax(input_tensor, dim=-1)
+        prob = torch.exp(log_prob)
+        return F.nll_loss(
+            ((1 - prob) ** self.gamma) * log_prob,
+            target_tensor,
+            weight=self.weight,
+            reduction=self.reduction,
+        )
+
+
+class ReferenceLabelSmoothingLoss(nn.Module):
+    """이전 LabelSmoothingLoss: 매 호출마다 dense 한 target 분포를 만들어 scatter"""
+
+    def __init__(self, classes=3, smoothing=0.0, dim=-1):
+        super().__init__()
+        self.confidence = 1.0 - smoothing
+        self.smoothing = smoothing
+        self.cls = classes
+        self.dim = dim
+
+    def forward(self, pred, target):
+        pred = pred.log_softmax(dim=self.dim)
+        with torch.no_grad():
+            true_dist = torch.zeros_like(pred)
+            true_dist.fill_(self.smoothing / (self.cls - 1))
+            true_dist.scatter_(1, target.data.unsqueeze(1), self.confidence)
+        return torch.mean(torch.sum(-true_dist * pred, dim=self.dim))
+
+
+class ReferenceF1Loss(nn.Module):
+    """이전 F1Loss: float one-hot 과 (N, C) 크기의 곱 네 개"""
+
+    def __init__(self, classes=3, epsilon=1e-7):
+        super().__init__()
+        self.epsilon = epsilon
+
+    def forward(self, y_pred, y_true):
+        classes = y_pred.size(-1)
+        y_true = F.one_hot(y_true, classes).to(torch.float32)
+        y_pred = F.softmax(y_pred, dim=1)
+
+        tp = (y_true * y_pred).sum(dim=0).to(torch.float32)
+        tn = ((1 - y_true) * (1 - y_pred)).sum(dim=0).to(torch.float32)  # noqa: F841 (이전 구현 그대로)
+        fp = ((1 - y_true) * y_pred).sum(dim=0).to(torch.float32)
+        fn = (y_true * (1 - y_pred)).sum(dim=0).to(torch.float32)
+
+        precision = tp / (tp + fp + self.epsilon)
+        recall = tp / (tp + fn + self.epsilon)
+
+        f1 = 2 * (precision * recall) / (precision + recall + self.epsilon)
+        f1 = f1.clamp(min=self.epsilon, max=1 - self.epsilon)
+        return 1 - f1.mean()
+
+
+class AllocationCounter(TorchDispatchMode):
+    """
+    ATen 연산이 입력과 storage 를 공유하지 않는 출력 Tensor 를 만들 때마다
+    횟수와 바이트 수를 센다.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.nbytes = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        inputs = {
+            arg.untyped_storage().data_ptr() for arg in tree_flatten((args, kwargs))[0] if isinstance(arg, torch.Tensor)
+        }
+        out = func(*args, **kwargs)
+        for tensor in tree_flatten(out)[0]:
+            if isinstance(tensor, torch.Tensor) and tensor.untyped_storage().data_ptr() not in inputs:
+                self.count += 1
+                self.nbytes += tensor.untyped_storage().nbytes()
+        return out
+
+
+def step(criterion, logits, target):
+    """forward + backward (reduction="none" 이면 샘플 loss 의 합으로)"""
+    loss = criterion(logits, target)
+    loss.backward(torch.ones_like(loss))
+    return loss
+
+
+def loss_and_grad(criterion, logits, target):
+    logits = logits.detach().clone().requires_grad_(True)
+    loss = step(criterion, logits, target)
+    return loss.detach(), logits.grad
+
+
+def count_allocations(criterion, logits, target):
+    """forward + backward 한 step 의 (할당 횟수, 바이트 수)"""
+    logits = logits.detach().clone().requires_grad_(True)
+    with AllocationCounter() as counter:
+        step(criterion, logits, target)
+    return counter.count, counter.nbytes
+
+
+def time_step(criterion, logits, target, repeat, warmup=3):
+    """forward + backward 한 step 의 중앙값 초"""
+    logits = logits.detach().clone().requires_grad_(True)
+    times = []
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        step(criterion, logits, target)
+        if i >= warmup:
+            times.append(time.perf_counter() - start)
+        logits.grad = None
+    return statistics.median(times)
+
+
+def cases(classes):
+    """(이름, 이전 구현, fused 구현) 목록"""
+    weight = torch.linspace(0.5, 2.0, classes)
+    return [
+        ("focal", ReferenceFocalLoss(), FocalLoss()),
+        ("focal gamma=0.5 weight", ReferenceFocalLoss(weight=weight, gamma=0.5), FocalLoss(weight=weight, gamma=0.5)),
+        ("focal sum", ReferenceFocalLoss(reduction="sum"), FocalLoss(reduction="sum")),
+        ("focal none", ReferenceFocalLoss(reduction="none"), FocalLoss(reduction="none")),
+        ("label_smoothing 0.0", ReferenceLabelSmoothingLoss(classes), LabelSmoothingLoss(classes)),
+        ("label_smoothing 0.1", ReferenceLabelSmoothingLoss(classes, 0.1), LabelSmoothingLoss(classes, 0.1)),
+        ("f1", ReferenceF1Loss(classes), F1Loss(classes)),
+    ]
+
+
+def main(config):
+    torch.manual_seed(config.seed)
+    failed = False
+    rows = []
+    for classes in config.classes:
+        for batch_size in config.batch_size:
+            logits = torch.randn(batch_size, classes) * 3
+            target = torch.randint(0, classes, (batch_size,))
+            for name, reference, fused in cases(classes):
+                ref_loss, ref_grad = loss_and_grad(reference, logits, target)
+                loss, grad = loss_and_grad(fused, logits, target)
+                loss_error = (loss - ref_loss).abs().max().item()
+                grad_error = (grad - ref_grad).abs().max().item()
+                ok = torch.allclose(loss, ref_loss, rtol=1e-5, atol=1e-6) and \
+                    torch.allclose(grad, ref_grad, rtol=1e-4, atol=1e-6)
+                failed = failed or not ok
+                row = [f"{name} N={batch_size} C={classes}", "ok" if ok else "MISMATCH",
+                       f"{loss_error:.1e}", f"{grad_error:.1e}"]
+                for criterion in (reference, fused):
+                    count, nbytes = count_allocations(criterion, logits, target)
+                    row += [str(count), f"{nbytes / 1024:.1f}",
+                            f"{time_step(criterion, logits, target, config.repeat) * 1e6:.0f}"]
+                rows.append(row)
+
+    header = ["loss", "parity", "|dloss|", "|dgrad|",
+              "ref allocs", "ref KiB", "ref us", "fused allocs", "fused KiB", "fused us"]
+    widths = [max(len(line[i]) for line in rows + [header]) for i in range(len(header))]
+    print(f"{torch.get_num_threads()} threads, forward + backward per step")
+    for line in [header] + rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+    if failed:
+        print("parity check failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, nargs="+", default=[64, 1024])
+    parser.add_argument("--classes", type=int, nargs="+", default=[3, 18])
+    parser.add_argument("--repeat", type=int, default=50, help="timed steps per measurement")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
@@ -0,0 +1,95 @@
+"""
+MetricTracker 성능 비교: 기존 pandas.DataFrame 기반 구현 vs 배열 기반 구현
+
+예시:
+    python -m benchmarks.metric_tracker --steps 20000
+"""
+import argparse
+import time
+import warnings
+
+import torch
+
+from utils import MetricTracker
+
+
+class PandasMetricTracker:
+    """비교용: 이전 pandas.DataFrame 기반 MetricTracker"""
+
+    def __init__(self, *keys, writer=None):
+        import pandas as pd
+
+        self.writer = writer
+        self._data = pd.DataFrame(index=keys, columns=['total', 'counts', 'average'])
+        self.reset()
+
+    def reset(self):
+        for col in self._data.columns:
+            self._data[col].values[:] = 0
+
+    def update(self, key, value, n=1):
+        if self.writer is not None:
+            self.writer.add_scalar(key, value)
+        self._data.total[key] += value * n
+        self._data.counts[key] += n
+        self._data.average[key] = self._data.total[key] / self._data.counts[key]
+
+    def result(self):
+        return dict(self._data.average)
+
+
+def bench(name, fn, steps):
+    start = time.perf_counter()
+    fn(steps)
+    elapsed = time.perf_counter() - start
+    print(f"{name:32} {elapsed * 1e6 / steps:10.2f} us/step ({steps} steps, {elapsed:.3f} s)")
+
+
+def main(config):
+    keys = ["loss", "acc", "f1"]
+    values = {key: 0.5 for key in keys}
+    tensors = {key: torch.tensor(0.5) for key in keys}
+
+    def pandas_update(steps):
+        tracker = PandasMetricTracker(*keys)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for _ in range(steps):
+                for key, value in values.items():
+                    tracker.update(key, value, n=64)
+        tracker.result()
+
+    def array_update(steps):
+        tracker = MetricTracker(*keys)
+        for _ in range(steps):
+            for key, value in values.items():
+                tracker.update(key, value, n=64)
+        tracker.result()
+
+    def array_update_many(steps):
+        tracker = MetricTracker(*keys)
+        for _ in range(steps):
+            tracker.update_many(values, n=64)
+        tracker.result()
+
+    def device_update_many(steps):
+        tracker = MetricTracker(*keys, device=torch.device(config.device))
+        for _ in range(steps):
+            tracker.update_many(tensors, n=64)
+        tracker.result()
+
+    pandas_steps = max(1, config.steps // 10)
+    bench("pandas (update x3)", pandas_update, pandas_steps)
+    bench("array (update x3)", array_update, config.steps)
+    bench("array (update_many)", array_update_many, config.steps)
+    bench(f"{config.device} tensors (update_many)", device_update_many, config.steps)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=20000)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
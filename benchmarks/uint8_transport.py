@@ -0,0 +1,182 @@
+"""
+float32 과 uint8 batch 전송 비교 (DataLoader worker IPC, host -> device 복사, device 정규화)
+
+1. worker IPC: 미리 만든 float32 / uint8 Tensor 를 worker 가 그대로 돌려주는 DataLoader 로
+   queue 전송량을 잽니다.
+2. pipeline: 같은 이미지에 ToTensor + Normalize 를 worker 에서 하는 경우와,
+   uint8 로 넘기고 `DeviceNormalize` 로 batch 를 한 번에 정규화하는 경우의
+   전체 처리량을 잽니다 (--data_dir 가 없으면 합성 이미지).
+3. copy: batch 를 device 로 옮기는 시간
+   (CUDA 가 없으면 같은 크기의 host 메모리 복사) 과 device 정규화 시간.
+두 경로의 정규화 결과가 같은지도 확인합니다.
+
+예시:
+    python -m benchmarks.uint8_transport --data_dir /data/ephemeral/maskdata/train/images --num_workers 4
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+from data_loader.augmentations import BaseAugmentation, DeviceNormalize
+
+MEAN, STD = (0.548, 0.504, 0.497), (0.237, 0.247, 0.246)
+
+
+class TensorDataset(Dataset):
+    """worker 가 같은 Tensor 의 복사본을 돌려주는 데이터셋 (IPC 비용만 남도록)"""
+
+    def __init__(self, tensor, length):
+        self.tensor = tensor
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.tensor.clone()
+
+
+class ImageDataset(Dataset):
+    """메모리에 올려둔 PIL 이미지에 transform 을 적용하는 데이터셋"""
+
+    def __init__(self, images, transform, length):
+        self.images = images
+        self.transform = transform
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.transform(self.images[index % len(self.images)])
+
+
+def load_images(data_dir, count, size=(512, 384)):
+    if data_dir is None:
+        rng = np.random.default_rng(0)
+        return [Image.fromarray(rng.integers(0, 256, (*size, 3), dtype=np.uint8)) for _ in range(count)]
+    paths = sorted(glob.glob(os.path.join(data_dir, "**", "*.jpg"), recursive=True))[:count]
+    if not paths:
+        raise ValueError(f"no jpg images under {data_dir}")
+    return [Image.open(path).convert("RGB") for path in paths]
+
+
+def time_loader(loader, device, input_transform=None):
+    """(samples/s, bytes/s through the loader) of one pass, including the device transform"""
+    samples, nbytes = 0, 0
+    start = time.perf_counter()
+    for batch in loader:
+        samples += batch.size(0)
+        nbytes += batch.nelement() * batch.element_size()
+        batch = batch.to(device)
+        if input_transform is not None:
+            batch = input_transform(batch)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elapsed = time.perf_counter() - start
+    return samples / elapsed, nbytes / elapsed
+
+
+def time_copy(batch, device, repeat):
+    """median seconds of moving the batch to the device (a host memcpy when the device is the CPU)"""
+    if device.type == "cuda":
+        batch = batch.pin_memory()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if device.type == "cuda":
+            batch.to(device, non_blocking=True)
+            torch.cuda.synchronize(device)
+        else:
+            batch.clone()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def time_normalize(batch, normalize, device, repeat):
+    batch = batch.to(device)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        normalize(batch)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main(config):
+    device = torch.device(config.device)
+    resize = tuple(config.resize)
+    float_aug = BaseAugmentation(resize, MEAN, STD)
+    uint8_aug = BaseAugmentation(resize, MEAN, STD, uint8=True)
+    normalize = DeviceNormalize(MEAN, STD, channels_last=config.channels_last).to(device)
+    images = load_images(config.data_dir, config.images)
+
+    # 두 경로의 정규화 결과 비교
+    reference = torch.stack([float_aug.prefix(image) for image in images[:8]])
+    fused = normalize(torch.stack([uint8_aug.prefix(image) for image in images[:8]]).to(device)).cpu()
+    print(f"parity: max |ToTensor+Normalize - DeviceNormalize| = {(reference - fused).abs().max().item():.2e}")
+
+    float_bytes = reference[0].nelement() * reference[0].element_size()
+    uint8_bytes = float_bytes // 4
+    print(f"bytes per sample: float32 {float_bytes}, uint8 {uint8_bytes}; per batch of {config.batch_size}: "
+          f"float32 {float_bytes * config.batch_size / 2 ** 20:.2f} MiB, "
+          f"uint8 {uint8_bytes * config.batch_size / 2 ** 20:.2f} MiB")
+
+    length = config.batches * config.batch_size
+    loader_options = dict(batch_size=config.batch_size, num_workers=config.num_workers,
+                          persistent_workers=config.num_workers > 0)
+    rows = []
+    for name, sample in (("float32", reference[0]), ("uint8", uint8_aug.prefix(images[0]))):
+        loader = DataLoader(TensorDataset(sample, length), **loader_options)
+        time_loader(loader, device)  # worker 시작 / warmup
+        rate, bandwidth = time_loader(loader, device)
+        rows.append(("ipc", name, rate, bandwidth))
+    for name, transform, input_transform in (
+        ("float32", float_aug.prefix, None),
+        ("uint8", uint8_aug.prefix, normalize),
+    ):
+        loader = DataLoader(ImageDataset(images, transform, length), **loader_options)
+        time_loader(loader, device, input_transform)
+        rate, bandwidth = time_loader(loader, device, input_transform)
+        rows.append(("pipeline", name, rate, bandwidth))
+
+    print(f"\n{config.num_workers} workers, batch {config.batch_size}, resize {list(resize)}, device {device}")
+    print(f"{'stage':10s}{'batch':10s}{'samples/s':>12s}{'MiB/s':>12s}")
+    for stage, name, rate, bandwidth in rows:
+        print(f"{stage:10s}{name:10s}{rate:12.1f}{bandwidth / 2 ** 20:12.1f}")
+
+    float_batch = reference[:1].expand(config.batch_size, -1, -1, -1).contiguous()
+    uint8_batch = uint8_aug.prefix(images[0]).unsqueeze(0).expand(config.batch_size, -1, -1, -1).contiguous()
+    copy_name = "host -> device copy" if device.type == "cuda" else "host memcpy (no CUDA device)"
+    float_copy = time_copy(float_batch, device, config.repeat)
+    uint8_copy = time_copy(uint8_batch, device, config.repeat)
+    print(f"\n{copy_name}: float32 {float_copy * 1e3:.3f} ms "
+          f"({float_batch.nelement() * 4 / float_copy / 2 ** 30:.2f} GiB/s), "
+          f"uint8 {uint8_copy * 1e3:.3f} ms ({uint8_batch.nelement() / uint8_copy / 2 ** 30:.2f} GiB/s)")
+    normalize_time = time_normalize(uint8_batch, normalize, device, config.repeat)
+    print(f"device normalization of a uint8 batch: {normalize_time * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default=None, help="jpg images to load (default: synthetic images)")
+    parser.add_argument("--images", type=int, default=64, help="images kept in memory for the pipeline pass")
+    parser.add_argument("--resize", nargs=2, type=int, default=[128, 96])
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=20, help="batches per timed pass")
+    parser.add_argument("--num_workers", type=int, default=2)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--channels_last", action="store_true")
+    parser.add_argument("--repeat", type=int, default=20, help="timed copies / normalizations")
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
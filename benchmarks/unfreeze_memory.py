@@ -0,0 +1,157 @@
+"""
+EfficientNetB0MultiHead 의 backbone 고정 / 부분 학습 / 전체 학습 방식별
+peak 메모리와 학습 처리량 비교
+
+방식마다 새 프로세스를 띄워서 (peak 메모리가 섞이지 않도록)
+pretrained weight 없이 모델을 만들고,
+학습하는 파라미터만 가진 Adam 으로 forward + backward + step 을 반복합니다.
+    frozen (current)    지금의 기본 방식: backbone 을 train 모드로 통째로 실행, 파라미터만 고정
+    frozen (no_grad)    set_trainable_blocks(0): backbone 을 eval 모드와 torch.no_grad 로 실행
+    last N [+ ckpt]     마지막 N 개 block 학습 (+ activation checkpointing)
+    unfrozen [+ ckpt]   backbone 전체 학습 (+ activation checkpointing)
+backward 를 위해 저장된 activation 크기 (saved_tensors_hooks 기준), 한 step 의 peak 메모리 증가량
+(CUDA 는 max_memory_allocated, CPU 는 첫 step 직전 RSS 대비 ru_maxrss),
+초당 학습 샘플 수를 보여줍니다.
+
+예시:
+    python -m benchmarks.unfreeze_memory --resize 256 192 --batch_size 32 --blocks 2 4
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+import torch
+
+from model.model import EfficientNetB0MultiHead
+
+
+def current_rss():
+    """현재 프로세스의 RSS (bytes)"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def saved_activation_bytes(model, inputs):
+    """
+    forward 한 번에서 backward 를 위해 저장되는 Tensor 의 바이트 수
+    (파라미터 제외, storage 당 한 번)
+    """
+    params = {param.untyped_storage().data_ptr() for param in model.parameters()}
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in params:
+            storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        outs = model(inputs)
+    del outs
+    return sum(storages.values())
+
+
+def train_step(model, optimizer, inputs, targets):
+    optimizer.zero_grad(set_to_none=True)
+    outs = model(inputs)
+    loss = sum(torch.nn.functional.cross_entropy(out, target) for out, target in zip(outs, targets))
+    loss.backward()
+    optimizer.step()
+
+
+def run_mode(name, blocks, grad_checkpointing, config):
+    """
+    새 프로세스에서 한 방식을 측정한다.
+
+    Returns:
+        dict: 학습 파라미터 수, 저장된 activation, peak 메모리 증가량 (bytes), 초당 샘플 수
+    """
+    if config.threads:
+        torch.set_num_threads(config.threads)
+    torch.manual_seed(0)
+    device = torch.device(config.device)
+    model = EfficientNetB0MultiHead(num_classes=18, pretrained=False).to(device)
+    if blocks is not None:
+        model.set_trainable_blocks(blocks)
+        model.set_grad_checkpointing(grad_checkpointing)
+    model.train()
+    trainable = [param for param in model.parameters() if param.requires_grad]
+    optimizer = torch.optim.Adam(trainable, lr=1e-3)
+    inputs = torch.randn(config.batch_size, 3, *config.resize, device=device)
+    targets = [torch.randint(0, classes, (config.batch_size,), device=device) for classes in (3, 2, 3)]
+
+    saved = saved_activation_bytes(model, inputs)
+
+    # 첫 step 에서 Adam 상태가 생기므로 그 전의 메모리를 기준으로 잽니다
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        base = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    else:
+        base = current_rss()
+    for _ in range(config.warmup):
+        train_step(model, optimizer, inputs, targets)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        peak = torch.cuda.max_memory_allocated(device) - base
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+
+    start = time.perf_counter()
+    for _ in range(config.steps):
+        train_step(model, optimizer, inputs, targets)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    rate = config.batch_size * config.steps / (time.perf_counter() - start)
+    return {
+        "name": name,
+        "threads": torch.get_num_threads(),
+        "trainable": sum(param.numel() for param in trainable),
+        "saved": saved,
+        "peak": peak,
+        "rate": rate,
+    }
+
+
+def modes(config):
+    """(이름, set_trainable_blocks 값 (None 이면 현재 방식), checkpointing) 목록"""
+    rows = [("frozen (current)", None, False), ("frozen (no_grad)", 0, False)]
+    for blocks in config.blocks:
+        rows += [(f"last {blocks}", blocks, False), (f"last {blocks} + ckpt", blocks, True)]
+    rows += [("unfrozen", -1, False), ("unfrozen + ckpt", -1, True)]
+    return rows
+
+
+def main(config):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name, blocks, grad_checkpointing in modes(config):
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            results.append(pool.apply(run_mode, (name, blocks, grad_checkpointing, config)))
+        print(f"measured {name}")
+
+    reference = results[0]
+    peak_name = "peak alloc MiB" if config.device.startswith("cuda") else "peak RSS MiB"
+    print(f"\nbatch {config.batch_size}, resize {list(config.resize)}, device {config.device}, "
+          f"{reference['threads']} threads")
+    print(f"{'mode':22s}{'trainable':>12s}{'saved MiB':>12s}{peak_name:>16s}{'samples/s':>12s}{'vs current':>12s}")
+    for row in results:
+        print(f"{row['name']:22s}{row['trainable']:12d}{row['saved'] / 2 ** 20:12.1f}{row['peak'] / 2 ** 20:16.1f}"
+              f"{row['rate']:12.1f}{row['rate'] / reference['rate']:11.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resize", nargs=2, type=int, default=[128, 96])
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--blocks", type=int, nargs="+", default=[2, 4], help="partial unfreeze block counts")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads (default: torch's default)")
+    parser.add_argument("--warmup", type=int, default=2, help="steps before timing (the peak is taken over them)")
+    parser.add_argument("--steps", type=int, default=5, help="timed steps")
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
@@ -0,0 +1,155 @@
+"""
+cascade 추론에 쓸 작은 모델의 head 별 confidence threshold 를
+검증 fold 에서 정하고 효과를 보고합니다.
+
+검증 fold 를 섞어서 절반(--calibration_ratio)으로 threshold 를 정하고, 나머지 절반에서
+작은 모델 / 큰 모델(또는 ensemble) / cascade 의 acc, f1, 큰 모델 예측과의 일치율,
+큰 모델로 넘긴 비율, 처리량(images/s)을 비교합니다.
+cascade 처리량은 실제로 작은 모델을 모든 이미지에,
+큰 모델을 넘긴 이미지에만 실행한 시간입니다.
+threshold 는 `{cascade_path}.thresholds.json` 에 저장되고 inference.py 가 읽습니다.
+
+예시:
+    python calibrate_cascade.py --data_dir /data/ephemeral/maskdata/train/images \\
+        --cascade_path model/exp2/best.pth --model_path model/exp/best.pth --target 0.99
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+import model.metric as module_metric
+from inference import INFERENCE_MEAN, INFERENCE_STD, predict, predict_ensemble
+from model.cascade import CascadeThresholds, decode_labels
+from model.weights import file_sha256, load_trained_model
+from utils.registry import AUGMENTATIONS, DATASETS, MODELS
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def evaluate(logits, labels, reference):
+    metrics = module_metric.MultiTaskMetrics(num_classes=18, topk=(3,))
+    preds = metrics.update(tuple(torch.from_numpy(logits).split([3, 2, 3], dim=-1)), torch.from_numpy(labels))
+    log = module_metric.scalar_metrics(metrics.compute())
+    return {
+        "acc": log["acc"],
+        "f1": log["f1"],
+        "mask_f1": log["mask_f1"],
+        "gender_f1": log["gender_f1"],
+        "age_f1": log["age_f1"],
+        "agree": float((preds.numpy() == reference).mean()),
+    }
+
+
+def main(config):
+    dataset = DATASETS.get(config.dataset)(
+        data_dir=config.data_dir,
+        multi_head=True,
+        use_caution=True,
+        val_ratio=config.val_ratio,
+        n_splits=config.n_splits,
+        fold=config.fold,
+        seed=config.seed,
+        split_file=config.split_file,
+        manifest=config.manifest,
+    )
+    # threshold 가 서빙과 같은 입력에서 정해지도록 inference.py 의 정규화 값을 씁니다
+    transform = AUGMENTATIONS.get(config.augmentation)(resize=config.resize, mean=INFERENCE_MEAN, std=INFERENCE_STD)
+    _, valid_set = dataset.split_dataset()
+    valid_set = dataset.subset(valid_set.indices, transform.val_pipeline())
+    # 디코딩 시간이 처리량에 섞이지 않도록 검증 이미지를 미리 tensor 로 만들어 둡니다
+    images = torch.stack([valid_set[i][0] for i in range(len(valid_set))])
+    labels = np.array([int(valid_set[i][1]) for i in range(len(valid_set))])
+
+    device = torch.device("cpu")
+    cheap_model = load_trained_model(MODELS.get(config.cascade_model), config.cascade_path, num_classes=18)
+    models = [load_trained_model(MODELS.get(config.model), path, num_classes=18) for path in config.model_path]
+
+    def batches(indices):
+        return images[torch.from_numpy(indices)].split(config.batch_size)
+
+    order = np.random.default_rng(config.seed).permutation(len(labels))
+    n_calibration = int(len(order) * config.calibration_ratio)
+    calibration, report = order[:n_calibration], order[n_calibration:]
+
+    _, cheap_logits = predict(cheap_model, batches(calibration), device, True)
+    thresholds = CascadeThresholds.calibrate(
+        cheap_logits,
+        labels[calibration],
+        target=config.target,
+        meta={
+            "cascade_model": config.cascade_model,
+            "cascade_sha256": file_sha256(config.cascade_path),
+            "resize": list(config.resize),
+            "calibration_samples": len(calibration),
+        },
+    )
+
+    # threshold 를 정하지 않은 나머지 검증 샘플에서 비교
+    (_, cheap_logits), cheap_time = timed(predict, cheap_model, batches(report), device, True)
+    (full_preds, full_logits), full_time = timed(predict_ensemble, models, batches(report), device, True)
+    escalated = np.flatnonzero(~thresholds.accept(cheap_logits))
+    cascade_logits = cheap_logits.copy()
+    if len(escalated):
+        (_, cascade_logits[escalated]), escalated_time = timed(
+            predict_ensemble, models, batches(report[escalated]), device, True
+        )
+    else:
+        escalated_time = 0.0
+
+    rows = {
+        f"cheap:{config.cascade_model}": (cheap_logits, cheap_time),
+        f"full:{config.model}x{len(models)}": (full_logits, full_time),
+        "cascade": (cascade_logits, cheap_time + escalated_time),
+    }
+    table = []
+    for name, (logits, elapsed) in rows.items():
+        row = {"model": name, **evaluate(logits, labels[report], full_preds), "images/s": len(report) / elapsed}
+        table.append(row)
+    thresholds.meta.update({"escalated": len(escalated) / len(report), "report_samples": len(report)})
+    thresholds.meta.update({f"cascade_{key}": value for key, value in table[-1].items() if key != "model"})
+    thresholds.save(config.output or f"{config.cascade_path}.thresholds.json")
+
+    print(f"{thresholds} (target precision {config.target}, {len(calibration)} calibration samples)")
+    print(f"{len(report)} report samples, {len(escalated)} escalated ({len(escalated) / len(report):.1%}), "
+          f"cascade prediction differs from full on {(decode_labels(cascade_logits) != full_preds).sum()}")
+    columns = list(table[0])
+    cells = [columns] + [[f"{row[c]:.4g}" if isinstance(row[c], float) else row[c] for c in columns] for row in table]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    for line in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="calibrate cascade confidence thresholds on the validation fold")
+    parser.add_argument("--data_dir", type=str, required=True)
+    parser.add_argument("--cascade_model", type=str, default="SlimCNNMultiHead", help="small model type")
+    parser.add_argument("--cascade_path", type=str, required=True, help="small model checkpoint")
+    parser.add_argument("--model", type=str, default="EfficientNetB0MultiHead", help="full model type")
+    parser.add_argument("--model_path", type=str, nargs="+", required=True, help="full model checkpoint(s)")
+    parser.add_argument("--target", type=float, default=0.99,
+                        help="per-head accuracy required of the accepted small model predictions")
+    parser.add_argument("--calibration_ratio", type=float, default=0.5,
+                        help="share of the validation fold used to pick the thresholds, the rest is reported on")
+    parser.add_argument("--output", type=str, default=None, help="default: {cascade_path}.thresholds.json")
+    parser.add_argument("--dataset", type=str, default="MaskSplitByProfileDataset")
+    parser.add_argument("--augmentation", type=str, default="BaseAugmentation")
+    parser.add_argument("--manifest", type=str, default=None)
+    parser.add_argument("--resize", nargs=2, type=int, default=[128, 96])
+    parser.add_argument("--val_ratio", type=float, default=0.2)
+    parser.add_argument("--n_splits", type=int, default=None,
+                        help="number of profile-level stratified folds (default: round(1 / val_ratio))")
+    parser.add_argument("--fold", type=int, default=0)
+    parser.add_argument("--split_file", type=str, default=None,
+                        help="json fold split saved by train.py --split_file, so the validation fold matches training")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch_size", type=int, default=100)
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
@@ -1,3 +1,5 @@
+import io
+import itertools
 import os
 import random
 from collections import defaultdict
@@ -7,15 +9,21 @@ from typing import Tuple, List
 import numpy as np
 import torch
 from PIL import Image
-from torch.utils.data import Dataset, Subset, random_split
-from base.base_data_set import MaskBaseDataset, GenderLabels, AgeLabels, MaskLabels
+from torch.utils.data import Dataset, IterableDataset, Subset, get_worker_info, random_split
+from base.base_data_set import MaskBaseDataset, GenderLabels, AgeLabels, MaskLabels, TransformSubset
+from data_loader.shards import ShardIndex, iter_shard, shuffle_buffer
+from data_loader.splits import ProfileKFoldSplit
 
 
 class MaskSplitByProfileDataset(MaskBaseDataset):
     """
     train / val 나누는 기준을 이미지에 대해서 random 이 아닌 사람(profile)을 기준으로 나눕니다.
-    구현은 val_ratio 에 맞게 train / val 나누는 것을 이미지 전체가 아닌 사람(profile)에 대해서 진행하여 indexing 을 합니다.
-    이후 `split_dataset` 에서 index 에 맞게 Subset 으로 dataset 을 분기합니다.
+    구현은 프로필의 (성별, 나이) 조합으로 층을 나눈 stratified k-fold 를
+    프로필 단위로 계산하여 indexing 을 합니다.
+    분할은 `split_file` 이 주어지면 seed 와 함께 저장되어 재사용되고,
+    이후 `split_dataset` 에서 fold 에 맞게 Subset 으로 dataset 을 분기합니다.
+    하나의 dataset 객체로 모든 fold 를 만들 수 있으므로
+    fold 실험끼리 디코딩된 이미지 캐시를 공유할 수 있습니다.
     """
 
     error_labels = ['001498-1', '004432', '006359', '006360', '006361', '006362', '006363', '006364']
@@ -30,62 +38,258 @@ class MaskSplitByProfileDataset(MaskBaseDataset):
         mean=(0.548, 0.504, 0.479),
         std=(0.237, 0.247, 0.246),
         val_ratio=0.2,
+        n_splits=None,
+        fold=0,
+        seed=42,
+        split_file=None,
+        **args,
     ):
+        """
+        Args:
+            n_splits (int): fold 개수. None 이면 val_ratio 로부터 계산 (0.2 -> 5)
+            fold (int): 기본으로 검증에 사용할 fold 번호
+            seed (int): 프로필 분할에 사용할 random seed
+            split_file (str): 분할을 저장/재사용할 json 파일 경로. None 이면 저장하지 않음
+        """
+        self.n_splits = n_splits if n_splits is not None else max(2, int(round(1 / val_ratio)))
+        self.fold = fold
+        self.seed = seed
+        self.split_file = split_file
+        self.split = None
         self.indices = defaultdict(list)
-        super().__init__(data_dir, multi_head, use_caution, mean, std, val_ratio)
+        super().__init__(data_dir, multi_head, use_caution, mean, std, val_ratio, seed=seed, **args)
+        self.setup_split()
 
-    @staticmethod
-    def _split_profile(profiles, val_ratio):
-        """프로필을 학습과 검증용으로 나누는 메서드"""
-        length = len(profiles)
-        n_val = int(length * val_ratio)
+    def setup(self):
+        """데이터셋 설정을 하는 메서드. 프로필 순서대로 샘플 테이블을 만든다."""
+        profiles = sorted(profile for profile in os.listdir(self.data_dir) if not profile.startswith("."))
 
-        val_indices = set(random.sample(range(length), k=n_val))
-        train_indices = set(range(length)) - val_indices
-        return {"train": train_indices, "val": val_indices}
+        image_paths, mask_labels, gender_labels, age_labels = [], [], [], []
+        sample_profiles = []
+        for profile, img_path, mask_label, gender_label, age_label in self._iter_samples(profiles):
+            image_paths.append(img_path)
+            mask_labels.append(mask_label)
+            gender_labels.append(gender_label)
+            age_labels.append(age_label)
+            sample_profiles.append(profile)
+        self.set_samples(image_paths, mask_labels, gender_labels, age_labels, profiles=sample_profiles)
 
-    def setup(self):
-        """데이터셋 설정을 하는 메서드. 프로필 기준으로 나눈다."""
-        profiles = os.listdir(self.data_dir)
-        profiles = [profile for profile in profiles if not profile.startswith(".")]
-        split_profiles = self._split_profile(profiles, self.val_ratio)
-
-        cnt = 0
-        for phase, indices in split_profiles.items():
-            for _idx in indices:
-                profile = profiles[_idx]
-                img_folder = os.path.join(self.data_dir, profile)
-                for file_name in os.listdir(img_folder):
-                    _file_name, ext = os.path.splitext(file_name)
-                    if (
-                        _file_name not in self._file_names
-                    ):  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
-                        continue
-
-                    img_path = os.path.join(
-                        self.data_dir, profile, file_name
-                    )  # (resized_data, 000004_male_Asian_54, mask1.jpg)
-                    mask_label = self._file_names[_file_name]
-
-                    id, gender, race, age = profile.split("_")
-
-                    if id in self.error_labels:  # 라벨링 오류 데이터 gender 수정
-                        gender = 'female' if gender == 'male' else 'male'
-
-                    if not self.use_caution and id in self.caution_labels:  # 주의 데이터 사용 여부
-                        continue
-
-                    gender_label = GenderLabels.from_str(gender)
-                    age_label = AgeLabels.from_number(age)
-
-                    self.image_paths.append(img_path)
-                    self.mask_labels.append(mask_label)
-                    self.gender_labels.append(gender_label)
-                    self.age_labels.append(age_label)
-
-                    self.indices[phase].append(cnt)
-                    cnt += 1
-
-    def split_dataset(self) -> List[Subset]:
-        """프로필 기준으로 나눈 데이터셋을 Subset 리스트로 반환하는 메서드"""
-        return [Subset(self, indices) for phase, indices in self.indices.items()]
+    def setup_split(self):
+        """
+        샘플 테이블의 프로필 번호로부터 프로필 기준 분할을 계산하는 메서드.
+        manifest 에서 불러온 경우에도 같은 분할이 만들어집니다.
+        """
+        self.split = ProfileKFoldSplit.for_samples(
+            self.split_file,
+            self.profile_names,
+            self.profile_ids,
+            self.gender_labels.astype(np.int64) * 3 + self.age_labels,
+            n_splits=self.n_splits,
+            seed=self.seed,
+        )
+
+        train_indices, val_indices = self.split.fold_indices(self.fold)
+        self.indices["train"] = train_indices
+        self.indices["val"] = val_indices
+
+    def split_dataset(self, fold=None) -> List[TransformSubset]:
+        """
+        프로필 기준으로 나눈 데이터셋을 [train Subset, val Subset] 리스트로 반환하는 메서드
+
+        Args:
+            fold (int): 검증에 사용할 fold 번호. None 이면 생성 시 지정한 fold 를 사용
+        """
+        if fold is None:
+            fold = self.fold
+        train_indices, val_indices = self.split.fold_indices(fold)
+        return [TransformSubset(self, train_indices), TransformSubset(self, val_indices)]
+
+
+class ShardedMaskDataset(IterableDataset):
+    """
+    `pack_shards.py` 로 만든 tar shard 들을 순서대로 읽는 streaming 데이터셋
+
+    작은 JPEG 을 하나씩 여는 대신 큰 shard 파일을 앞에서부터 큰 버퍼 단위로 읽고,
+    shuffle buffer 로 순서를 섞습니다. DataLoader worker 는 서로 다른 shard 를 나눠 읽습니다.
+    프로필 분할은 `MaskSplitByProfileDataset` 과 같은 방식(같은 seed 면 같은 fold)으로 계산되고,
+    `split_dataset` 은 프로필 fold 로 걸러내는 `ShardSubset` 을 반환합니다.
+    `data_dir` 에는 shard 와 index.npz 가 있는 디렉토리를 지정합니다.
+    """
+
+    num_classes = 3 * 2 * 3
+    caution_labels = MaskBaseDataset.caution_labels
+
+    def __init__(
+        self,
+        data_dir,
+        multi_head,
+        use_caution,
+        mean=(0.548, 0.504, 0.479),
+        std=(0.237, 0.247, 0.246),
+        val_ratio=0.2,
+        n_splits=None,
+        fold=0,
+        seed=42,
+        split_file=None,
+        shuffle_buffer=1000,
+        **args,
+    ):
+        """
+        Args:
+            data_dir (str): shard 디렉토리
+            use_caution (bool): False 이면 주의 데이터 프로필을 읽지 않는다
+                (shard 에는 모두 들어있음)
+            shuffle_buffer (int): 학습용 스트림을 섞는 buffer 의 샘플 수
+            나머지 인자는 `MaskSplitByProfileDataset` 과 같음
+        """
+        self.data_dir = data_dir
+        self.multi_head = multi_head
+        self.use_caution = use_caution
+        self.mean = mean
+        self.std = std
+        self.val_ratio = val_ratio
+        self.n_splits = n_splits if n_splits is not None else max(2, int(round(1 / val_ratio)))
+        self.fold = fold
+        self.seed = seed
+        self.split_file = split_file
+        self.shuffle_buffer = shuffle_buffer
+        self.transform = None
+        self.epoch = 0
+
+        self.index = ShardIndex.load(data_dir)
+        self.mask_labels = self.index.mask_labels
+        self.gender_labels = self.index.gender_labels
+        self.age_labels = self.index.age_labels
+        self.multi_class_labels = MaskBaseDataset.encode_multi_class(
+            self.mask_labels, self.gender_labels, self.age_labels
+        ).astype(np.uint8)
+
+        available = np.ones(len(self.index), dtype=bool)
+        if not use_caution:
+            caution = np.array(
+                [name.split("_")[0] in self.caution_labels for name in self.index.profile_names], dtype=bool
+            )
+            available = ~caution[self.index.profile_ids]
+        self.samples = np.flatnonzero(available)
+        self.indices = defaultdict(list)
+        self.setup_split()
+
+    def setup_split(self):
+        """사용할 샘플만으로 프로필 기준 분할을 계산하는 메서드"""
+        samples = self.samples
+        self.split = ProfileKFoldSplit.for_samples(
+            self.split_file,
+            self.index.profile_names,
+            self.index.profile_ids[samples],
+            self.gender_labels[samples].astype(np.int64) * 3 + self.age_labels[samples],
+            n_splits=self.n_splits,
+            seed=self.seed,
+        )
+        train_indices, val_indices = self.split.fold_indices(self.fold)
+        self.indices["train"] = samples[train_indices]
+        self.indices["val"] = samples[val_indices]
+
+    def set_transform(self, transform):
+        """변환(transform)을 설정하는 메서드"""
+        self.transform = transform
+
+    def set_epoch(self, epoch):
+        """epoch 마다 shard 순서와 shuffle buffer 의 난수를 바꾸도록 설정한다."""
+        self.epoch = epoch
+
+    def get_item(self, index, data, transform):
+        """
+        shard 에서 읽은 JPEG 바이트를 주어진 transform 으로 변환해서 샘플을 만드는 메서드
+        """
+        def read_image(_):
+            return Image.open(io.BytesIO(data))
+
+        if hasattr(transform, "apply"):
+            image_transform = transform.apply(index, read_image)
+        else:
+            image_transform = transform(read_image(index))
+        multi_class_label = int(self.multi_class_labels[index])
+        if self.multi_head:
+            return (image_transform, multi_class_label, MaskLabels(int(self.mask_labels[index])),
+                    GenderLabels(int(self.gender_labels[index])), AgeLabels(int(self.age_labels[index])))
+        return image_transform, multi_class_label
+
+    def iter_samples(self, indices, transform, shuffle):
+        """
+        주어진 샘플들을 현재 worker 가 맡은 shard 에서 읽어 변환한 샘플을 생성한다.
+
+        Args:
+            indices (np.ndarray): 읽을 샘플 번호
+            transform (callable): 적용할 변환
+            shuffle (bool): shard 순서를 섞고 shuffle buffer 를 사용할지 여부
+        """
+        assert transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        rng = np.random.default_rng([self.seed, self.epoch, worker_id])
+
+        wanted = np.zeros(len(self.index), dtype=bool)
+        wanted[indices] = True
+        shard_order = np.arange(len(self.index.shards))
+        if shuffle:
+            shard_order = np.random.default_rng([self.seed, self.epoch]).permutation(shard_order)
+
+        stream = itertools.chain.from_iterable(
+            iter_shard(self.index, shard_id, wanted) for shard_id in shard_order[worker_id::num_workers]
+        )
+        if shuffle:
+            stream = shuffle_buffer(stream, self.shuffle_buffer, rng)
+        for index, data in stream:
+            yield self.get_item(index, data, transform)
+
+    def subset(self, indices, transform=None, shuffle=False) -> "ShardSubset":
+        """주어진 샘플만 읽는 `ShardSubset` 을 반환하는 메서드"""
+        return ShardSubset(self, indices, transform, shuffle)
+
+    def split_dataset(self, fold=None) -> List["ShardSubset"]:
+        """
+        프로필 기준으로 나눈 데이터셋을
+        [train ShardSubset, val ShardSubset] 리스트로 반환하는 메서드
+        train 은 섞어서, val 은 shard 순서대로 읽습니다.
+
+        Args:
+            fold (int): 검증에 사용할 fold 번호. None 이면 생성 시 지정한 fold 를 사용
+        """
+        if fold is None:
+            train_indices, val_indices = self.indices["train"], self.indices["val"]
+        else:
+            train_indices, val_indices = (self.samples[i] for i in self.split.fold_indices(fold))
+        return [self.subset(train_indices, shuffle=True), self.subset(val_indices)]
+
+    def __iter__(self):
+        return self.iter_samples(self.samples, self.transform, shuffle=True)
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class ShardSubset(IterableDataset):
+    """
+    `ShardedMaskDataset` 의 일부 샘플만 읽는 데이터셋
+    `TransformSubset` 처럼 자신의 transform 이 없으면 dataset 의 transform 을 사용합니다.
+    """
+
+    def __init__(self, dataset, indices, transform=None, shuffle=False):
+        self.dataset = dataset
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.transform = transform
+        self.shuffle = shuffle
+
+    def set_transform(self, transform):
+        """변환(transform)을 설정하는 메서드"""
+        self.transform = transform
+
+    def set_epoch(self, epoch):
+        self.dataset.set_epoch(epoch)
+
+    def __iter__(self):
+        transform = self.transform if self.transform is not None else self.dataset.transform
+        return self.dataset.iter_samples(self.indices, transform, self.shuffle)
+
+    def __len__(self):
+        return len(self.indices)
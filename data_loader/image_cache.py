@@ -0,0 +1,112 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+
+class DecodedImageCache:
+    """
+    디코딩된 uint8 이미지를 (N, H, W, 3) 모양의 파일 memmap 으로 저장하는 읽기 전용 캐시
+
+    한 번 `build` 로 만들어 두면 여러 학습 프로세스가 같은 파일을 읽기 모드로 열어
+    OS page cache 를 공유하므로, 실험마다 JPEG 을 다시 디코딩하지 않습니다.
+    이미지 순서는 데이터셋의 샘플 테이블 순서와 같고,
+    헤더의 `sample_key` 로 일치 여부를 확인합니다.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): `build` 로 만든 캐시 파일 경로 (헤더는 `{path}.json`)
+        """
+        self.path = path
+        with open(self.header_path(path), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        self.shape = tuple(header["shape"])
+        self.sample_key = header["sample_key"]
+        self._images = None
+
+    @staticmethod
+    def header_path(path):
+        return f"{path}.json"
+
+    @classmethod
+    def exists(cls, path, sample_key=None):
+        """
+        캐시 파일이 있고,
+        `sample_key` 가 주어지면 같은 샘플 테이블로 만들어졌는지 확인한다.
+        """
+        if not (os.path.exists(path) and os.path.exists(cls.header_path(path))):
+            return False
+        return sample_key is None or cls(path).sample_key == sample_key
+
+    @classmethod
+    def build(cls, path, dataset, size=None):
+        """
+        데이터셋의 모든 이미지를 디코딩해서 캐시 파일을 만든다.
+
+        Args:
+            path (str): 캐시 파일 경로
+            dataset (MaskBaseDataset): 샘플 테이블 순서대로 이미지를 읽을 데이터셋
+            size (tuple): (height, width). 주어지면 저장 전에 BILINEAR 로 줄이고,
+                None 이면 모든 이미지가 첫 이미지와 같은 크기여야 한다.
+
+        Returns:
+            DecodedImageCache: 만들어진 캐시
+        """
+        resize = size is not None
+        if resize:
+            size = tuple(size)
+        else:
+            with Image.open(dataset.image_paths[0]) as image:
+                size = (image.height, image.width)
+        shape = (len(dataset), size[0], size[1], 3)
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        if os.path.exists(cls.header_path(path)):
+            os.remove(cls.header_path(path))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        images = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=shape)
+        for index, image_path in enumerate(dataset.image_paths):
+            with Image.open(image_path) as image:
+                image = image.convert("RGB")
+                if (image.height, image.width) != size:
+                    if not resize:
+                        raise ValueError(f"{image_path} has a different size, pass size= to resize")
+                    image = image.resize((size[1], size[0]), Image.BILINEAR)
+                images[index] = np.asarray(image)
+        images.flush()
+        del images
+        os.replace(tmp_path, path)
+
+        # 헤더는 이미지 파일이 완성된 뒤에 써서,
+        # 헤더가 있으면 캐시가 완성된 것으로 본다
+        with open(cls.header_path(path), "w", encoding="utf-8") as f:
+            json.dump({"shape": list(shape), "sample_key": dataset.sample_key}, f)
+        return cls(path)
+
+    @property
+    def images(self) -> np.ndarray:
+        # 처음 접근할 때 열어서 DataLoader worker 로 pickle 될 때 배열이 복사되지 않게 한다
+        if self._images is None:
+            self._images = np.load(self.path, mmap_mode="r")
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index) -> np.ndarray:
+        """(H, W, 3) uint8 이미지"""
+        return self.images[index]
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape))
@@ -0,0 +1,260 @@
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler, Subset
+
+
+def subset_labels(dataset):
+    """
+    Subset(또는 MaskBaseDataset)의 라벨 배열을 인덱스 순서대로 반환한다.
+
+    Args:
+        dataset (Dataset): `MaskBaseDataset` 이거나 그것을 감싼 `Subset`
+
+    Returns:
+        dict: "multi", "mask", "gender", "age" -> np.ndarray
+    """
+    if isinstance(dataset, Subset):
+        base = dataset.dataset
+        indices = np.asarray(dataset.indices, dtype=np.int64)
+    else:
+        base = dataset
+        indices = np.arange(len(dataset))
+    return {
+        "multi": base.multi_class_labels[indices],
+        "mask": base.mask_labels[indices],
+        "gender": base.gender_labels[indices],
+        "age": base.age_labels[indices],
+    }
+
+
+def inverse_frequency(labels, power=1.0):
+    """라벨 빈도의 -power 제곱을 샘플별 가중치로 반환한다."""
+    counts = np.bincount(labels)
+    return 1.0 / counts[labels].astype(np.float64) ** power
+
+
+def class_balanced_weights(labels):
+    """18 클래스 각각이 같은 확률로 뽑히도록 하는 가중치"""
+    return inverse_frequency(labels["multi"])
+
+
+def sqrt_balanced_weights(labels):
+    """클래스 빈도의 제곱근에 반비례하는 가중치 (class balanced 보다 완만함)"""
+    return inverse_frequency(labels["multi"], power=0.5)
+
+
+def task_balanced_weights(labels):
+    """mask / gender / age 각 task 별로 균형을 맞춘 가중치를 평균한 가중치"""
+    weights = np.zeros(len(labels["multi"]), dtype=np.float64)
+    for task in ("mask", "gender", "age"):
+        task_weights = inverse_frequency(labels[task])
+        weights += task_weights / task_weights.sum()
+    return weights / 3
+
+
+class WeightedEpochSampler(Sampler):
+    """
+    샘플별 가중치에 비례해서 매 epoch 인덱스를 뽑는 Sampler
+
+    한 epoch 의 인덱스는 `torch.multinomial` 한 번으로 생성되며, seed + epoch 로 고정되어
+    모든 프로세스(rank)가 같은 순서를 만든 뒤 자기 몫만 가져갑니다.
+    DataLoader 의 worker 수와 무관하게 동작하고, `set_epoch` 으로 epoch 마다 순서가 바뀝니다.
+    """
+
+    def __init__(self, weights, num_samples=None, replacement=True, seed=0, num_replicas=None, rank=None):
+        """
+        Args:
+            weights (np.ndarray): 샘플별 가중치
+            num_samples (int): 전체 rank 기준 한 epoch 에 뽑을 샘플 수 (default: len(weights))
+            replacement (bool): 복원 추출 여부
+            seed (int): random seed
+            num_replicas (int): 분산 학습 프로세스 수 (default: torch.distributed 설정값 또는 1)
+            rank (int): 현재 프로세스의 rank (default: torch.distributed 설정값 또는 0)
+        """
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+        self.weights = torch.as_tensor(weights, dtype=torch.double)
+        self.replacement = replacement
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+        total = len(self.weights) if num_samples is None else num_samples
+        self.num_samples = total // num_replicas
+        self.total_size = self.num_samples * num_replicas
+
+    def set_epoch(self, epoch):
+        """epoch 에 따라 다른 순서를 만들도록 설정한다."""
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.multinomial(self.weights, self.total_size, self.replacement, generator=generator)
+        return iter(indices[self.rank:self.total_size:self.num_replicas].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+class LossAwareSampler(Sampler):
+    """
+    샘플별 최근 loss 에 비례해서 매 epoch 인덱스를 뽑는 hard example sampler
+
+    학습 중 `update` 로 받은 reduction 없는 loss 를
+    샘플별 지수 이동 평균으로 float32 배열에 저장하고,
+    다음 epoch 은 평균 대비 loss 에 비례하는 확률로 (복원 추출) 인덱스를 뽑습니다.
+    평균의 `floor` 배 아래로는 가중치를 내리지 않아 쉬운 샘플도 가끔 다시 보고,
+    `staleness` epoch 이상 loss 가 갱신되지 않은 샘플은
+    확률과 무관하게 그 epoch 에 한 번씩 넣어서 loss 를 새로 잽니다.
+    첫 epoch 은 모든 샘플이 갱신 전이므로 균등한 순열과 같습니다.
+
+    `update` 는 이번 epoch 의 순서에서의 위치로 샘플을 찾으므로
+    DataLoader 는 drop_last 와 같은 batch 크기로 sampler 의 순서를 그대로 소비해야 합니다.
+    loss 가 프로세스마다 달라지므로 분산 학습은 지원하지 않습니다.
+    """
+
+    def __init__(self, num_samples, floor=0.1, staleness=3, momentum=0.5, seed=0):
+        """
+        Args:
+            num_samples (int): 학습 `Subset` 의 샘플 수 (한 epoch 에 뽑는 샘플 수와 같음)
+            floor (float): 평균 loss 대비 최소 가중치
+            staleness (int): loss 를 다시 재도록 강제로 넣기 전까지 허용하는 epoch 수
+            momentum (float): 이전 loss 에 주는 지수 이동 평균 가중치 (0 이면 마지막 loss 만 사용)
+            seed (int): random seed
+        """
+        self.num_samples = num_samples
+        self.floor = floor
+        self.staleness = staleness
+        self.momentum = momentum
+        self.seed = seed
+        self.epoch = 0
+        self.losses = np.zeros(num_samples, dtype=np.float32)
+        self.last_seen = np.full(num_samples, -1, dtype=np.int32)  # loss 를 마지막으로 갱신한 epoch
+        self.order = np.arange(num_samples)
+        self.num_refreshed = 0
+
+    def set_epoch(self, epoch):
+        """
+        epoch 에 따라 다른 순서를 만들도록 설정한다.
+        staleness 도 이 epoch 기준으로 계산된다.
+        """
+        self.epoch = epoch
+
+    def weights(self):
+        """
+        Returns:
+            np.ndarray: 샘플별 추출 가중치 (평균 loss 대비 비율, floor 이상)
+        """
+        seen = self.last_seen >= 0
+        mean = self.losses[seen].mean() if seen.any() else 0.0
+        if mean <= 0:
+            return np.ones(self.num_samples, dtype=np.float64)
+        return np.maximum(self.losses / mean, self.floor).astype(np.float64)
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        stale = np.flatnonzero((self.last_seen < 0) | (self.epoch - self.last_seen >= self.staleness))
+        if len(stale) >= self.num_samples:
+            order = rng.permutation(stale)[:self.num_samples]
+        else:
+            weights = self.weights()
+            drawn = rng.choice(self.num_samples, size=self.num_samples - len(stale), p=weights / weights.sum())
+            order = rng.permutation(np.concatenate([stale, drawn]))
+        self.order = order
+        self.num_refreshed = min(len(stale), self.num_samples)
+        return iter(order.tolist())
+
+    def update(self, start, losses):
+        """
+        이번 epoch 순서의 start 번째부터 len(losses) 개 샘플의 loss 를 갱신한다.
+
+        Args:
+            start (int): batch 의 첫 샘플이 epoch 순서에서 차지하는 위치 (batch 번호 * batch 크기)
+            losses (torch.Tensor or np.ndarray): reduction 없는 샘플별 loss
+        """
+        if isinstance(losses, torch.Tensor):
+            losses = losses.detach().float().cpu().numpy()
+        indices = self.order[start:start + len(losses)]
+        previous = self.losses[indices]
+        smoothed = self.momentum * previous + (1 - self.momentum) * losses
+        self.losses[indices] = np.where(self.last_seen[indices] < 0, losses, smoothed)
+        self.last_seen[indices] = self.epoch
+
+    def __len__(self):
+        return self.num_samples
+
+    def __repr__(self):
+        seen = self.last_seen >= 0
+        mean = self.losses[seen].mean() if seen.any() else 0.0
+        unique = len(np.unique(self.order)) / max(self.num_samples, 1)
+        return (f"{self.__class__.__name__}(mean loss {mean:.4f}, {unique:.1%} unique samples, "
+                f"{self.num_refreshed} stale refreshed)")
+
+
+class ShardSampler(Sampler):
+    """
+    검증용: 순서를 유지한 채 rank 별로 인덱스를 나눠 갖는 Sampler
+    DistributedSampler 와 달리 샘플을 복제해서 길이를 맞추지 않으므로
+    all-reduce 한 metric 이 정확합니다.
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        self.indices = range(rank, len(dataset), num_replicas)
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+# 사용 가능한 sampler 가중치 함수의 진입점
+_sampler_entrypoints = {
+    "class_balanced": class_balanced_weights,
+    "sqrt_balanced": sqrt_balanced_weights,
+    "task_balanced": task_balanced_weights,
+}
+
+
+def is_sampler(sampler_name):
+    """
+    주어진 sampler 이름이 지원되는지 확인한다.
+
+    Args:
+        sampler_name (str): 확인할 sampler 이름
+
+    Returns:
+        bool: 지원되면 True, 그렇지 않으면 False
+    """
+    return sampler_name in _sampler_entrypoints or sampler_name == "loss_aware"
+
+
+def create_sampler(sampler_name, dataset, **kwargs):
+    """
+    데이터셋의 라벨 배열로부터 가중치를 계산해서 sampler 객체를 생성한다.
+
+    Args:
+        sampler_name (str): 생성할 sampler 이름
+        dataset (Dataset): 학습에 사용할 `Subset`
+        **kwargs: `WeightedEpochSampler` (loss_aware 이면 `LossAwareSampler`)
+            생성자에 전달되는 키워드 인자
+
+    Returns:
+        Sampler: 생성된 sampler 객체
+    """
+    if not is_sampler(sampler_name):
+        raise RuntimeError("Unknown sampler (%s)" % sampler_name)
+    if sampler_name == "loss_aware":  # 라벨이 아니라 학습 중의 loss 로 가중치를 정함
+        return LossAwareSampler(len(dataset), **kwargs)
+    weights = _sampler_entrypoints[sampler_name](subset_labels(dataset))
+    return WeightedEpochSampler(weights, **kwargs)
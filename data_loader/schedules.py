@@ -0,0 +1,130 @@
+from typing import List, Tuple
+
+
+class ResizeSchedule:
+    """
+    epoch 구간별로 학습 이미지 크기를 바꾸는 progressive resizing 스케줄
+
+    초반 epoch 은 작은 해상도로 빠르게 학습하고
+    마지막 구간은 원래 해상도(`final_size`)로 학습합니다.
+    `scale_batch_size` 가 True 이면 해상도가 작은 구간의 batch size 를
+    픽셀 수에 반비례해서 키웁니다.
+
+    Attributes:
+        phases (List[Tuple[int, Tuple[int, int]]]): (시작 epoch, (height, width)) 목록
+    """
+
+    def __init__(self, phases, final_size, batch_size, scale_batch_size=True, max_batch_size=None):
+        """
+        Args:
+            phases (List[Tuple[int, Tuple[int, int]]]): (시작 epoch, (height, width)) 목록
+            final_size (Tuple[int, int]): 기준이 되는 최종 해상도 (--resize)
+            batch_size (int): 최종 해상도에서의 batch size (--batch_size)
+            scale_batch_size (bool): 해상도에 맞춰 batch size 를 조정할지 여부
+            max_batch_size (int): 조정된 batch size 의 상한
+        """
+        self.phases = sorted((int(start), tuple(size)) for start, size in phases)
+        if not self.phases or self.phases[0][0] > 1:
+            self.phases.insert(0, (1, tuple(final_size)))
+        # 검증과 추론은 final_size 로 하므로
+        # 마지막 구간은 반드시 그 해상도로 학습해야 한다
+        if self.phases[-1][1] != tuple(final_size):
+            raise ValueError(f"the last resize phase {list(self.phases[-1][1])} (from epoch {self.phases[-1][0]}) "
+                             f"must be the final resize {list(final_size)}")
+        self.final_size = tuple(final_size)
+        self.batch_size = batch_size
+        self.scale_batch_size = scale_batch_size
+        self.max_batch_size = max_batch_size
+
+    @classmethod
+    def parse(cls, spec, final_size, batch_size, **kwargs):
+        """
+        "1:64,48;4:96,72;8:128,96" 형태의 문자열로부터 스케줄을 만든다.
+
+        Args:
+            spec (str): "시작epoch:height,width" 를 ";" 로 이은 문자열
+            final_size (Tuple[int, int]): 최종 해상도
+            batch_size (int): 최종 해상도에서의 batch size
+        """
+        phases = []
+        for phase in spec.split(";"):
+            if not phase.strip():
+                continue
+            start, size = phase.split(":")
+            height, width = size.split(",")
+            phases.append((int(start), (int(height), int(width))))
+        return cls(phases, final_size, batch_size, **kwargs)
+
+    def phase(self, epoch) -> Tuple[Tuple[int, int], int]:
+        """
+        주어진 epoch 에 사용할 (해상도, batch size) 를 반환한다.
+        """
+        size = self.phases[0][1]
+        for start, phase_size in self.phases:
+            if epoch >= start:
+                size = phase_size
+        return size, self.batch_size_for(size)
+
+    def batch_size_for(self, size) -> int:
+        if not self.scale_batch_size:
+            return self.batch_size
+        scale = (self.final_size[0] * self.final_size[1]) / (size[0] * size[1])
+        batch_size = max(1, int(self.batch_size * scale))
+        if self.max_batch_size is not None:
+            batch_size = min(batch_size, self.max_batch_size)
+        return batch_size
+
+    def sizes(self) -> List[Tuple[int, int]]:
+        return [size for _, size in self.phases]
+
+
+class UnfreezeSchedule:
+    """
+    epoch 구간별로 backbone 의 마지막 몇 block 을 학습할지 정하는 partial unfreeze 스케줄
+
+    처음에는 head 만 학습하고,
+    뒤 구간으로 갈수록 backbone 의 뒤쪽 block 부터 차례로 학습에 포함합니다.
+    첫 구간이 1 epoch 부터 시작하지 않으면 그 전까지는 backbone 전체를 고정합니다.
+
+    Attributes:
+        phases (List[Tuple[int, int]]): (시작 epoch, 학습할 block 수) 목록. `ALL` (-1) 은 backbone 전체
+    """
+
+    ALL = -1
+
+    def __init__(self, phases):
+        """
+        Args:
+            phases (List[Tuple[int, int]]): (시작 epoch, 학습할 block 수) 목록
+        """
+        self.phases = sorted((int(start), int(blocks)) for start, blocks in phases)
+        if not self.phases or self.phases[0][0] > 1:
+            self.phases.insert(0, (1, 0))
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        "1:0;4:2;8:all" 형태의 문자열로부터 스케줄을 만든다.
+
+        Args:
+            spec (str): "시작epoch:block 수" 를 ";" 로 이은 문자열
+                (block 수 대신 all 이면 backbone 전체)
+        """
+        phases = []
+        for phase in spec.split(";"):
+            if not phase.strip():
+                continue
+            start, blocks = phase.split(":")
+            blocks = blocks.strip()
+            phases.append((int(start), cls.ALL if blocks == "all" else int(blocks)))
+        return cls(phases)
+
+    def phase(self, epoch) -> int:
+        """
+        주어진 epoch 에 학습할 block 수를 반환한다.
+        """
+        blocks = self.phases[0][1]
+        for start, phase_blocks in self.phases:
+            if epoch >= start:
+                blocks = phase_blocks
+        return blocks
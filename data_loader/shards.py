@@ -0,0 +1,180 @@
+import json
+import os
+import tarfile
+
+import numpy as np
+
+from base.base_data_set import PackedStrings
+
+
+INDEX_FILE = "index.npz"
+SHARD_NAME = "shard-{:05d}.tar"
+TAR_BLOCK = tarfile.BLOCKSIZE
+
+
+class ShardIndex:
+    """
+    tar shard 들에 저장된 샘플의 위치와 라벨을 담은 인덱스
+
+    샘플 번호는 shard 를 만들 때 사용한 데이터셋의 샘플 테이블 순서와 같고,
+    각 샘플의 JPEG 바이트는 `shards[shard_ids[i]]` 파일의 `offsets[i]` 부터 `sizes[i]` 바이트입니다.
+    """
+
+    version = 1
+
+    def __init__(self, root, shards, shard_ids, offsets, sizes, image_paths, profile_names, profile_ids,
+                 mask_labels, gender_labels, age_labels):
+        self.root = root
+        self.shards = shards
+        self.shard_ids = shard_ids
+        self.offsets = offsets
+        self.sizes = sizes
+        self.image_paths = image_paths
+        self.profile_names = profile_names
+        self.profile_ids = profile_ids
+        self.mask_labels = mask_labels
+        self.gender_labels = gender_labels
+        self.age_labels = age_labels
+
+        # shard 별로 파일 안의 위치 순서대로 정렬한 샘플 번호 (순차 읽기용)
+        order = np.lexsort((offsets, shard_ids))
+        bounds = np.searchsorted(shard_ids[order], np.arange(len(shards) + 1))
+        self.shard_samples = [order[bounds[i]:bounds[i + 1]] for i in range(len(shards))]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def shard_path(self, shard_id):
+        return os.path.join(self.root, self.shards[shard_id])
+
+    def save(self):
+        tmp_path = os.path.join(self.root, f"{INDEX_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                meta=np.array(json.dumps({"version": self.version, "shards": self.shards})),
+                shard_ids=self.shard_ids,
+                offsets=self.offsets,
+                sizes=self.sizes,
+                path_buffer=self.image_paths.buffer,
+                path_offsets=self.image_paths.offsets,
+                profile_buffer=self.profile_names.buffer,
+                profile_offsets=self.profile_names.offsets,
+                profile_ids=self.profile_ids,
+                mask=self.mask_labels,
+                gender=self.gender_labels,
+                age=self.age_labels,
+            )
+        os.replace(tmp_path, os.path.join(self.root, INDEX_FILE))
+
+    @classmethod
+    def load(cls, root):
+        with np.load(os.path.join(root, INDEX_FILE)) as content:
+            meta = json.loads(str(content["meta"]))
+            if meta["version"] != cls.version:
+                raise ValueError(f"{root} was packed with shard format version {meta['version']}, "
+                                 f"expected {cls.version}. pack the shards again")
+            return cls(
+                root,
+                meta["shards"],
+                content["shard_ids"],
+                content["offsets"],
+                content["sizes"],
+                PackedStrings.from_arrays(content["path_buffer"], content["path_offsets"]),
+                PackedStrings.from_arrays(content["profile_buffer"], content["profile_offsets"]),
+                content["profile_ids"],
+                content["mask"],
+                content["gender"],
+                content["age"],
+            )
+
+
+def pack_shards(dataset, output_dir, shard_bytes=256 * 2 ** 20, shuffle=True, seed=42):
+    """
+    데이터셋의 JPEG 파일을 다시 인코딩하지 않고 큰 tar shard 들로 묶고 인덱스를 저장한다.
+
+    Args:
+        dataset (MaskBaseDataset): 프로필 정보가 있는 샘플 테이블 (예: MaskSplitByProfileDataset)
+        output_dir (str): shard 와 index.npz 를 저장할 디렉토리
+        shard_bytes (int): shard 하나의 목표 크기
+        shuffle (bool): 샘플을 섞어서 저장할지 여부.
+            섞어두면 읽을 때 작은 shuffle buffer 로도 충분히 섞인다.
+        seed (int): 섞을 때 사용할 random seed
+
+    Returns:
+        ShardIndex: 저장된 인덱스
+    """
+    if dataset.profile_ids is None:
+        raise ValueError("packing needs per-sample profiles, use MaskSplitByProfileDataset")
+    os.makedirs(output_dir, exist_ok=True)
+
+    n = len(dataset)
+    order = np.random.default_rng(seed).permutation(n) if shuffle else np.arange(n)
+    shard_ids = np.zeros(n, dtype=np.int32)
+    offsets = np.zeros(n, dtype=np.int64)
+    sizes = np.zeros(n, dtype=np.int64)
+    shards = []
+
+    tar = None
+    for index in order:
+        image_path = dataset.image_paths[index]
+        size = os.path.getsize(image_path)
+        if tar is None or (tar.offset > 0 and tar.offset + size > shard_bytes):
+            if tar is not None:
+                tar.close()
+            shards.append(SHARD_NAME.format(len(shards)))
+            tar = tarfile.open(os.path.join(output_dir, shards[-1]), "w", format=tarfile.USTAR_FORMAT)
+
+        info = tarfile.TarInfo(f"{index:08d}{os.path.splitext(image_path)[1]}")
+        info.size = size
+        with open(image_path, "rb") as f:
+            tar.addfile(info, f)
+        # addfile 뒤의 offset 은 512 바이트 단위로 채운 데이터의 끝이므로
+        # 데이터 시작 위치를 역산한다
+        shard_ids[index] = len(shards) - 1
+        offsets[index] = tar.offset - (size + TAR_BLOCK - 1) // TAR_BLOCK * TAR_BLOCK
+        sizes[index] = size
+    if tar is not None:
+        tar.close()
+
+    shard_index = ShardIndex(
+        output_dir, shards, shard_ids, offsets, sizes, dataset.image_paths, dataset.profile_names,
+        dataset.profile_ids, dataset.mask_labels, dataset.gender_labels, dataset.age_labels,
+    )
+    shard_index.save()
+    return shard_index
+
+
+def iter_shard(index, shard_id, wanted=None, buffer_size=8 * 2 ** 20):
+    """
+    shard 하나를 앞에서부터 순서대로 읽으면서 (샘플 번호, JPEG 바이트) 를 생성한다.
+
+    Args:
+        index (ShardIndex): shard 인덱스
+        shard_id (int): 읽을 shard 번호
+        wanted (np.ndarray): 샘플별 bool 마스크. False 인 샘플은 건너뛴다.
+        buffer_size (int): 파일 읽기 버퍼 크기. 작은 샘플들을 큰 단위로 한 번에 읽는다.
+    """
+    samples = index.shard_samples[shard_id]
+    if wanted is not None:
+        samples = samples[wanted[samples]]
+    if len(samples) == 0:
+        return
+    with open(index.shard_path(shard_id), "rb", buffering=buffer_size) as f:
+        for sample in samples:
+            f.seek(index.offsets[sample])  # 버퍼 안으로의 seek 은 시스템 콜 없이 처리된다
+            yield int(sample), f.read(index.sizes[sample])
+
+
+def shuffle_buffer(iterable, size, rng):
+    """크기가 size 인 buffer 에서 무작위로 꺼내는 방식으로 스트림을 섞는다."""
+    buffer = []
+    for item in iterable:
+        if len(buffer) < size:
+            buffer.append(item)
+            continue
+        j = rng.integers(size)
+        yield buffer[j]
+        buffer[j] = item
+    rng.shuffle(buffer)
+    yield from buffer
@@ -0,0 +1,252 @@
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+
+class SharedArrayCache:
+    """
+    DataLoader worker 들이 함께 쓰는 고정 모양 배열 캐시 (multiprocessing.shared_memory)
+
+    고정 크기 slot 들로 나눈 arena 에 샘플 인덱스별 배열을 저장합니다.
+    어떤 worker 든 처음 만든 배열을 채워 넣으면
+    이후에는 다른 worker 도 그 배열을 다시 만들지 않고 읽습니다.
+    slot 수는 byte budget (샘플 수 이하) 으로 정해지고,
+    가득 차면 clock (second chance) 또는 FIFO 로 slot 을 교체합니다.
+
+    slot 배정만 lock 으로 보호하고 이미지 복사는 lock 밖에서 합니다.
+    slot 마다 seqlock 카운터 (쓰는 중이면 홀수)를 두어,
+    읽는 쪽은 복사 전후의 카운터와 소유 샘플이 같을 때만 hit 으로 인정합니다.
+    hit / miss 카운터는 프로세스마다 다른 행에 기록되고 `stats` 에서 합쳐집니다.
+    """
+
+    max_processes = 256
+
+    def __init__(self, num_samples, shape, dtype, max_bytes, eviction="clock"):
+        """
+        Args:
+            num_samples (int): 샘플 인덱스의 개수 (key 는 0 이상 num_samples 미만)
+            shape (tuple): 저장할 배열 하나의 모양
+            dtype (np.dtype): 저장할 배열의 dtype
+            max_bytes (int): slot 들이 차지할 최대 바이트 수
+            eviction (str): "clock" 또는 "fifo"
+        """
+        if eviction not in ("clock", "fifo"):
+            raise ValueError(f"eviction should be either 'clock' or 'fifo', {eviction}")
+        self.num_samples = num_samples
+        self.slot_shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slot_bytes = int(np.prod(self.slot_shape)) * self.dtype.itemsize
+        self.num_slots = min(max_bytes // self.slot_bytes, num_samples)
+        if self.num_slots == 0:
+            raise ValueError(f"byte budget {max_bytes} is smaller than one slot ({self.slot_bytes} bytes)")
+        self.eviction = eviction
+
+        self._layout = self._make_layout()
+        total = self._layout[-1][1]
+        self._shm = shared_memory.SharedMemory(create=True, size=total)
+        self._owner_pid = os.getpid()
+        # spawn context 의 lock 은 fork 한 worker 에도 상속되고,
+        # spawn 한 프로세스(백그라운드 검증 등)에도 넘길 수 있다
+        self._lock = mp.get_context("spawn").Lock()
+        self._bind()
+        self._buffers["slot_of"][:] = -1
+        self._buffers["owner"][:] = -1
+        self._buffers["seq"][:] = 0
+        self._buffers["ref"][:] = 0
+        self._buffers["header"][:] = 0
+        self._buffers["counters"][:] = 0
+        self._row = None
+        self._row_pid = None
+
+    def _make_layout(self):
+        """(이름, 끝 offset, dtype, shape) 목록. 각 배열은 64 바이트 경계에서 시작한다."""
+        specs = [
+            ("header", np.int64, (2,)),  # clock hand, 다음에 배정할 카운터 행
+            ("slot_of", np.int32, (self.num_samples,)),
+            ("owner", np.int64, (self.num_slots,)),
+            ("seq", np.int64, (self.num_slots,)),
+            ("ref", np.uint8, (self.num_slots,)),
+            ("counters", np.int64, (self.max_processes, 2)),  # 프로세스별 hit, miss
+            ("images", self.dtype, (self.num_slots,) + self.slot_shape),
+        ]
+        layout, offset = [], 0
+        for name, dtype, shape in specs:
+            offset = (offset + 63) // 64 * 64
+            start = offset
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+            layout.append((name, start, dtype, shape))
+        layout.append(("end", offset, None, None))
+        return layout
+
+    def _bind(self):
+        self._buffers = {
+            name: np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=start)
+            for name, start, dtype, shape in self._layout[:-1]
+        }
+
+    def __getstate__(self):
+        # spawn 으로 만든 worker 에는 shared memory 이름만 넘기고 다시 연결한다
+        state = self.__dict__.copy()
+        state["_shm_name"] = self._shm.name
+        del state["_shm"], state["_buffers"]
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop("_shm_name")
+        self.__dict__.update(state)
+        # spawn 한 자식 프로세스는 만든 프로세스의 resource tracker 를 함께 쓰므로,
+        # 연결할 때의 등록은 중복이고
+        # 여기서 등록을 해제하면 만든 프로세스의 등록까지 지워진다
+        # (arena 는 만든 프로세스의 close 가 지운다)
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._bind()
+
+    def _counter_row(self):
+        """현재 프로세스가 hit / miss 를 기록할 행 (fork 된 worker 는 새 행을 배정받음)"""
+        pid = os.getpid()
+        if self._row_pid != pid:
+            with self._lock:
+                header = self._buffers["header"]
+                self._row = int(header[1]) % self.max_processes
+                header[1] += 1
+            self._row_pid = pid
+        return self._row
+
+    def get(self, index):
+        """
+        Returns:
+            np.ndarray or None: 캐시된 배열의 복사본. 없으면 None
+        """
+        counters = self._buffers["counters"][self._counter_row()]
+        slot = int(self._buffers["slot_of"][index])
+        if slot >= 0:
+            seq = self._buffers["seq"]
+            before = seq[slot]
+            if before % 2 == 0 and self._buffers["owner"][slot] == index:
+                image = self._buffers["images"][slot].copy()
+                if seq[slot] == before and self._buffers["owner"][slot] == index:
+                    self._buffers["ref"][slot] = 1
+                    counters[0] += 1
+                    return image
+        counters[1] += 1
+        return None
+
+    def _claim_slot(self, index):
+        """
+        lock 안에서 index 를 위한 slot 을 골라 쓰기 중(홀수) 상태로 만든다.
+        이미 있으면 None
+        """
+        slot_of, owner, seq, ref = (self._buffers[name] for name in ("slot_of", "owner", "seq", "ref"))
+        header = self._buffers["header"]
+        if slot_of[index] >= 0:  # 다른 worker 가 이미 넣었거나 넣는 중
+            return None
+        # 쓰는 중인 slot 은 건너뛰고, clock 이면 최근에 읽힌 slot 에 한 번 더 기회를 준다
+        for _ in range(2 * self.num_slots + 1):
+            slot = int(header[0])
+            header[0] = (slot + 1) % self.num_slots
+            if seq[slot] % 2 == 1:
+                continue
+            if self.eviction == "clock" and ref[slot]:
+                ref[slot] = 0
+                continue
+            break
+        else:
+            return None
+        if owner[slot] >= 0:
+            slot_of[owner[slot]] = -1
+        seq[slot] += 1
+        owner[slot] = index
+        ref[slot] = 0
+        slot_of[index] = slot
+        return slot
+
+    def put(self, index, image):
+        """
+        Args:
+            index (int): 샘플 인덱스
+            image (np.ndarray): `shape` 모양의 배열
+        """
+        with self._lock:
+            slot = self._claim_slot(index)
+        if slot is None:
+            return
+        self._buffers["images"][slot] = image
+        self._buffers["seq"][slot] += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: 모든 프로세스의 "hits", "misses" 합과 "hit_rate", 채워진 "slots", 전체 "num_slots"
+        """
+        hits, misses = (int(value) for value in self._buffers["counters"].sum(axis=0))
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "slots": int((self._buffers["owner"] >= 0).sum()),
+            "num_slots": self.num_slots,
+        }
+
+    def reset_stats(self):
+        self._buffers["counters"][:] = 0
+
+    @property
+    def nbytes(self):
+        return self._shm.size
+
+    def close(self):
+        """arena 를 닫고, 만든 프로세스라면 shared memory 를 삭제한다."""
+        self._buffers = None
+        self._shm.close()
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
+
+
+class SharedImageCache(SharedArrayCache):
+    """
+    DataLoader worker 들이 함께 쓰는 디코딩된 uint8 이미지 캐시
+
+    (H, W, 3) 이미지를 `SharedArrayCache` 에 저장합니다.
+    첫 epoch 에 어떤 worker 든 처음 읽은 이미지를 채워 넣고,
+    이후 epoch 과 검증에서는 다른 worker 도 그 이미지를 디코딩 없이 읽습니다.
+    """
+
+    def __init__(self, num_samples, size, max_bytes, eviction="clock"):
+        """
+        Args:
+            num_samples (int): 데이터셋의 샘플 수
+            size (tuple): 저장할 이미지의 (height, width). 다른 크기의 이미지는 BILINEAR 로 맞춘다.
+            max_bytes (int): 이미지 slot 들이 차지할 최대 바이트 수
+            eviction (str): "clock" 또는 "fifo"
+        """
+        self.size = tuple(size)
+        super().__init__(num_samples, (self.size[0], self.size[1], 3), np.uint8, max_bytes, eviction)
+
+    def load(self, index, read_image):
+        """
+        캐시에서 이미지를 읽고, 없으면 `read_image(index)` 로 디코딩해서 채운다.
+
+        Args:
+            index (int): 샘플 인덱스
+            read_image (callable): index 를 받아 PIL 이미지를 반환하는 함수
+
+        Returns:
+            PIL.Image: `size` 크기의 RGB 이미지
+        """
+        cached = self.get(index)
+        if cached is not None:
+            return Image.fromarray(cached)
+        image = read_image(index).convert("RGB")
+        if (image.height, image.width) != self.size:
+            image = image.resize((self.size[1], self.size[0]), Image.BILINEAR)
+        self.put(index, np.asarray(image))
+        return image
+
+    def __repr__(self):
+        stats = self.stats()
+        return (f"{self.__class__.__name__}({stats['slots']}/{stats['num_slots']} slots of "
+                f"{self.size[0]}x{self.size[1]}, {self.eviction}, hit rate {stats['hit_rate']:.1%})")
@@ -0,0 +1,159 @@
+import json
+import os
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+class ProfileKFoldSplit:
+    """
+    사람(profile) 단위로 stratified k-fold 분할을 계산하고 저장하는 클래스
+
+    프로필마다 (성별, 나이) 라벨 조합을 층(stratum)으로 두고,
+    각 층 안에서 프로필을 섞은 뒤 fold 에 순서대로 배정합니다.
+    한 번 계산한 분할은 seed 와 함께 json 으로 저장되어
+    같은 데이터셋으로 여러 fold 를 돌릴 때 그대로 재사용됩니다.
+
+    Attributes:
+        n_splits (int): fold 개수
+        seed (int): 분할에 사용한 random seed
+        folds (dict): 프로필 이름 -> fold 번호
+    """
+
+    def __init__(self, folds: Dict[str, int], n_splits: int, seed: int):
+        self.folds = folds
+        self.n_splits = n_splits
+        self.seed = seed
+        self._sample_folds = None
+        self._fold_indices = None
+
+    @classmethod
+    def from_profiles(cls, profiles: Sequence[str], strata: Sequence[int], n_splits=5, seed=42):
+        """
+        프로필과 층 라벨로부터 stratified k-fold 분할을 계산한다.
+
+        Args:
+            profiles (Sequence[str]): 프로필 이름 목록
+            strata (Sequence[int]): 프로필별 층 라벨 (예: gender * 3 + age)
+            n_splits (int): fold 개수
+            seed (int): random seed
+
+        Returns:
+            ProfileKFoldSplit: 계산된 분할
+        """
+        if n_splits < 2:
+            raise ValueError(f"n_splits should be at least 2, {n_splits}")
+
+        groups = defaultdict(list)
+        for profile, stratum in zip(profiles, strata):
+            groups[int(stratum)].append(profile)
+
+        rng = np.random.default_rng(seed)
+        folds = {}
+        offset = 0  # 층마다 남는 프로필이 앞쪽 fold 에 몰리지 않도록 시작 fold 를 이어서 배정
+        for stratum in sorted(groups):
+            members = sorted(groups[stratum])
+            for i, j in enumerate(rng.permutation(len(members))):
+                folds[members[j]] = (offset + i) % n_splits
+            offset = (offset + len(members)) % n_splits
+        return cls(folds, n_splits, seed)
+
+    @classmethod
+    def load(cls, path):
+        """json 파일에 저장된 분할을 불러온다."""
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+        return cls(content["folds"], content["n_splits"], content["seed"])
+
+    def save(self, path):
+        """분할을 seed 와 함께 json 파일로 저장한다."""
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"seed": self.seed, "n_splits": self.n_splits, "folds": self.folds}, f, indent=4)
+
+    @classmethod
+    def load_or_create(cls, path, profiles, strata, n_splits=5, seed=42):
+        """
+        저장된 분할이 현재 프로필 목록, fold 개수, seed 와 일치하면 재사용하고
+        그렇지 않으면 새로 계산해서 저장한다.
+
+        Args:
+            path (str or None): 분할 파일 경로. None 이면 저장하지 않는다.
+            profiles (Sequence[str]): 프로필 이름 목록
+            strata (Sequence[int]): 프로필별 층 라벨
+            n_splits (int): fold 개수
+            seed (int): random seed
+
+        Returns:
+            ProfileKFoldSplit: 분할
+        """
+        if path is not None and os.path.exists(path):
+            split = cls.load(path)
+            if split.n_splits == n_splits and split.seed == seed and set(split.folds) == set(profiles):
+                return split
+            print(f"[Warning] {path} does not match current profiles/n_splits/seed, recomputing split")
+
+        split = cls.from_profiles(profiles, strata, n_splits, seed)
+        if path is not None:
+            split.save(path)
+        return split
+
+    @classmethod
+    def for_samples(cls, path, profile_names, profile_ids, sample_strata, n_splits=5, seed=42):
+        """
+        샘플별 프로필 번호와 층 라벨로부터 분할을 불러오거나 계산하고,
+        샘플 인덱스까지 배정한다.
+
+        Args:
+            path (str or None): 분할 파일 경로. None 이면 저장하지 않는다.
+            profile_names (Sequence[str]): 프로필 이름 목록
+            profile_ids (np.ndarray): 샘플별 프로필 번호 (`profile_names` 의 인덱스)
+            sample_strata (np.ndarray): 샘플별 층 라벨 (같은 프로필의 샘플은 같은 값)
+            n_splits (int): fold 개수
+            seed (int): random seed
+
+        Returns:
+            ProfileKFoldSplit: 샘플이 배정된 분할
+        """
+        present, first_samples = np.unique(profile_ids, return_index=True)
+        profiles = [profile_names[i] for i in present]
+        split = cls.load_or_create(path, profiles, sample_strata[first_samples].tolist(), n_splits=n_splits, seed=seed)
+        split.assign_samples([profile_names[i] for i in profile_ids])
+        return split
+
+    def assign_samples(self, sample_profiles: Sequence[str]):
+        """
+        샘플별 프로필 이름으로부터 모든 fold 의 train / val 인덱스 배열을 미리 계산한다.
+
+        Args:
+            sample_profiles (Sequence[str]): 데이터셋 순서대로 나열된 샘플별 프로필 이름
+        """
+        self._sample_folds = np.fromiter(
+            (self.folds[profile] for profile in sample_profiles), dtype=np.int8, count=len(sample_profiles)
+        )
+        self._fold_indices = [
+            (np.flatnonzero(self._sample_folds != fold), np.flatnonzero(self._sample_folds == fold))
+            for fold in range(self.n_splits)
+        ]
+
+    def fold_indices(self, fold: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        주어진 fold 의 (train 인덱스, val 인덱스) 배열을 반환한다.
+
+        Args:
+            fold (int): fold 번호 (0 <= fold < n_splits)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: 미리 계산된 train / val 샘플 인덱스
+        """
+        assert self._fold_indices is not None, ".assign_samples 메소드를 먼저 호출해주세요"
+        if not 0 <= fold < self.n_splits:
+            raise ValueError(f"fold should be in [0, {self.n_splits}), {fold}")
+        return self._fold_indices[fold]
+
+    def profiles_in_fold(self, fold: int) -> List[str]:
+        """주어진 fold 에 속한 (검증용) 프로필 이름 목록을 반환한다."""
+        return [profile for profile, f in self.folds.items() if f == fold]
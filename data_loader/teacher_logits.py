@@ -0,0 +1,110 @@
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+
+class TeacherLogits:
+    """
+    teacher 모델의 head 별 logit 을 샘플 테이블 순서대로 저장한 (N, 8) float32 npy 파일
+
+    mask(3) / gender(2) / age(3) logit 을 이어 붙여 저장하고, 헤더(`{path}.json`)에 teacher checkpoint 의
+    sha256, resize, 데이터셋의 `sample_key` 를 기록해서 같은 조건이면 다시 계산하지 않습니다.
+    teacher 는 random augmentation 없는 검증용 변환을 거친 이미지를 보므로,
+    학습 중 student 가 보는 augment 된 이미지와는 조금 다른 offline 타겟입니다.
+    """
+
+    head_sizes = (3, 2, 3)
+
+    def __init__(self, path):
+        self.path = path
+        with open(self.header_path(path), "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        self.logits = np.load(path, mmap_mode="r")
+
+    @staticmethod
+    def header_path(path):
+        return f"{path}.json"
+
+    @classmethod
+    def exists(cls, path, header):
+        """캐시 파일이 있고 헤더가 주어진 조건과 같은지 확인한다."""
+        if not (os.path.exists(path) and os.path.exists(cls.header_path(path))):
+            return False
+        with open(cls.header_path(path), "r", encoding="utf-8") as f:
+            return json.load(f) == header
+
+    @classmethod
+    def build(cls, path, teacher, dataset, header, batch_size=256, device=None, input_transform=None):
+        """
+        데이터셋의 모든 샘플에 대한 teacher logit 을 계산해서 저장한다.
+
+        Args:
+            path (str): 저장할 npy 경로
+            teacher (nn.Module): (mask, gender, age) logit 을 반환하는 모델
+            dataset (Dataset): 샘플 테이블 순서대로 (image, ...) 를 반환하는 결정적인 데이터셋
+            header (dict): 저장 조건 (teacher checkpoint, resize, sample_key 등)
+            batch_size (int): 추론 batch 크기
+            device (torch.device): teacher 를 실행할 device
+            input_transform (callable): device 로 옮긴 이미지 batch 에 적용할 변환
+                (uint8 batch 의 `DeviceNormalize`)
+
+        Returns:
+            TeacherLogits: 만들어진 캐시
+        """
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        if os.path.exists(cls.header_path(path)):
+            os.remove(cls.header_path(path))
+
+        teacher.eval()
+        outputs = []
+        with torch.no_grad():
+            for batch in DataLoader(dataset, batch_size=batch_size, shuffle=False):
+                images = batch[0].to(device)
+                if input_transform is not None:
+                    images = input_transform(images)
+                outs = teacher(images)
+                outputs.append(torch.cat(outs, dim=-1).float().cpu().numpy())
+        logits = np.concatenate(outputs)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, logits)
+        os.replace(tmp_path, path)
+        # 헤더는 logit 파일이 완성된 뒤에 써서, 헤더가 있으면 캐시가 완성된 것으로 본다
+        with open(cls.header_path(path), "w", encoding="utf-8") as f:
+            json.dump(header, f)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.logits)
+
+
+class WithTeacherLogits(Dataset):
+    """
+    학습 `Subset` 의 각 샘플 뒤에 그 샘플의 teacher logit (8,) 을 붙여서 반환하는 데이터셋
+    batch 는 (inputs, labels, mask, gender, age, teacher_logits) 가 됩니다.
+    """
+
+    def __init__(self, subset, logits):
+        """
+        Args:
+            subset (Subset): 원래 학습 데이터셋 (`indices` 가 샘플 테이블의 인덱스)
+            logits (np.ndarray): 샘플 테이블 순서의 (N, 8) teacher logit
+        """
+        self.subset = subset
+        self.logits = logits
+
+    def __getitem__(self, idx):
+        teacher = torch.from_numpy(np.array(self.logits[self.subset.indices[idx]], dtype=np.float32))
+        return (*self.subset[idx], teacher)
+
+    def __getitems__(self, indices):
+        return [self[idx] for idx in indices]
+
+    def __len__(self):
+        return len(self.subset)
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+
+import torch
+
+from data_loader.shm_cache import SharedArrayCache
+
+
+class LRUCache:
+    """
+    바이트 수 상한을 가진 LRU 캐시
+
+    값은 Tensor 이고 `Tensor.nbytes` 의 합이 `max_bytes` 를 넘으면
+    가장 오래 사용되지 않은 항목부터 버립니다.
+    프로세스 안에서만 유지되므로 DataLoader worker 가 없을 때 사용하고,
+    worker 가 있으면 `SharedTensorCache` 를 씁니다.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes (int): 캐시가 차지할 수 있는 최대 바이트 수.
+                0 이면 아무것도 저장하지 않는다.
+        """
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = value.nbytes
+        if size > self.max_bytes:
+            return
+        if key in self.items:
+            self.nbytes -= self.items.pop(key).nbytes
+        while self.nbytes + size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        self.items[key] = value
+        self.nbytes += size
+
+    def clear(self):
+        self.items.clear()
+        self.nbytes = 0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(items={len(self)}, {self.nbytes / 2 ** 20:.1f}/"
+                f"{self.max_bytes / 2 ** 20:.0f} MiB, hit rate {self.hit_rate:.1%})")
+
+
+class SharedTensorCache(SharedArrayCache):
+    """
+    DataLoader worker 들이 함께 쓰는 prefix 결과 캐시
+
+    `LRUCache` 와 같은 get / put / hit_rate 를 제공하지만,
+    같은 모양의 Tensor 를 shared memory slot 에 저장하므로 worker 가 여럿이어도 캐시는 하나이고
+    (상한도 전체에 한 번), hit / miss 는 모든 worker 의 합입니다.
+    """
+
+    def __init__(self, num_samples, example, max_bytes, eviction="clock"):
+        """
+        Args:
+            num_samples (int): 샘플 인덱스의 개수 (key 는 0 이상 num_samples 미만)
+            example (torch.Tensor): 저장할 Tensor 와 같은 모양 / dtype 의 예시 (prefix 결과)
+            max_bytes (int): 캐시가 차지할 수 있는 최대 바이트 수
+            eviction (str): "clock" 또는 "fifo"
+        """
+        super().__init__(num_samples, tuple(example.shape), example.numpy().dtype, max_bytes, eviction)
+
+    def get(self, key):
+        value = super().get(key)
+        return torch.from_numpy(value) if value is not None else None
+
+    def put(self, key, value):
+        super().put(key, value.numpy())
+
+    @property
+    def hits(self):
+        return self.stats()["hits"]
+
+    @property
+    def misses(self):
+        return self.stats()["misses"]
+
+    @property
+    def hit_rate(self):
+        return self.stats()["hit_rate"]
+
+    def __len__(self):
+        return self.stats()["slots"]
+
+    def __repr__(self):
+        stats = self.stats()
+        return (f"{self.__class__.__name__}({stats['slots']}/{stats['num_slots']} slots of "
+                f"{list(self.slot_shape)} {self.dtype}, {self.nbytes / 2 ** 20:.1f} MiB, "
+                f"hit rate {stats['hit_rate']:.1%})")
+
+
+class CachedPipeline:
+    """
+    결정적인 prefix 변환과 random suffix 변환으로 나눈 transform
+
+    `apply(index, read_image)` 는 prefix 결과를 샘플 인덱스로 캐시에 저장해두고,
+    다음부터는 이미지를 읽지도 디코딩하지도 않고 suffix 만 적용합니다.
+    캐시된 Tensor 를 그대로 돌려줄 수 있으므로
+    suffix 는 입력을 in-place 로 바꾸지 않아야 합니다.
+    """
+
+    def __init__(self, prefix, suffix=None, cache=None):
+        """
+        Args:
+            prefix (callable): PIL 이미지를 받는 결정적인 변환
+            suffix (callable): prefix 결과에 적용할 변환 (None 이면 prefix 결과를 그대로 반환)
+            cache (LRUCache or SharedTensorCache): prefix 결과를 저장할 캐시 (None 이면 캐시하지 않음)
+        """
+        self.prefix = prefix
+        self.suffix = suffix
+        self.cache = cache
+
+    def apply(self, index, read_image):
+        """
+        Args:
+            index (int): 데이터셋의 샘플 인덱스 (캐시 key)
+            read_image (callable): index 를 받아 PIL 이미지를 반환하는 함수
+        """
+        value = self.cache.get(index) if self.cache is not None else None
+        if value is None:
+            value = self.prefix(read_image(index))
+            if self.cache is not None:
+                self.cache.put(index, value)
+        return self.suffix(value) if self.suffix is not None else value
+
+    def __call__(self, image):
+        """인덱스 없이 이미지 하나를 변환 (캐시를 사용하지 않음)"""
+        value = self.prefix(image)
+        return self.suffix(value) if self.suffix is not None else value
@@ -0,0 +1,261 @@
+"""
+CPU 코어를 연산 thread 와 DataLoader worker 에 나눠 배정하는 실행 프로파일
+
+OpenMP / MKL 은 처음 import 될 때의 환경 변수로 thread pool 크기를 정하므로,
+`configure` 는 train.py / inference.py 맨 위에서 torch 를 import 하기 전에 호출합니다.
+그래서 이 모듈은 torch 를 import 하지 않고
+(utils 패키지도 torch 를 import 하므로) 최상위에 둡니다.
+
+--exec_profile 형식:
+    none                                 아무것도 바꾸지 않음 (기본값)
+    threads=12,workers=4[,interop=2][,pin=0]
+                                         연산 thread 12개를 앞쪽 코어 12개에,
+                                         worker 4개를 그 다음 코어 4개에 고정
+    auto                                 후보 배분을 짧게 측정해서
+                                         가장 빠른 것을 고르고 host 별로 캐시
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "mask_execution_profile.json")
+
+
+class ExecutionProfile:
+    """
+    연산 thread 수, DataLoader worker 수와 각각을 고정할 CPU 목록
+    """
+
+    def __init__(self, threads, workers=0, interop=None, pin=True, cpus=None):
+        """
+        Args:
+            threads (int): torch intra-op (OpenMP / MKL) thread 수
+            workers (int): DataLoader worker 수
+            interop (int): torch inter-op thread 수 (None 이면 그대로)
+            pin (bool): 학습 프로세스와 worker 를 각자의 코어에 고정할지 여부
+            cpus (list): 나눠 쓸 CPU 목록 (None 이면 현재 프로세스에 허용된 CPU)
+        """
+        cpus = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+        if threads < 1 or workers < 0:
+            raise ValueError(f"threads should be >= 1 and workers >= 0, got threads={threads} workers={workers}")
+        if threads + workers > len(cpus):
+            raise ValueError(f"threads={threads} + workers={workers} needs more than the {len(cpus)} available CPUs")
+        self.threads = threads
+        self.workers = workers
+        self.interop = interop
+        self.pin = pin
+        self.compute_cpus = cpus[:threads]
+        self.worker_cpus = cpus[threads:threads + workers]
+
+    @classmethod
+    def parse(cls, spec):
+        """"threads=12,workers=4,interop=2,pin=0" 형식의 문자열로 프로파일을 만든다."""
+        options = {}
+        for part in spec.split(","):
+            key, _, value = part.partition("=")
+            if key.strip() not in ("threads", "workers", "interop", "pin") or not value:
+                raise ValueError(f"execution profile should look like threads=12,workers=4[,interop=2][,pin=0], "
+                                 f"got {spec}")
+            options[key.strip()] = int(value)
+        if "threads" not in options:
+            raise ValueError(f"execution profile needs threads=N, got {spec}")
+        options["pin"] = bool(options.get("pin", 1))
+        return cls(**options)
+
+    def spec(self):
+        spec = f"threads={self.threads},workers={self.workers}"
+        if self.interop is not None:
+            spec += f",interop={self.interop}"
+        return spec + ("" if self.pin else ",pin=0")
+
+    def set_environment(self):
+        """torch import 전에 OpenMP / MKL thread 수와 thread 고정 방식을 환경 변수로 지정한다."""
+        for var in ENV_VARS:
+            os.environ[var] = str(self.threads)
+        if self.pin:
+            # 사용자가 직접 지정한 값은 존중
+            os.environ.setdefault("OMP_PROC_BIND", "close")
+            os.environ.setdefault("OMP_PLACES", "cores")
+            os.environ.setdefault("KMP_AFFINITY", "granularity=fine,compact,1,0")
+
+    def apply(self):
+        """
+        학습 프로세스를 연산 코어에 고정하고,
+        torch 가 이미 import 되었으면 thread 수도 맞춘다.
+        fork 한 worker 는 이 affinity 를 물려받은 뒤 `worker_init_fn` 에서 자기 코어로 옮겨갑니다.
+        """
+        if self.pin:
+            os.sched_setaffinity(0, self.compute_cpus)
+        torch = sys.modules.get("torch")
+        if torch is None:
+            return
+        torch.set_num_threads(self.threads)
+        if self.interop is not None:
+            try:
+                torch.set_num_interop_threads(self.interop)
+            except RuntimeError as e:  # inter-op pool 이 이미 시작된 경우
+                print(f"Warning: inter-op threads are already set ({e})")
+
+    def worker_init_fn(self, worker_id):
+        """DataLoader worker 를 자기 몫의 코어 하나에 고정한다."""
+        if self.pin and self.worker_cpus:
+            os.sched_setaffinity(0, {self.worker_cpus[worker_id % len(self.worker_cpus)]})
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}({self.spec()}, compute CPUs {self.compute_cpus}, "
+                f"worker CPUs {self.worker_cpus})")
+
+
+class AutoProfile:
+    """
+    캐시된 결과가 없는 --exec_profile auto.
+    데이터셋과 모델이 준비된 뒤 `tune` 으로 배분을 정한다.
+
+    연산 thread 수 후보마다 모델의 한 step
+    (학습은 forward + backward, 추론은 forward) 처리량을 재고,
+    thread 1개로 샘플 하나를 읽는 (디코딩 + augmentation) 처리량을 잽니다.
+    남은 코어를 모두 worker 로 쓰는 배분의 예상 처리량은
+    min(연산 처리량, worker 수 x 샘플 처리량) 이고 (worker 가 없으면 둘을 직렬로 실행),
+    가장 빠른 배분을 고릅니다.
+    결과는 (host, mode, model, resize) 별로 캐시되어
+    다음 실행부터는 torch import 전에 바로 적용됩니다.
+    """
+
+    def __init__(self, key, cache_path, mode):
+        self.key = key
+        self.cache_path = cache_path
+        self.mode = mode
+
+    def tune(self, model_module, resize, batch_size, load_sample=None, steps=2, samples=16, **model_kwargs):
+        """
+        Args:
+            model_module (type): 모델 클래스 (pretrained weight 없이 만든다)
+            resize (tuple): 입력 (height, width)
+            batch_size (int): 한 step 의 batch 크기
+            load_sample (callable): index 를 받아 학습 샘플 하나를 만드는 함수
+                (None 이면 연산만 측정)
+            steps (int): thread 수 후보마다 측정할 step 수
+            samples (int): 샘플 처리량 측정에 읽을 샘플 수
+            **model_kwargs: 모델 생성자에 전달되는 키워드 인자
+
+        Returns:
+            ExecutionProfile: 고른 프로파일 (환경 변수와 affinity 가 적용된 상태)
+        """
+        import inspect
+
+        import torch
+
+        cpus = sorted(os.sched_getaffinity(0))
+        candidates = sorted({n for n in (1, 2, 4, 8, 16, 32, 64, 128) if n < len(cpus)} | {len(cpus)})
+        if load_sample is not None and len(cpus) > 1:
+            candidates = [n for n in candidates if n < len(cpus)] or [len(cpus) - 1]
+
+        load_rate = None
+        if load_sample is not None:
+            torch.set_num_threads(1)
+            load_sample(0)
+            start = time.perf_counter()
+            for index in range(samples):
+                load_sample(index)
+            load_rate = samples / (time.perf_counter() - start)
+
+        if "pretrained" in inspect.signature(model_module).parameters:
+            model_kwargs.setdefault("pretrained", False)
+        model = model_module(**model_kwargs)
+        model.train(self.mode == "train")
+        inputs = torch.randn(batch_size, 3, *resize)
+        rows = []
+        for threads in candidates:
+            torch.set_num_threads(threads)
+            for step in range(1 + steps):
+                if step == 1:
+                    start = time.perf_counter()
+                if self.mode == "train":
+                    outs = model(inputs)
+                    outs = outs if isinstance(outs, (tuple, list)) else (outs,)
+                    sum(out.float().mean() for out in outs).backward()
+                    model.zero_grad(set_to_none=True)
+                else:
+                    with torch.no_grad():
+                        model(inputs)
+            compute_rate = batch_size * steps / (time.perf_counter() - start)
+            workers = len(cpus) - threads if load_rate is not None else 0
+            if load_rate is None:
+                rate = compute_rate
+            elif workers == 0:
+                rate = 1 / (1 / compute_rate + 1 / load_rate)
+            else:
+                rate = min(compute_rate, workers * load_rate)
+            rows.append((rate, threads, workers, compute_rate))
+            print(f"Execution profile: threads={threads:3d} workers={workers:3d} compute {compute_rate:8.1f} "
+                  f"samples/s" + (f", loading {workers * load_rate:8.1f} samples/s" if workers else "")
+                  + f" -> {rate:8.1f} samples/s")
+        del model
+
+        rate, threads, workers, _ = max(rows)
+        profile = ExecutionProfile(threads, workers)
+        profile.set_environment()
+        profile.apply()
+        write_cache(self.cache_path, self.key, {"spec": profile.spec(), "samples_per_sec": rate})
+        print(f"Execution profile: picked {profile.spec()} ({rate:.1f} samples/s), cached in {self.cache_path}")
+        return profile
+
+
+def read_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_cache(path, key, entry):
+    cache = read_cache(path)
+    cache[key] = entry
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def configure(mode, argv=None):
+    """
+    명령행의 --exec_profile 을 읽어서 torch import 전에 환경 변수와 affinity 를 적용한다.
+
+    Args:
+        mode (str): "train" 또는 "eval" (auto 캐시 key 와 측정 방식)
+        argv (list): 명령행 인자 (None 이면 sys.argv)
+
+    Returns:
+        ExecutionProfile, AutoProfile 또는 None: 적용한 프로파일, 아직 측정하지 않은 auto, 또는 none
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--exec_profile", type=str, default="none")
+    parser.add_argument("--exec_profile_cache", type=str, default=None)
+    parser.add_argument("--model", type=str, default=None)
+    parser.add_argument("--resize", nargs=2, type=int, default=None)
+    args, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+
+    if args.exec_profile == "none":
+        return None
+    if args.exec_profile == "auto":
+        cpus = len(os.sched_getaffinity(0))
+        resize = "default" if args.resize is None else f"{args.resize[0]}x{args.resize[1]}"
+        key = f"{socket.gethostname()}/cpu{cpus}|{mode}|{args.model or 'default'}|{resize}"
+        cache_path = args.exec_profile_cache or DEFAULT_CACHE
+        entry = read_cache(cache_path).get(key)
+        if entry is None:
+            return AutoProfile(key, cache_path, mode)
+        profile = ExecutionProfile.parse(entry["spec"])
+        print(f"Execution profile: {profile.spec()} (cached in {cache_path})")
+    else:
+        profile = ExecutionProfile.parse(args.exec_profile)
+    profile.set_environment()
+    profile.apply()
+    return profile
@@ -0,0 +1,47 @@
+import argparse
+
+from model.weights import WeightStore
+
+
+def main(args):
+    store = WeightStore(args.root)
+    if args.names:
+        for name in args.names:
+            if args.from_file is not None:
+                store.add(name, path=args.from_file, source=args.from_file)
+            elif name not in store or args.force:
+                store.fetch(name)
+            store.verify(name, full=True)
+            print(f"{name}: {store.path(name)} ok")
+        return
+
+    # 이름 없이 실행하면 저장소의 모든 weight 를 검증하고 목록을 보여줍니다
+    index = store.read_index()
+    print(f"Weight store {store.root}: {len(index)} entries")
+    for name in store.names():
+        try:
+            store.verify(name, full=True)
+            status = "ok"
+        except RuntimeError as e:
+            status = str(e)
+        entry = index[name]
+        print(f"  {name:24} {entry['size'] / 2 ** 20:7.1f} MiB  sha256 {entry['sha256'][:12]}  "
+              f"source {entry['source']}  {status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="populate and verify the local pretrained weight store used by model/model.py. "
+                    "run once on a host with network access (or with --from_file), training then works offline"
+    )
+    parser.add_argument(
+        "names", nargs="*", help="timm model names to add, e.g. efficientnet_b0 (none: list and verify the store)"
+    )
+    parser.add_argument(
+        "--root", type=str, default=None, help="store directory (default: $MASK_WEIGHTS_DIR or ~/.cache/mask_weights)"
+    )
+    parser.add_argument("--from_file", type=str, default=None, help="add a state_dict file instead of downloading")
+    parser.add_argument("--force", action="store_true", help="download again even if the weights are in the store")
+    args = parser.parse_args()
+
+    main(args)
@@ -1,18 +1,26 @@
 import argparse
 import os
-import pandas as pd
+import time
+
+# --exec_profile 의 OpenMP / MKL thread 수와 CPU affinity 는 torch 를 import 하기 전에 적용해야 합니다
+import execution_profile
+EXECUTION_PROFILE = execution_profile.configure("eval") if __name__ == "__main__" else None
+
 from PIL import Image
 from tqdm import tqdm
 
-import data_loader.data_loaders as module_data
-import model.loss as module_loss
-import model.metric as module_metric
-import model.model as module_arch
+from model.cascade import CascadeThresholds, decode_labels
+from model.weights import load_trained_model
+from utils.autotune import BatchSizeTuner
+from utils.prediction_cache import PredictionCache, prediction_context
+from utils.registry import MODELS
 
+import numpy as np
 import torch
-from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms
-from torchvision.transforms import Resize, ToTensor, Normalize
+from torch.utils.data import Dataset, DataLoader, Subset
+
+# 추론 입력 정규화 값 (calibrate_cascade.py 도 같은 값으로 threshold 를 정합니다)
+INFERENCE_MEAN, INFERENCE_STD = (0.548, 0.504, 0.497), (0.237, 0.247, 0.246)
 
 
 class TestDataset(Dataset):
@@ -31,50 +39,186 @@ class TestDataset(Dataset):
         return len(self.img_paths)
     
 
+def predict(model, loader, device, multi_head, tta="none", input_transform=None):
+    """
+    loader 의 이미지들을 예측한다.
+
+    Args:
+        tta (str): "none" 또는 "hflip" (좌우 반전한 이미지의 logit 과 평균)
+        input_transform (callable): device 로 옮긴 batch 에 적용할 변환 (uint8 batch 의 `DeviceNormalize`)
+
+    Returns:
+        tuple: (예측 클래스 np.ndarray, 모든 head 의 logit 을 이어 붙인 (N, C) np.ndarray)
+    """
+    all_predictions, all_logits = [], []
+    with torch.no_grad():
+        for images in tqdm(loader):
+            images = images.to(device)
+            if input_transform is not None:
+                images = input_transform(images)
+            outs = model(images)
+            if tta == "hflip":
+                flipped = model(torch.flip(images, dims=[-1]))
+                outs = tuple((out + out_flipped) / 2 for out, out_flipped in zip(outs, flipped)) \
+                    if multi_head else (outs + flipped) / 2
+
+            if multi_head:
+                pred_mask, pred_gender, pred_age = outs
+                pred = (
+                    torch.argmax(pred_mask, dim=-1) * 6
+                    + torch.argmax(pred_gender, dim=-1) * 3
+                    + torch.argmax(pred_age, dim=-1)
+                )
+                logits = torch.cat(outs, dim=-1)
+            else:
+                pred = outs.argmax(dim=-1)
+                logits = outs
+            all_predictions.append(pred.cpu().numpy())
+            all_logits.append(logits.float().cpu().numpy())
+    return np.concatenate(all_predictions), np.concatenate(all_logits)
+
+
+def predict_ensemble(models, loader, device, multi_head, tta="none", input_transform=None):
+    """
+    여러 모델의 logit 을 평균해서 예측한다. 모델이 하나면 `predict` 와 같습니다.
+
+    Returns:
+        tuple: (예측 클래스 np.ndarray, 평균 logit np.ndarray)
+    """
+    if len(models) == 1:
+        return predict(models[0], loader, device, multi_head, tta, input_transform)
+    logits = np.mean([predict(model, loader, device, multi_head, tta, input_transform)[1] for model in models], axis=0)
+    return decode_labels(logits, multi_head), logits
+
+
+def predict_cascade(cheap_model, models, dataset, thresholds, device, multi_head, tta="none", batch_size=100,
+                    input_transform=None):
+    """
+    작은 모델로 먼저 예측하고,
+    head confidence 가 threshold 에 못 미치는 샘플만 모아서 큰 모델(들)로 다시 예측한다.
+
+    Args:
+        cheap_model (nn.Module): 먼저 실행할 작은 모델
+        models (list): 확신이 낮은 샘플을 넘길 큰 모델 또는 ensemble
+        dataset (Dataset): 이미지 데이터셋
+        thresholds (CascadeThresholds): head 별 confidence threshold
+
+    Returns:
+        tuple: (예측 클래스, logit, 큰 모델로 넘긴 샘플의 인덱스 np.ndarray)
+    """
+    labels, logits = predict(cheap_model, DataLoader(dataset, batch_size=batch_size, shuffle=False), device,
+                             multi_head, tta, input_transform)
+    escalated = np.flatnonzero(~thresholds.accept(logits))
+    if len(escalated):
+        loader = DataLoader(Subset(dataset, escalated), batch_size=batch_size, shuffle=False)
+        labels[escalated], logits[escalated] = predict_ensemble(models, loader, device, multi_head, tta,
+                                                                input_transform)
+    return labels, logits, escalated
+
+
 def main(config):
-    device = torch.device('cuda')
+    # --help 등 추론하지 않는 실행에서는 import 하지 않음
+    import pandas as pd
+    from torchvision import transforms
+    from torchvision.transforms import Resize, ToTensor, PILToTensor, Normalize
+    from data_loader.augmentations import DeviceNormalize
+
+    mean, std = INFERENCE_MEAN, INFERENCE_STD
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
     # meta 데이터와 이미지 경로를 불러옵니다.
     submission = pd.read_csv(os.path.join(config.test_dir, 'info.csv'))
     image_dir = os.path.join(config.test_dir, 'images')
     image_paths = [os.path.join(image_dir, img_id) for img_id in submission.ImageID]
 
-    # Test Dataset 클래스 객체를 생성하고 DataLoader를 만듭니다.
-    transform = transforms.Compose([
-        Resize(config.resize, Image.BILINEAR),
-        ToTensor(),
-        Normalize(mean=(0.548, 0.504, 0.497), std=(0.237, 0.247, 0.246))
-    ])
-    dataset = TestDataset(image_paths, transform)
-
-    loader = DataLoader(
-        dataset,
-        batch_size=config.batch_size,
-        shuffle=False
-    )
-
-    # 모델을 정의합니다. (학습한 모델이 있다면 torch.load로 모델을 불러주세요!)
-    model_module = getattr(module_arch, config.model)
-    model = model_module(num_classes=18).to(device)
-    model.load_state_dict(torch.load(config.model_path, map_location=device))
-    model.eval()
-
-    # 모델이 테스트 데이터셋을 예측하고 결과를 저장합니다.
-    all_predictions = []
-    for images in tqdm(loader):
-        with torch.no_grad():
-            images = images.to(device)
+    # 이미지 내용과 checkpoint / resize / TTA 가 같은 예측은 캐시에서 가져오고
+    # 나머지만 추론합니다
+    cache = None
+    if not config.no_prediction_cache:
+        cache = PredictionCache(config.prediction_cache)
+        digests = cache.file_digests(image_paths)
+        settings = dict(
+            checkpoint=",".join(digest.hex() for digest in cache.file_digests(config.model_path)),
+            model=config.model,
+            resize=list(config.resize),
+            tta=config.tta,
+            multi_head=bool(config.multi_head),
+        )
+        if config.cascade_path:
+            settings["cascade"] = dict(
+                checkpoint=cache.file_digests([config.cascade_path])[0].hex(),
+                model=config.cascade_model,
+                thresholds=CascadeThresholds.load(config.cascade_thresholds).thresholds,
+            )
+        context = prediction_context(**settings)
+        predictions = cache.get_many(context, digests)
+        # 내용이 같은 이미지는 한 번만 추론
+        todo = list({digest: i for i, digest in enumerate(digests) if digest not in predictions}.values())
+    else:
+        digests = list(range(len(image_paths)))
+        predictions = {}
+        todo = digests
 
-            if config.multi_head:
-                pred = model(images)
-                pred_mask, pred_gender, pred_age = pred
-                pred = torch.argmax(pred_mask, dim=-1) * 6 + torch.argmax(pred_gender, dim=-1) * 3 + torch.argmax(pred_age, dim=-1)
-                all_predictions.extend(pred.cpu().numpy())
-            else:
-                pred = model(images)
-                pred = pred.argmax(dim=-1)
-                all_predictions.extend(pred.cpu().numpy())
-    submission['ans'] = all_predictions
+    if todo:
+        # Test Dataset 클래스 객체를 생성하고 DataLoader를 만듭니다.
+        # --uint8_transport 이면 uint8 이미지를 옮긴 뒤 device 에서 batch 단위로 정규화합니다
+        input_transform = None
+        if config.uint8_transport:
+            transform = transforms.Compose([Resize(config.resize, Image.BILINEAR), PILToTensor()])
+            input_transform = DeviceNormalize(mean, std, channels_last=config.channels_last).to(device)
+        else:
+            transform = transforms.Compose([
+                Resize(config.resize, Image.BILINEAR),
+                ToTensor(),
+                Normalize(mean=mean, std=std)
+            ])
+        dataset = TestDataset([image_paths[i] for i in todo], transform)
+        if isinstance(EXECUTION_PROFILE, execution_profile.AutoProfile):
+            profile = EXECUTION_PROFILE.tune(MODELS.get(config.model), config.resize, config.batch_size, num_classes=18)
+            print(f"Execution profile: {profile}")
+        if config.autotune:
+            tuner = BatchSizeTuner(device, memory_limit_mb=config.autotune_memory_mb)
+            config.batch_size = tuner.tune(config.model, MODELS.get(config.model), config.resize, "eval",
+                                           num_classes=18)
+
+        # 모델을 정의합니다. (여러 checkpoint 를 주면 logit 을 평균하는 ensemble 입니다)
+        models = [
+            load_trained_model(MODELS.get(config.model), path, device, num_classes=18) for path in config.model_path
+        ]
+        if config.channels_last:
+            models = [model.to(memory_format=torch.channels_last) for model in models]
+
+        # 모델이 테스트 데이터셋을 예측하고 결과를 저장합니다.
+        start = time.perf_counter()
+        if config.cascade_path:
+            cheap_model = load_trained_model(
+                MODELS.get(config.cascade_model), config.cascade_path, device, num_classes=18
+            )
+            if config.channels_last:
+                cheap_model = cheap_model.to(memory_format=torch.channels_last)
+            thresholds = CascadeThresholds.load(config.cascade_thresholds)
+            labels, logits, escalated = predict_cascade(
+                cheap_model, models, dataset, thresholds, device, config.multi_head, config.tta, config.batch_size,
+                input_transform,
+            )
+            print(f"Cascade: {len(escalated)}/{len(dataset)} images ({len(escalated) / len(dataset):.1%}) "
+                  f"escalated to {config.model} x{len(models)}, {thresholds}")
+        else:
+            loader = DataLoader(dataset, batch_size=config.batch_size, shuffle=False)
+            labels, logits = predict_ensemble(models, loader, device, config.multi_head, config.tta, input_transform)
+        elapsed = time.perf_counter() - start
+        print(f"Inferred {len(dataset)} images in {elapsed:.1f}s ({len(dataset) / elapsed:.1f} images/s)")
+        todo_digests = [digests[i] for i in todo]
+        predictions.update(zip(todo_digests, zip(labels, logits)))
+        if cache is not None:
+            cache.put_many(context, todo_digests, labels, logits)
+
+    if cache is not None:
+        print(f"Prediction cache: {cache.hits}/{len(image_paths)} hits ({cache.hit_rate:.1%}), "
+              f"{len(todo)} images inferred")
+        cache.close()
+    submission['ans'] = [int(predictions[digest][0]) for digest in digests]
 
     # 제출할 파일을 저장합니다.
     submission.to_csv(os.path.join(config.test_dir, 'submission.csv'), index=False)
@@ -107,8 +251,10 @@ if __name__ == '__main__':
     parser.add_argument(
         "--model_path",
         type=str,
-        default="/data/ephemeral/home/model/exp/best.pth",
-        help="사용할 모델의 weight 경로를 입력해주세요 (예: /data/ephemeral/home/model/exp/best.pth)"
+        nargs="+",
+        default=["/data/ephemeral/home/model/exp/best.pth"],
+        help="사용할 모델의 weight 경로를 입력해주세요 (예: /data/ephemeral/home/model/exp/best.pth), "
+             "여러 개면 logit 을 평균하는 ensemble",
     )
     parser.add_argument(
         "--batch_size",
@@ -116,7 +262,82 @@ if __name__ == '__main__':
         default=100,
         help="input batch size for validing (default: 1000)",
     )
+    parser.add_argument(
+        "--uint8_transport",
+        action="store_true",
+        help="uint8 이미지를 device 로 옮긴 뒤 batch 단위로 정규화 (복사량이 float32 의 1/4)",
+    )
+    parser.add_argument(
+        "--channels_last",
+        action="store_true",
+        help="--uint8_transport 와 함께, batch 와 모델을 channels_last 메모리 순서로 실행",
+    )
+    parser.add_argument(
+        "--exec_profile",
+        type=str,
+        default="none",
+        help="CPU threads for inference, pinned and applied before torch is imported: none, threads=N[,pin=0] "
+             "or auto (measures a few thread counts once per host, model and resize) (default: none)",
+    )
+    parser.add_argument(
+        "--exec_profile_cache",
+        type=str,
+        default=None,
+        help="json file of --exec_profile auto results (default: ~/.cache/mask_execution_profile.json)",
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="replace --batch_size by the batch size with the highest measured images/s on this host (cached)",
+    )
+    parser.add_argument(
+        "--autotune_memory_mb",
+        type=float,
+        default=None,
+        help="memory ceiling of the autotune probes in MiB (default: 90%% of the GPU memory, half of RAM on CPU)",
+    )
+    parser.add_argument(
+        "--tta",
+        type=str,
+        default="none",
+        choices=["none", "hflip"],
+        help="test time augmentation policy (default: none)",
+    )
+    parser.add_argument(
+        "--prediction_cache",
+        type=str,
+        default=None,
+        help="sqlite file of cached predictions (default: ~/.cache/mask_predictions.sqlite)",
+    )
+    parser.add_argument(
+        "--no_prediction_cache",
+        action="store_true",
+        help="predict every image without reading or writing the prediction cache",
+    )
+    parser.add_argument(
+        "--cascade_model",
+        type=str,
+        default="SlimCNNMultiHead",
+        help="cascade 에서 먼저 실행할 작은 모델 type (default: SlimCNNMultiHead)",
+    )
+    parser.add_argument(
+        "--cascade_path",
+        type=str,
+        default=None,
+        help="작은 모델의 weight 경로, 주면 확신이 낮은 이미지만 --model 로 다시 예측 "
+        "(default: cascade 사용 안 함)",
+    )
+    parser.add_argument(
+        "--cascade_thresholds",
+        type=str,
+        default=None,
+        help="calibrate_cascade.py 로 만든 threshold json (default: {cascade_path}.thresholds.json)",
+    )
     args = parser.parse_args()
+    if args.channels_last and not args.uint8_transport:
+        parser.error("--channels_last converts the batches in the device normalization, use --uint8_transport")
+    if args.cascade_path and args.cascade_thresholds is None:
+        args.cascade_thresholds = f"{args.cascade_path}.thresholds.json"
     print(args)
 
     main(args)
@@ -0,0 +1,111 @@
+import json
+
+import numpy as np
+
+
+HEADS = {"mask": 3, "gender": 2, "age": 3}
+
+
+def head_probabilities(logits, multi_head=True):
+    """
+    이어 붙인 logit 을 head 별 softmax 확률로 나눈다.
+
+    Args:
+        logits (np.ndarray): (N, 8) mask / gender / age logit 또는 (N, 18) logit
+        multi_head (bool): logit 이 head 3개를 이어 붙인 것인지 여부
+
+    Returns:
+        dict: head 이름 -> (N, head 클래스 수) 확률. multi_head 가 아니면 {"multi": (N, 18)}
+    """
+    logits = np.asarray(logits, dtype=np.float64)
+    sizes = HEADS if multi_head else {"multi": logits.shape[-1]}
+    probs, offset = {}, 0
+    for head, size in sizes.items():
+        head_logits = logits[:, offset:offset + size]
+        head_logits = head_logits - head_logits.max(axis=1, keepdims=True)
+        exp = np.exp(head_logits)
+        probs[head] = exp / exp.sum(axis=1, keepdims=True)
+        offset += size
+    return probs
+
+
+def decode_labels(logits, multi_head=True):
+    """이어 붙인 logit 에서 18 클래스 예측을 구한다."""
+    if not multi_head:
+        return np.asarray(logits).argmax(axis=1)
+    probs = head_probabilities(logits)
+    return probs["mask"].argmax(axis=1) * 6 + probs["gender"].argmax(axis=1) * 3 + probs["age"].argmax(axis=1)
+
+
+class CascadeThresholds:
+    """
+    작은 모델의 예측을 그대로 받아들일 head 별 최소 confidence (softmax 최댓값)
+
+    모든 head 의 confidence 가 threshold 이상인 샘플만 작은 모델의 예측을 쓰고,
+    나머지는 큰 모델로 넘깁니다.
+    threshold 는 검증 데이터에서 받아들인 샘플의 head 정확도가
+    목표 precision 이상이 되는 가장 낮은 값으로 정합니다.
+    """
+
+    def __init__(self, thresholds, multi_head=True, meta=None):
+        """
+        Args:
+            thresholds (dict): head 이름 -> threshold
+            multi_head (bool): 작은 모델이 head 3개를 가지는지 여부
+            meta (dict): 보정에 쓴 모델, 목표 precision, 검증 결과 등 기록용 정보
+        """
+        self.thresholds = thresholds
+        self.multi_head = multi_head
+        self.meta = meta or {}
+
+    @classmethod
+    def calibrate(cls, logits, labels, target=0.99, multi_head=True, meta=None):
+        """
+        검증 데이터에서 head 별 threshold 를 정한다.
+
+        Args:
+            logits (np.ndarray): 작은 모델의 검증 데이터 logit
+            labels (np.ndarray): 18 클래스 정답
+            target (float): 받아들인 샘플의 head 별 목표 정확도
+            multi_head (bool): logit 이 head 3개를 이어 붙인 것인지 여부
+
+        Returns:
+            CascadeThresholds: 보정된 threshold
+        """
+        labels = np.asarray(labels)
+        head_labels = {"mask": (labels // 6) % 3, "gender": (labels // 3) % 2, "age": labels % 3, "multi": labels}
+        thresholds = {}
+        for head, probs in head_probabilities(logits, multi_head).items():
+            confidence = probs.max(axis=1)
+            correct = probs.argmax(axis=1) == head_labels[head]
+            # confidence 내림차순으로 받아들일 때
+            # 누적 정확도가 target 이상인 가장 긴 prefix 의 끝 confidence
+            order = np.argsort(-confidence, kind="stable")
+            precision = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+            passing = np.flatnonzero(precision >= target)
+            thresholds[head] = float(confidence[order][passing[-1]]) if len(passing) else 1.0 + 1e-6
+        return cls(thresholds, multi_head, dict(meta or {}, target=target))
+
+    def accept(self, logits):
+        """
+        Returns:
+            np.ndarray: (N,) bool, 모든 head 가 threshold 를 넘어 작은 모델의 예측을 쓸 샘플
+        """
+        accepted = np.ones(len(logits), dtype=bool)
+        for head, probs in head_probabilities(logits, self.multi_head).items():
+            accepted &= probs.max(axis=1) >= self.thresholds[head]
+        return accepted
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"thresholds": self.thresholds, "multi_head": self.multi_head, "meta": self.meta}, f, indent=4)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+        return cls(content["thresholds"], content["multi_head"], content.get("meta"))
+
+    def __repr__(self):
+        values = ", ".join(f"{head} {value:.4f}" for head, value in self.thresholds.items())
+        return f"{self.__class__.__name__}({values})"
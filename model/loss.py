@@ -3,6 +3,149 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 
+# batch 가 이보다 작으면 fused Function 대신
+# 같은 식 (정답 클래스 항 gather, closed form smoothing) 을 autograd 로 계산합니다.
+# (batch 64 에서는 Function 호출 자체의 오버헤드가 커서 fused 쪽이 더 느립니다)
+_FUSED_MIN_BATCH = 1024
+
+
+def _reduce(loss, reduction, denominator):
+    if reduction == "none":
+        return loss
+    if reduction == "sum":
+        return loss.sum()
+    return loss.sum() / denominator
+
+
+class _FocalLossFunction(torch.autograd.Function):
+    """
+    focal loss -w[t] * (1 - p_t) ^ gamma * log p_t 의 forward / backward 를 직접 계산하는 함수
+
+    nll_loss 는 정답 클래스 항만 쓰므로
+    (N, C) 크기로는 log_softmax 하나만 만들고 나머지는 (N,) 크기로 계산합니다.
+    backward 는 d log p_t / dx = onehot(t) - p 이므로
+    샘플별 계수 c 로 -c * p 를 만들고 정답 클래스에 c 를 더합니다.
+    """
+
+    @staticmethod
+    def forward(ctx, logits, target, gamma, weight, reduction):
+        log_prob = F.log_softmax(logits, dim=-1)
+        log_pt = log_prob.gather(1, target.unsqueeze(1)).squeeze(1)
+        # p_t 가 1 에 가까울 때도 정확하도록 1 - p_t 를 -expm1(log p_t) 로 계산
+        one_minus_pt = torch.expm1(log_pt).neg_().clamp_(min=0)
+        loss = one_minus_pt.pow(gamma).mul_(log_pt).neg_()
+        scale = weight[target] if weight is not None else None
+        if scale is not None:
+            loss.mul_(scale)
+        ctx.gamma = gamma
+        ctx.reduction = reduction
+        ctx.save_for_backward(log_prob, target, log_pt, one_minus_pt, scale)
+        # nll_loss 와 같이 weight 가 있으면 mean 은 정답 클래스 weight 의 합으로 나눈다
+        return _reduce(loss, reduction, scale.sum() if scale is not None else target.numel())
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        log_prob, target, log_pt, one_minus_pt, scale = ctx.saved_tensors
+        gamma = ctx.gamma
+        # d loss / d log p_t = -(1 - p_t) ^ gamma + gamma * (1 - p_t) ^ (gamma - 1) * p_t * log p_t
+        coef = one_minus_pt.pow(gamma).neg_()
+        if gamma != 0:
+            focal_grad = torch.where(one_minus_pt > 0, one_minus_pt.pow(gamma - 1), 0.0)
+            coef.add_(focal_grad.mul_(log_pt.exp()).mul_(log_pt), alpha=gamma)
+        if scale is not None:
+            coef.mul_(scale)
+        if ctx.reduction == "mean":
+            grad_output = grad_output / (scale.sum() if scale is not None else target.numel())
+        coef.mul_(grad_output)  # sum / mean 은 scalar, none 은 (N,)
+
+        grad = log_prob.exp().mul_(coef.neg().unsqueeze(1))
+        grad.scatter_add_(1, target.unsqueeze(1), coef.unsqueeze(1))
+        return grad, None, None, None, None
+
+
+class _LabelSmoothingFunction(torch.autograd.Function):
+    """
+    label smoothing loss -sum_j q_j * log p_j 의 closed form forward / backward
+
+    q 는 정답 클래스에 on = 1 - smoothing, 나머지 클래스에 off = smoothing / (classes - 1) 이므로
+    loss = -(off * sum_j log p_j + (on - off) * log p_t) 이고, dense 한 q 를 만들지 않습니다.
+    backward 는 dloss / dx = sum(q) * p - q 입니다.
+    """
+
+    @staticmethod
+    def forward(ctx, logits, target, classes, smoothing, dim, reduction):
+        off = smoothing / (classes - 1)
+        on = 1.0 - smoothing
+        log_prob = F.log_softmax(logits, dim=dim)
+        loss = log_prob.sum(dim=dim).mul_(-off)
+        loss.sub_(log_prob.gather(dim, target.unsqueeze(dim)).squeeze(dim), alpha=on - off)
+        ctx.on, ctx.off, ctx.dim, ctx.reduction = on, off, dim, reduction
+        ctx.save_for_backward(log_prob, target)
+        return _reduce(loss, reduction, target.numel())
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        log_prob, target = ctx.saved_tensors
+        on, off, dim = ctx.on, ctx.off, ctx.dim
+        coef = grad_output / target.numel() if ctx.reduction == "mean" else grad_output
+        coef = coef.unsqueeze(dim) if coef.dim() else coef
+
+        total = off * log_prob.size(dim) + (on - off)  # sum(q)
+        grad = log_prob.exp().mul_(total).sub_(off).mul_(coef)
+        target_grad = torch.full_like(target, -(on - off), dtype=grad.dtype).unsqueeze(dim).mul_(coef)
+        grad.scatter_add_(dim, target.unsqueeze(dim), target_grad)
+        return grad, None, None, None, None, None
+
+
+def _soft_f1_loss(tp, predicted, actual, epsilon):
+    """클래스별 tp, tp + fp, tp + fn 으로 1 - macro F1 을 계산한다."""
+    precision = tp / (predicted + epsilon)
+    recall = tp / (actual + epsilon)
+    f1 = 2 * (precision * recall) / (precision + recall + epsilon)
+    f1 = f1.clamp(min=epsilon, max=1 - epsilon)
+    return 1 - f1.mean()
+
+
+class _SoftF1Function(torch.autograd.Function):
+    """
+    softmax 확률로 계산한 batch 의 1 - macro F1
+
+    one-hot 과 (N, C) 크기의 곱들을 만들지 않고,
+    tp 는 정답 클래스 확률을 클래스별로 `index_add_` 해서, tp + fp 는 확률의 열 합으로,
+    tp + fn 은 `bincount` 로 센 클래스별 샘플 수로 계산합니다.
+    backward 는 (C,) 크기의 F1 식만 autograd 로 미분하고,
+    확률과 logit 으로의 전파는 직접 계산합니다.
+    """
+
+    @staticmethod
+    def forward(ctx, logits, target, epsilon):
+        classes = logits.size(-1)
+        prob = F.softmax(logits, dim=1)
+        pt = prob.gather(1, target.unsqueeze(1)).squeeze(1)
+        tp = torch.zeros(classes, dtype=prob.dtype, device=prob.device).index_add_(0, target, pt)
+        predicted = prob.sum(dim=0)  # tp + fp
+        actual = torch.bincount(target, minlength=classes).to(prob.dtype)  # tp + fn
+        ctx.epsilon = epsilon
+        ctx.save_for_backward(prob, target, pt, tp, predicted, actual)
+        return _soft_f1_loss(tp, predicted, actual, epsilon)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        prob, target, pt, tp, predicted, actual = ctx.saved_tensors
+        with torch.enable_grad():
+            tp = tp.detach().requires_grad_(True)
+            predicted = predicted.detach().requires_grad_(True)
+            loss = _soft_f1_loss(tp, predicted, actual, ctx.epsilon)
+        d_tp, d_predicted = torch.autograd.grad(loss, (tp, predicted), grad_output)
+
+        # dloss / dp_ic = d_predicted_c + [c == t_i] * d_tp_c 를 softmax backward p * (g - sum_c p_c * g_c) 로 전파
+        target_grad = d_tp[target].mul_(pt)
+        dot = prob.mv(d_predicted).add_(target_grad)
+        grad = (d_predicted.unsqueeze(0) - dot.unsqueeze(1)).mul_(prob)
+        grad.scatter_add_(1, target.unsqueeze(1), target_grad.unsqueeze(1))
+        return grad, None, None
+
+
 # Focal Loss 구현
 # 이는 불균형한 데이터셋에서 사용되며, 잘못 분류된 샘플에 더 많은 중요도를 부여한다.
 # https://discuss.pytorch.org/t/is-this-a-correct-implementation-for-focal-loss-in-pytorch/43327/8
@@ -14,14 +157,22 @@ class FocalLoss(nn.Module):
         self.reduction = reduction
 
     def forward(self, input_tensor, target_tensor):
-        log_prob = F.log_softmax(input_tensor, dim=-1)
-        prob = torch.exp(log_prob)
-        return F.nll_loss(
-            ((1 - prob) ** self.gamma) * log_prob,
-            target_tensor,
-            weight=self.weight,
-            reduction=self.reduction,
-        )
+        return self._loss(input_tensor, target_tensor, self.reduction)
+
+    def sample_loss(self, input_tensor, target_tensor):
+        """reduction 없이 샘플별 focal loss 를 반환한다."""
+        return self._loss(input_tensor, target_tensor, "none")
+
+    def _loss(self, input_tensor, target_tensor, reduction):
+        if input_tensor.size(0) >= _FUSED_MIN_BATCH:
+            return _FocalLossFunction.apply(input_tensor, target_tensor, self.gamma, self.weight, reduction)
+        # 부호는 reduction 뒤에 한 번만 바꿉니다 (mean / sum 이면 scalar 연산)
+        log_pt = F.log_softmax(input_tensor, dim=-1).gather(1, target_tensor.unsqueeze(1)).squeeze(1)
+        log_likelihood = (1 - log_pt.exp()) ** self.gamma * log_pt
+        if self.weight is None:
+            return -_reduce(log_likelihood, reduction, target_tensor.numel())
+        scale = self.weight[target_tensor]
+        return -_reduce(log_likelihood * scale, reduction, scale.sum())
 
 
 # Label Smoothing Loss 구현
@@ -35,12 +186,23 @@ class LabelSmoothingLoss(nn.Module):
         self.dim = dim
 
     def forward(self, pred, target):
-        pred = pred.log_softmax(dim=self.dim)
-        with torch.no_grad():
-            true_dist = torch.zeros_like(pred)
-            true_dist.fill_(self.smoothing / (self.cls - 1))
-            true_dist.scatter_(1, target.data.unsqueeze(1), self.confidence)
-        return torch.mean(torch.sum(-true_dist * pred, dim=self.dim))
+        if pred.size(0) >= _FUSED_MIN_BATCH:
+            return _LabelSmoothingFunction.apply(pred, target, self.cls, self.smoothing, self.dim, "mean")
+        return -self._log_likelihood(pred.log_softmax(dim=self.dim), target).mean()
+
+    def sample_loss(self, pred, target, log_prob=False):
+        """reduction 없이 샘플별 label smoothing loss 를 반환한다."""
+        if not log_prob:
+            if pred.size(0) >= _FUSED_MIN_BATCH:
+                return _LabelSmoothingFunction.apply(pred, target, self.cls, self.smoothing, self.dim, "none")
+            pred = pred.log_softmax(dim=self.dim)
+        return -self._log_likelihood(pred, target)
+
+    def _log_likelihood(self, log_prob, target):
+        """closed form 의 sum_j q_j * log p_j = off * sum_j log p_j + (on - off) * log p_t"""
+        off = self.smoothing / (self.cls - 1)
+        target_log_prob = log_prob.gather(self.dim, target.unsqueeze(self.dim)).squeeze(self.dim)
+        return torch.add(log_prob.sum(dim=self.dim).mul(off), target_log_prob, alpha=self.confidence - off)
 
 
 # F1 Score 손실 함수 구현
@@ -55,21 +217,50 @@ class F1Loss(nn.Module):
     def forward(self, y_pred, y_true):
         assert y_pred.ndim == 2
         assert y_true.ndim == 1
+        if y_pred.size(0) >= _FUSED_MIN_BATCH:
+            return _SoftF1Function.apply(y_pred, y_true, self.epsilon)
         classes = y_pred.size(-1)
-        y_true = F.one_hot(y_true, classes).to(torch.float32)
-        y_pred = F.softmax(y_pred, dim=1)
+        prob = F.softmax(y_pred, dim=1)
+        tp = torch.zeros(classes, dtype=prob.dtype, device=prob.device).index_add_(
+            0, y_true, prob.gather(1, y_true.unsqueeze(1)).squeeze(1)
+        )
+        actual = torch.bincount(y_true, minlength=classes).to(prob.dtype)
+        return _soft_f1_loss(tp, prob.sum(dim=0), actual, self.epsilon)
 
-        tp = (y_true * y_pred).sum(dim=0).to(torch.float32)
-        tn = ((1 - y_true) * (1 - y_pred)).sum(dim=0).to(torch.float32)
-        fp = ((1 - y_true) * y_pred).sum(dim=0).to(torch.float32)
-        fn = (y_true * (1 - y_pred)).sum(dim=0).to(torch.float32)
+    def sample_loss(self, y_pred, y_true):
+        """
+        F1 은 batch 단위 지표라 샘플별로 나눌 수 없으므로,
+        정답 클래스에 주지 못한 확률 1 - p(target) 을 샘플별 loss 로 사용한다.
+        (tp 를 줄이고 fp / fn 을 늘리는 정도에 비례)
+        """
+        prob = F.softmax(y_pred, dim=1)
+        return 1 - prob.gather(1, y_true.unsqueeze(1)).squeeze(1)
 
-        precision = tp / (tp + fp + self.epsilon)
-        recall = tp / (tp + fn + self.epsilon)
 
-        f1 = 2 * (precision * recall) / (precision + recall + self.epsilon)
-        f1 = f1.clamp(min=self.epsilon, max=1 - self.epsilon)
-        return 1 - f1.mean()
+def per_sample_loss(criterion, input_tensor, target_tensor):
+    """
+    reduction 없이 샘플별 손실을 계산한다. (loss 기반 sampler 가 사용)
+
+    Args:
+        criterion (nn.Module): `create_criterion` 으로 만든 손실 함수 객체
+        input_tensor (torch.Tensor): (N, C) logit
+        target_tensor (torch.Tensor): (N,) 정답 클래스
+
+    Returns:
+        torch.Tensor: (N,) 샘플별 손실
+    """
+    if isinstance(criterion, nn.CrossEntropyLoss):
+        return F.cross_entropy(
+            input_tensor,
+            target_tensor,
+            weight=criterion.weight,
+            ignore_index=criterion.ignore_index,
+            reduction="none",
+            label_smoothing=criterion.label_smoothing,
+        )
+    if hasattr(criterion, "sample_loss"):
+        return criterion.sample_loss(input_tensor, target_tensor)
+    raise RuntimeError("Per-sample loss is not supported for %s" % type(criterion).__name__)
 
 
 # 사용 가능한 손실 함수의 진입점
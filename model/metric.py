@@ -1,4 +1,8 @@
+import numpy as np
 import torch
+import torch.nn.functional as F
+
+from utils import all_reduce_sum
 
 
 def accuracy(output, target):
@@ -14,7 +18,175 @@ def top_k_acc(output, target, k=3):
     with torch.no_grad():
         pred = torch.topk(output, k, dim=1)[1]
         assert pred.shape[0] == len(target)
-        correct = 0
-        for i in range(k):
-            correct += torch.sum(pred[:, i] == target).item()
+        correct = (pred == target.unsqueeze(1)).any(dim=1).sum().item()
     return correct / len(target)
+
+
+def multi_head_logits(pred_mask, pred_gender, pred_age):
+    """
+    mask / gender / age head 의 출력을 18 클래스의 결합 log 확률로 합친다.
+    클래스 순서는 `MaskBaseDataset.encode_multi_class` (mask * 6 + gender * 3 + age) 와 같고,
+    argmax 는 head 별 argmax 를 인코딩한 값과 같습니다.
+
+    Returns:
+        Tensor: (batch, 18) 결합 log 확률
+    """
+    log_mask = F.log_softmax(pred_mask.float(), dim=-1)
+    log_gender = F.log_softmax(pred_gender.float(), dim=-1)
+    log_age = F.log_softmax(pred_age.float(), dim=-1)
+    joint = log_mask[:, :, None, None] + log_gender[:, None, :, None] + log_age[:, None, None, :]
+    return joint.reshape(joint.size(0), -1)
+
+
+class StreamingMetrics:
+    """
+    배치마다 device 위에서 confusion matrix 를 누적하는 metric 클래스
+
+    `update` 는 `torch.bincount` 한 번으로 confusion matrix 를 누적하고 host 와 동기화하지 않습니다.
+    accuracy, macro F1, 클래스별 precision / recall, top-k accuracy 는 `compute` 에서 계산됩니다.
+    """
+
+    def __init__(self, num_classes, topk=(), device=None):
+        """
+        Args:
+            num_classes (int): 클래스 개수
+            topk (tuple): 계산할 top-k accuracy 의 k 목록 (logits 가 주어질 때만 누적)
+            device (torch.device): 누적 텐서를 둘 device
+        """
+        self.num_classes = num_classes
+        self.topk = tuple(k for k in topk if k < num_classes)
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.confusion = torch.zeros(self.num_classes ** 2, dtype=torch.long, device=self.device)
+        self.topk_correct = torch.zeros(len(self.topk), dtype=torch.long, device=self.device)
+
+    def update(self, preds, targets, logits=None):
+        """
+        Args:
+            preds (Tensor): (batch,) 예측 클래스
+            targets (Tensor): (batch,) 정답 클래스
+            logits (Tensor): (batch, num_classes) top-k 계산용 점수 (optional)
+        """
+        targets = targets.to(self.confusion.device, torch.long)
+        preds = preds.to(self.confusion.device, torch.long)
+        self.confusion += torch.bincount(targets * self.num_classes + preds, minlength=self.num_classes ** 2)
+        if logits is not None and self.topk:
+            topk_preds = torch.topk(logits, max(self.topk), dim=1)[1]
+            hits = (topk_preds == targets.unsqueeze(1)).cumsum(dim=1)
+            self.topk_correct += hits[:, [k - 1 for k in self.topk]].sum(dim=0)
+
+    def state(self):
+        """누적 상태를 하나의 1차원 텐서로 반환한다."""
+        return torch.cat([self.confusion, self.topk_correct])
+
+    def compute_from_state(self, state):
+        """`state` 를 host 로 옮긴 numpy 배열로부터 metric 을 계산한다."""
+        n = self.num_classes
+        confusion = state[: n * n].reshape(n, n).astype(np.float64)
+        topk_correct = state[n * n:]
+
+        tp = np.diag(confusion)
+        support = confusion.sum(axis=1)
+        predicted = confusion.sum(axis=0)
+        total = max(confusion.sum(), 1.0)
+
+        precision = np.divide(tp, predicted, out=np.zeros(n), where=predicted > 0)
+        recall = np.divide(tp, support, out=np.zeros(n), where=support > 0)
+        denominator = support + predicted
+        f1 = np.divide(2 * tp, denominator, out=np.zeros(n), where=denominator > 0)
+        # sklearn 과 같이 정답 / 예측 어디에도 없는 클래스는 평균에서 제외
+        present = denominator > 0
+
+        result = {
+            "acc": tp.sum() / total,
+            "f1": f1[present].mean() if present.any() else 0.0,
+            "precision": precision,
+            "recall": recall,
+            "confusion": confusion.astype(np.int64),
+        }
+        for k, correct in zip(self.topk, topk_correct):
+            result[f"top{k}"] = correct / total
+        return result
+
+    def compute(self):
+        """분산 학습 중이면 모든 rank 의 누적 상태를 더한 뒤 계산한다."""
+        return self.compute_from_state(all_reduce_sum(self.state()).cpu().numpy())
+
+
+class MultiTaskMetrics:
+    """
+    18 클래스 라벨과 mask / gender / age 각 head 에 대한 StreamingMetrics 묶음
+
+    모델 출력이 head 3개의 튜플이면 결합 log 확률로 18 클래스 점수를 만들고,
+    18 클래스 출력이면 예측을 디코딩해서 head 별 metric 을 계산합니다.
+    `compute` 에서 모든 누적 상태를 한 번만 host 로 옮깁니다.
+    """
+
+    heads = {"mask": 3, "gender": 2, "age": 3}
+
+    def __init__(self, num_classes=18, topk=(3,), device=None):
+        self.metrics = {"multi": StreamingMetrics(num_classes, topk=topk, device=device)}
+        for head, head_classes in self.heads.items():
+            self.metrics[head] = StreamingMetrics(head_classes, device=device)
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+    @staticmethod
+    def decode(labels):
+        return (labels // 6) % 3, (labels // 3) % 2, labels % 3
+
+    def update(self, outputs, labels):
+        """
+        Args:
+            outputs (Tensor or tuple): (batch, 18) 점수 또는 (mask, gender, age) head 출력
+            labels (Tensor): (batch,) 18 클래스 정답
+
+        Returns:
+            Tensor: (batch,) 18 클래스 예측
+        """
+        with torch.no_grad():
+            if isinstance(outputs, (tuple, list)):
+                logits = multi_head_logits(*outputs)
+                head_preds = [torch.argmax(output, dim=-1) for output in outputs]
+                preds = head_preds[0] * 6 + head_preds[1] * 3 + head_preds[2]
+            else:
+                logits = outputs
+                preds = torch.argmax(outputs, dim=-1)
+                head_preds = self.decode(preds)
+
+            self.metrics["multi"].update(preds, labels, logits=logits)
+            for head, head_pred, head_label in zip(self.heads, head_preds, self.decode(labels)):
+                self.metrics[head].update(head_pred, head_label)
+        return preds
+
+    def state(self):
+        return torch.cat([metric.state() for metric in self.metrics.values()])
+
+    def compute_from_state(self, state):
+        result = {}
+        offset = 0
+        for name, metric in self.metrics.items():
+            size = metric.state().numel()
+            values = metric.compute_from_state(state[offset:offset + size])
+            offset += size
+            prefix = "" if name == "multi" else f"{name}_"
+            result.update({prefix + key: value for key, value in values.items()})
+        return result
+
+    def compute(self):
+        """
+        Returns:
+            dict: "acc", "f1", "top3", "precision", "recall", "confusion" 과
+                  "mask_acc", "mask_f1", ... 처럼 head 이름이 붙은 metric
+                  (분산 학습 중이면 모든 rank 의 누적 상태를 더한 값)
+        """
+        return self.compute_from_state(all_reduce_sum(self.state()).cpu().numpy())
+
+
+def scalar_metrics(result, prefix=""):
+    """`compute` 결과에서 로그로 남길 수 있는 스칼라 값만 골라 prefix 를 붙인다."""
+    return {prefix + key: float(value) for key, value in result.items() if np.ndim(value) == 0}
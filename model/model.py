@@ -1,7 +1,9 @@
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 from base.base_model import BaseModel
-import timm
+from model.weights import create_backbone
 
 
 class MnistModel(BaseModel):
@@ -23,50 +25,226 @@ class MnistModel(BaseModel):
         return F.log_softmax(x, dim=1)
 
 
+def make_head(in_features, out_features, hidden=(512, 128)):
+    """Linear - BatchNorm1d - ReLU 블록을 hidden 너비만큼 쌓고 마지막에 Linear 를 붙인 분류 head"""
+    layers = []
+    for width in hidden:
+        layers += [nn.Linear(in_features, width), nn.BatchNorm1d(width), nn.ReLU()]
+        in_features = width
+    layers.append(nn.Linear(in_features, out_features))
+    return nn.Sequential(*layers)
+
+
+class MultiHeadSet(nn.Module):
+    """
+    mask / gender / age head 묶음
+    기본 hidden 너비에서는 `EfficientNetB0MultiHead` 의 head 와 구조 및 state_dict key 가 같습니다.
+    """
+
+    def __init__(self, in_features=1280, hidden=(512, 128)):
+        super().__init__()
+        self.hidden = tuple(hidden)
+        self.mask = make_head(in_features, 3, hidden)
+        self.age = make_head(in_features, 3, hidden)
+        self.gender = make_head(in_features, 2, hidden)
+
+    def forward(self, x):
+        return self.mask(x), self.gender(x), self.age(x)
+
+
 class EfficientNetB0MultiHead(BaseModel):
-    def __init__(self, num_classes):
+    """
+    고정된 EfficientNet-B0 backbone 에 mask / gender / age head 를 붙인 모델
+
+    기본적으로 backbone 은 고정되어 있고,
+    `set_trainable_blocks` 로 backbone 의 마지막 몇 block 만 학습할 수 있습니다.
+    block 은 stem (conv_stem, bn1) 과 timm 의 stage 7개이고,
+    마지막 conv (conv_head, bn2) 는 block 을 하나라도 학습하면 함께 학습합니다.
+    이때 고정된 앞쪽 block 은 eval 모드 (BatchNorm 통계 고정) 와 `torch.no_grad` 로 실행되어
+    activation 을 저장하지 않고,
+    `grad_checkpointing` 이면 학습하는 block 의 activation 도 backward 때 다시 계산합니다.
+    """
+
+    def __init__(self, num_classes, pretrained=True):
+        """
+        Args:
+            num_classes (int): 사용하지 않음 (다른 모델과 같은 생성자 형태를 위해 유지)
+            pretrained (bool): 로컬 weight 저장소의 pretrained backbone 사용 여부.
+                학습한 checkpoint 를 바로 불러올 때는 False
+        """
         super().__init__()
-        self.model = timm.create_model('efficientnet_b0', pretrained=True, num_classes=0)  # num_features : 1280
+        self.model = create_backbone('efficientnet_b0', pretrained=pretrained)  # num_features : 1280
         for param in self.model.parameters():
             param.requires_grad = False
+        # None 이면 backbone 전체를 그대로 실행 (예전 방식), 정수면 학습하는 마지막 block 수
+        self.trainable_blocks = None
+        self.grad_checkpointing = False
+
+        self.mask = make_head(1280, 3)
+        self.age = make_head(1280, 3)
+        self.gender = make_head(1280, 2)
 
-        self.mask = nn.Sequential(
-            nn.Linear(1280, 512),
-            nn.BatchNorm1d(512),
-            nn.ReLU(),
-            nn.Linear(512, 128),
-            nn.BatchNorm1d(128),
-            nn.ReLU(),
-            nn.Linear(128, 3)
-        )
-
-        self.age = nn.Sequential(
-            nn.Linear(1280, 512),
-            nn.BatchNorm1d(512),
-            nn.ReLU(),
-            nn.Linear(512, 128),
-            nn.BatchNorm1d(128),
-            nn.ReLU(),
-            nn.Linear(128, 3)
-        )
-        
-        self.gender = nn.Sequential(
-            nn.Linear(1280, 512),
-            nn.BatchNorm1d(512),
-            nn.ReLU(),
-            nn.Linear(512, 128),
-            nn.BatchNorm1d(128),
-            nn.ReLU(),
-            nn.Linear(128, 2)
-        )
+    def backbone_blocks(self):
+        """stem 과 stage 들, 그리고 마지막 conv 를 forward 순서대로 나열한 목록"""
+        backbone = self.model
+        return [nn.Sequential(backbone.conv_stem, backbone.bn1), *backbone.blocks,
+                nn.Sequential(backbone.conv_head, backbone.bn2)]
+
+    def _frozen_blocks(self):
+        """앞쪽부터 고정된 `backbone_blocks` 의 개수"""
+        blocks = len(self.backbone_blocks())
+        return blocks if self.trainable_blocks == 0 else blocks - 1 - self.trainable_blocks
+
+    def set_trainable_blocks(self, blocks):
+        """
+        backbone 의 마지막 `blocks` 개 block 만 학습하도록
+        requires_grad 와 train / eval 모드를 바꾼다.
+
+        Args:
+            blocks (int): 학습할 block 수
+                (0 이면 backbone 전체 고정, 음수이거나 block 수보다 크면 backbone 전체 학습)
+
+        Returns:
+            int: 실제로 학습하는 block 수
+        """
+        max_blocks = len(self.backbone_blocks()) - 1
+        self.trainable_blocks = max_blocks if blocks < 0 else min(blocks, max_blocks)
+        frozen = self._frozen_blocks()
+        for i, block in enumerate(self.backbone_blocks()):
+            for param in block.parameters():
+                param.requires_grad = i >= frozen
+        self.train(self.training)
+        return self.trainable_blocks
+
+    def set_grad_checkpointing(self, enable=True):
+        """
+        학습하는 backbone block 의 activation 을 저장하지 않고
+        backward 때 다시 계산할지 설정한다.
+        """
+        self.grad_checkpointing = enable
+
+    def train(self, mode=True):
+        super().train(mode)
+        if self.trainable_blocks is not None:
+            for block in self.backbone_blocks()[:self._frozen_blocks()]:
+                block.eval()
+        return self
+
+    def features(self, x):
+        """backbone 의 pooling 된 feature"""
+        if self.trainable_blocks is None:
+            return self.model(x)
+
+        blocks = self.backbone_blocks()
+        frozen = self._frozen_blocks()
+        with torch.no_grad():
+            for block in blocks[:frozen]:
+                x = block(x)
+        for block in blocks[frozen:]:
+            # 다시 계산하는 forward 에서 BatchNorm running 통계가 한 번 더 갱신되는 것은
+            # timm 의 checkpoint_seq 와 같음
+            if self.grad_checkpointing and self.training:
+                x = checkpoint(block, x, use_reentrant=False)
+            else:
+                x = block(x)
+        return self.model.forward_head(x)
 
     def forward(self, x):
-        x = self.model(x)
+        x = self.features(x)
         mask = self.mask(x)
         gender = self.gender(x)
         age = self.age(x)
         return mask, gender, age
-    
+
+
+class SharedBackboneMultiHead(BaseModel):
+    """
+    고정된 EfficientNet-B0 backbone 하나에 여러 개의 `MultiHeadSet` 을 붙인 모델
+    backbone 의 forward 는 batch 마다 한 번만 (no_grad 로) 계산되고,
+    모든 head set 이 같은 feature 를 사용합니다.
+    `variant_state_dict` 는 head set 하나를
+    `EfficientNetB0MultiHead` 에 그대로 불러올 수 있는 state_dict 로 만듭니다.
+    """
+
+    def __init__(self, num_classes, head_hiddens=((512, 128),), pretrained=True):
+        """
+        Args:
+            num_classes (int): 사용하지 않음 (다른 모델과 같은 생성자 형태를 위해 유지)
+            head_hiddens (Sequence[Sequence[int]]): head set 별 hidden 너비
+            pretrained (bool): 로컬 weight 저장소의 pretrained backbone 사용 여부
+        """
+        super().__init__()
+        self.model = create_backbone('efficientnet_b0', pretrained=pretrained)  # num_features : 1280
+        for param in self.model.parameters():
+            param.requires_grad = False
+        self.heads = nn.ModuleList(MultiHeadSet(self.model.num_features, hidden) for hidden in head_hiddens)
+
+    def features(self, x):
+        with torch.no_grad():
+            return self.model(x)
+
+    def forward(self, x):
+        features = self.features(x)
+        return [head(features) for head in self.heads]
+
+    def variant_state_dict(self, index):
+        """backbone 과 index 번째 head set 으로 이루어진 `EfficientNetB0MultiHead` 형식의 state_dict"""
+        state_dict = {f"model.{key}": value for key, value in self.model.state_dict().items()}
+        state_dict.update(self.heads[index].state_dict())
+        return state_dict
+
+
+class SlimCNNMultiHead(BaseModel):
+    """
+    distillation 용 작은 student: `MnistModel` 의 conv 구조를
+    3 채널 입력, 넓은 채널, global average pooling 으로 바꾸고
+    `EfficientNetB0MultiHead` 와 같은 (mask, gender, age) 출력을 내는 CNN
+    """
+
+    def __init__(self, num_classes, width=32, hidden=(64,)):
+        """
+        Args:
+            num_classes (int): 사용하지 않음 (다른 모델과 같은 생성자 형태를 위해 유지)
+            width (int): 첫 conv 의 채널 수. 이후 block 마다 두 배
+            hidden (Sequence[int]): head 의 hidden 너비
+        """
+        super().__init__()
+        layers, in_channels = [], 3
+        for channels in (width, width * 2, width * 4, width * 8):
+            layers += [
+                nn.Conv2d(in_channels, channels, kernel_size=3, stride=2, padding=1, bias=False),
+                nn.BatchNorm2d(channels),
+                nn.ReLU(inplace=True),
+            ]
+            in_channels = channels
+        self.features = nn.Sequential(*layers, nn.AdaptiveAvgPool2d(1), nn.Flatten())
+        self.heads = MultiHeadSet(in_channels, hidden)
+
+    def forward(self, x):
+        return self.heads(self.features(x))
+
+
+class MobileNetV3MultiHead(BaseModel):
+    """
+    distillation 용 student:
+    로컬 weight 저장소의 pretrained `mobilenetv3_small_100` backbone 전체를 학습하고
+    `EfficientNetB0MultiHead` 와 같은 (mask, gender, age) 출력을 내는 모델
+    """
+
+    def __init__(self, num_classes, pretrained=True, hidden=(128,)):
+        """
+        Args:
+            num_classes (int): 사용하지 않음 (다른 모델과 같은 생성자 형태를 위해 유지)
+            pretrained (bool): 로컬 weight 저장소의 pretrained backbone 사용 여부
+            hidden (Sequence[int]): head 의 hidden 너비
+        """
+        super().__init__()
+        self.model = create_backbone('mobilenetv3_small_100', pretrained=pretrained)  # num_features : 1024
+        self.heads = MultiHeadSet(self.model.num_features, hidden)
+
+    def forward(self, x):
+        return self.heads(self.model(x))
+
 
 # Custom Model Template
 class MyModel(nn.Module):
@@ -0,0 +1,222 @@
+import hashlib
+import inspect
+import json
+import os
+import warnings
+
+import torch
+
+
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "mask_weights")
+INDEX_FILE = "index.json"
+
+
+def file_sha256(path, chunk_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_checkpoint(path, mmap=True):
+    """
+    checkpoint(state_dict)를 memory-mapped tensor 로 불러온다.
+
+    mmap 이면 파일을 RAM 으로 복사하지 않고 tensor 가 파일의 page 를 직접 가리키므로,
+    같은 파일을 여는 여러 프로세스가 page cache 를 공유하고
+    실제로 읽힌 부분만 메모리에 올라갑니다.
+    `load_state_dict(..., assign=True)` 와 함께 쓰면
+    모델 파라미터도 복사 없이 이 tensor 를 사용합니다.
+    예전 (zip 이 아닌) 형식의 파일은 mmap 할 수 없으므로 일반 load 로 읽습니다.
+
+    Args:
+        path (str): torch.save 로 저장한 state_dict 경로
+        mmap (bool): memory-map 여부
+
+    Returns:
+        dict: CPU 위의 state_dict
+    """
+    if mmap:
+        try:
+            return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        except RuntimeError as e:
+            warnings.warn(f"{path} cannot be memory-mapped ({e}), loading it into memory")
+    return torch.load(path, map_location="cpu", weights_only=True)
+
+
+def load_trained_model(model_module, path, device=None, **kwargs):
+    """
+    학습한 checkpoint 로 모델을 만든다.
+
+    pretrained weight 없이 meta device 에서 구조만 만들고
+    memory-mapped checkpoint 를 복사 없이 연결하므로,
+    무작위 초기화나 weight 복사 없이 만들어집니다.
+
+    Args:
+        model_module (type): 모델 클래스
+        path (str): `Trainer` 가 저장한 state_dict 경로 (best.pth 등)
+        device (torch.device): 모델을 옮길 device
+        **kwargs: 모델 생성자에 전달되는 키워드 인자
+
+    Returns:
+        nn.Module: eval 모드의 모델
+    """
+    if "pretrained" in inspect.signature(model_module).parameters:
+        kwargs.setdefault("pretrained", False)
+    with torch.device("meta"):
+        model = model_module(**kwargs)
+    model.load_state_dict(load_checkpoint(path), assign=True)
+    if device is not None:
+        model = model.to(device)
+    return model.eval()
+
+
+class WeightStore:
+    """
+    checksum 으로 검증하는 로컬 pretrained weight 저장소
+
+    `{root}/{name}.pth` 에 backbone 의 state_dict 를,
+    `{root}/index.json` 에 파일별 sha256 과 크기, 수정 시각, 출처를 저장합니다.
+    모델은 네트워크나 hub cache 대신 이 저장소에서 weight 를 찾습니다.
+    sha256 은 파일을 추가할 때와
+    크기 / 수정 시각이 기록과 달라졌을 때만 다시 계산합니다.
+
+    저장소 위치는 `MASK_WEIGHTS_DIR` 환경 변수로 바꿀 수 있고, `MASK_WEIGHTS_OFFLINE=1` 이면
+    저장소에 없는 weight 를 내려받지 않고 오류를 냅니다.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.environ.get("MASK_WEIGHTS_DIR", DEFAULT_ROOT)
+        self.index_path = os.path.join(self.root, INDEX_FILE)
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_index(self, index):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    def path(self, name):
+        return os.path.join(self.root, f"{name}.pth")
+
+    def __contains__(self, name):
+        return name in self.read_index() and os.path.exists(self.path(name))
+
+    def names(self):
+        return sorted(self.read_index())
+
+    def add(self, name, state_dict=None, path=None, source=None):
+        """
+        state_dict 또는 이미 저장된 파일을 저장소에 추가하고 checksum 을 기록한다.
+
+        Args:
+            name (str): weight 이름 (예: "efficientnet_b0")
+            state_dict (dict): 저장할 state_dict
+            path (str): 복사해 올 state_dict 파일 (state_dict 대신)
+            source (str): 출처 설명 (예: "timm")
+        """
+        if (state_dict is None) == (path is None):
+            raise ValueError("give either state_dict or path")
+        if state_dict is None:
+            state_dict = load_checkpoint(path, mmap=False)
+        os.makedirs(self.root, exist_ok=True)
+        target = self.path(name)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        torch.save({key: value.detach().cpu().contiguous() for key, value in state_dict.items()}, tmp_path)
+        os.replace(tmp_path, target)
+
+        index = self.read_index()
+        stat = os.stat(target)
+        index[name] = {
+            "file": os.path.basename(target),
+            "sha256": file_sha256(target),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "source": source,
+        }
+        self.write_index(index)
+        return target
+
+    def verify(self, name, full=False):
+        """
+        저장된 파일이 기록된 checksum 과 같은지 확인한다.
+
+        Args:
+            name (str): weight 이름
+            full (bool): True 면 크기 / 수정 시각이 같아도 sha256 을 다시 계산
+
+        Raises:
+            RuntimeError: 파일이 없거나 checksum 이 다를 때
+        """
+        entry = self.read_index().get(name)
+        path = self.path(name)
+        if entry is None or not os.path.exists(path):
+            raise RuntimeError(f"weights '{name}' are not in the store {self.root}")
+        stat = os.stat(path)
+        if not full and stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+            return
+        if file_sha256(path) != entry["sha256"]:
+            raise RuntimeError(f"checksum mismatch for {path}, fetch the weights again")
+        # 내용은 같고 시각만 바뀐 경우 다음부터는 다시 계산하지 않음
+        if stat.st_mtime != entry["mtime"]:
+            index = self.read_index()
+            index[name]["mtime"] = stat.st_mtime
+            self.write_index(index)
+
+    def fetch(self, name):
+        """
+        timm 의 pretrained weight 를 (네트워크 또는 hub cache 에서) 한 번 받아 저장소에 추가한다.
+        """
+        if os.environ.get("MASK_WEIGHTS_OFFLINE", "0") == "1":
+            raise RuntimeError(f"weights '{name}' are not in the store {self.root} and MASK_WEIGHTS_OFFLINE=1. "
+                               f"run `python fetch_weights.py {name}` on a host with network access")
+        import timm
+
+        print(f"Fetching pretrained {name} weights into {self.root} ...")
+        model = timm.create_model(name, pretrained=True, num_classes=0)
+        return self.add(name, model.state_dict(), source="timm")
+
+    def load(self, name, mmap=True):
+        """
+        저장소의 weight 를 검증한 뒤 memory-mapped state_dict 로 불러온다.
+        저장소에 없으면 먼저 받아온다.
+
+        Returns:
+            dict: state_dict
+        """
+        if name not in self:
+            self.fetch(name)
+        self.verify(name)
+        return load_checkpoint(self.path(name), mmap=mmap)
+
+
+def create_backbone(name, pretrained=True, store=None):
+    """
+    분류기 없는 (num_classes=0) timm backbone 을 만든다.
+
+    pretrained 면 meta device 에서 구조만 만든 뒤
+    저장소의 memory-mapped weight 를 복사 없이 연결하므로,
+    무작위 초기화와 네트워크 접근 없이 만들어지고
+    같은 host 의 여러 프로세스가 weight page 를 공유합니다.
+
+    Args:
+        name (str): timm 모델 이름 (예: "efficientnet_b0")
+        pretrained (bool): False 면 무작위 초기화 (checkpoint 를 바로 불러올 때)
+        store (WeightStore): weight 저장소 (None 이면 기본 저장소)
+    """
+    import timm  # import 에 수 초가 걸리므로 모델을 만들 때 import
+
+    if not pretrained:
+        return timm.create_model(name, pretrained=False, num_classes=0)
+    state_dict = (store or WeightStore()).load(name)
+    with torch.device("meta"):
+        backbone = timm.create_model(name, pretrained=False, num_classes=0)
+    backbone.load_state_dict(state_dict, assign=True)
+    return backbone
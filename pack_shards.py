@@ -0,0 +1,43 @@
+import argparse
+
+from data_loader.shards import pack_shards
+from utils.registry import DATASETS
+
+
+def main(args):
+    dataset = DATASETS.get(args.dataset)(
+        data_dir=args.data_dir,
+        multi_head=True,
+        # 주의 데이터는 ShardedMaskDataset 에서 읽을 때 거를 수 있으므로 모두 저장
+        use_caution=True,
+        manifest=args.manifest,
+    )
+    shard_index = pack_shards(
+        dataset,
+        args.output_dir,
+        shard_bytes=args.shard_size_mb * 2 ** 20,
+        shuffle=not args.no_shuffle,
+        seed=args.seed,
+    )
+    total = int(shard_index.sizes.sum())
+    print(f"Packed {len(shard_index)} images ({total / 2 ** 20:.1f} MiB) into {len(shard_index.shards)} shards "
+          f"at {args.output_dir}. train with --dataset ShardedMaskDataset --data_dir {args.output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pack the training images into tar shards for ShardedMaskDataset")
+    parser.add_argument("--data_dir", type=str, required=True, help="image tree (e.g. .../train/images)")
+    parser.add_argument("--output_dir", type=str, required=True, help="directory for the shards and index.npz")
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default="MaskSplitByProfileDataset",
+        help="dataset that builds the sample table (default: MaskSplitByProfileDataset)",
+    )
+    parser.add_argument("--manifest", type=str, default=None, help="reuse a dataset manifest npz (default: None)")
+    parser.add_argument("--shard_size_mb", type=int, default=256, help="target size of one shard (default: 256)")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the packing order (default: 42)")
+    parser.add_argument("--no_shuffle", action="store_true", help="keep the sample-table order inside the shards")
+    args = parser.parse_args()
+
+    main(args)
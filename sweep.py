@@ -0,0 +1,267 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from torch.utils.data import IterableDataset
+
+from data_loader.image_cache import DecodedImageCache
+from utils.registry import DATASETS
+
+
+# train.py 의 기본값 중 manifest / 이미지 캐시를 만들 때 필요한 값
+TRAIN_DEFAULTS = {
+    "data_dir": os.environ.get("SM_CHANNEL_TRAIN", "/data/ephemeral/maskdata/train/images"),
+    "dataset": "MaskSplitByProfileDataset",
+    "use_caution_data": True,
+    "multi_head": True,
+    "monitor": "max val_f1",
+}
+# action="store_true" 로 정의된 train.py 인자
+STORE_TRUE_ARGS = {"restore_best", "vectorize_heads"}
+# 결과 표에 남길 best epoch 의 metric
+RESULT_METRICS = ["epoch", "val_f1", "val_acc", "val_loss", "val_mask_f1", "val_gender_f1", "val_age_f1", "train_loss"]
+
+
+def expand_grid(parameters):
+    """parameters 의 모든 값 조합을 dict 목록으로 만든다."""
+    keys = list(parameters)
+    return [dict(zip(keys, values)) for values in itertools.product(*(parameters[key] for key in keys))]
+
+
+def sample_value(rng, space):
+    """
+    random search 공간 하나에서 값을 뽑는다.
+
+    Args:
+        space (list or dict): 값 목록이면 그 중 하나를 고르고,
+            {"min", "max", "log"(optional), "int"(optional)} 이면
+            구간에서 균등하게 (log 이면 log 스케일로) 뽑는다.
+    """
+    if isinstance(space, list):
+        return rng.choice(space)
+    low, high = space["min"], space["max"]
+    if space.get("log", False):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return int(round(value)) if space.get("int", False) else value
+
+
+def expand_random(parameters, num_runs, seed):
+    """parameters 공간에서 num_runs 개의 조합을 seed 로 고정해서 뽑는다."""
+    rng = random.Random(seed)
+    return [{key: sample_value(rng, space) for key, space in parameters.items()} for _ in range(num_runs)]
+
+
+def to_cli_args(options):
+    """
+    dict 를 train.py 명령행 인자로 바꾼다.
+    train.py 의 `type=bool` 인자는 빈 문자열만 False 로 해석하므로 False 는 "" 로 넘긴다.
+    """
+    cli_args = []
+    for key, value in options.items():
+        if value is None:
+            continue
+        if key in STORE_TRUE_ARGS:
+            if value:
+                cli_args.append(f"--{key}")
+            continue
+        cli_args.append(f"--{key}")
+        if isinstance(value, (list, tuple)):
+            cli_args.extend(str(item) for item in value)
+        elif isinstance(value, bool):
+            cli_args.append("True" if value else "")
+        else:
+            cli_args.append(str(value))
+    return cli_args
+
+
+def prepare_shared_data(runs, sweep_dir, build_cache, cache_size):
+    """
+    (dataset, data_dir, use_caution_data) 조합마다 manifest 와 이미지 캐시를 한 번만 만들고
+    각 run 의 인자에 경로를 넣는다. 이미 만들어진 파일은 그대로 재사용한다.
+    """
+    shared = {}
+    for run in runs:
+        options = run["options"]
+        key = (options["dataset"], os.path.abspath(options["data_dir"]), bool(options["use_caution_data"]))
+        if key not in shared:
+            tag = f"{key[0]}_{len(shared)}"
+            manifest = os.path.join(sweep_dir, "shared", f"{tag}.npz")
+            dataset = DATASETS.get(key[0])(
+                data_dir=options["data_dir"],
+                multi_head=True,
+                use_caution=key[2],
+                manifest=manifest,
+            )
+            if isinstance(dataset, IterableDataset):  # shard 데이터셋은 자체 인덱스를 사용
+                manifest = None
+            image_cache = None
+            if build_cache and manifest is not None:
+                image_cache = os.path.join(sweep_dir, "shared", f"{tag}_images.npy")
+                if not DecodedImageCache.exists(image_cache, dataset.sample_key):
+                    print(f"Decoding {len(dataset)} images into {image_cache} ...")
+                    DecodedImageCache.build(image_cache, dataset, size=cache_size)
+            shared[key] = (manifest, image_cache)
+        options["manifest"], options["image_cache"] = shared[key]
+
+
+def launch(run, threads_per_run):
+    """train.py 를 스레드 수를 제한한 별도 프로세스로 실행하고 끝날 때까지 기다린다."""
+    env = dict(os.environ)
+    env["OMP_NUM_THREADS"] = str(threads_per_run)
+    env["MKL_NUM_THREADS"] = str(threads_per_run)
+
+    command = [sys.executable, "train.py"] + to_cli_args(run["options"])
+    start = time.time()
+    with open(run["log_file"], "w", encoding="utf-8") as log_file:
+        process = subprocess.run(
+            command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=log_file, stderr=subprocess.STDOUT,
+        )
+    run["returncode"] = process.returncode
+    run["elapsed"] = time.time() - start
+    print(f"[{run['name']}] finished with code {process.returncode} in {run['elapsed']:.0f}s")
+    return run
+
+
+def collect_results(runs, parameter_keys, monitor, path):
+    """
+    각 run 의 results.json 을 모아서 csv 표로 저장하고,
+    monitor 기준으로 정렬한 표를 반환한다.
+    """
+    rows = []
+    for run in runs:
+        row = {"run": run["name"], "returncode": run.get("returncode"), "elapsed": round(run.get("elapsed", 0.0), 1)}
+        row.update({key: run["params"][key] for key in parameter_keys})
+        best = {}
+        if os.path.exists(run["options"]["results_file"]):
+            with open(run["options"]["results_file"], "r", encoding="utf-8") as f:
+                results = json.load(f)
+            best = results["best"] or {}
+            row["epochs_run"] = results["epochs_run"]
+            row["epochs_to_target"] = results.get("epochs_to_target")
+            row["save_dir"] = results["save_dir"]
+        row.update({metric: best.get(metric) for metric in RESULT_METRICS})
+        rows.append(row)
+
+    mode, metric = monitor.split() if monitor != "off" else ("max", "val_f1")
+
+    def sort_key(row):
+        value = row.get(metric)
+        if value is None:  # 실패한 run 은 맨 뒤로
+            return (1, 0.0)
+        return (0, -value if mode == "max" else value)
+
+    rows.sort(key=sort_key)
+
+    columns = ["run"] + list(parameter_keys) + RESULT_METRICS + [
+        "epochs_run", "epochs_to_target", "elapsed", "returncode", "save_dir"
+    ]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows, columns
+
+
+def print_table(rows, columns):
+    def fmt(value):
+        return f"{value:.4g}" if isinstance(value, float) else ("-" if value is None else str(value))
+
+    columns = [column for column in columns if column != "save_dir"]
+    table = [columns] + [[fmt(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def main(args):
+    with open(args.spec, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+
+    name = spec.get("name", os.path.splitext(os.path.basename(args.spec))[0])
+    method = spec.get("method", "grid")
+    parameters = spec.get("parameters", {})
+    if method == "grid":
+        combinations = expand_grid(parameters)
+    elif method == "random":
+        combinations = expand_random(parameters, spec.get("num_runs", 10), spec.get("seed", 0))
+    else:
+        raise ValueError(f"method should be either 'grid' or 'random', {method}")
+
+    max_parallel = args.max_parallel or spec.get("max_parallel", 1)
+    threads_per_run = args.threads_per_run or spec.get("threads_per_run") or max(1, os.cpu_count() // max_parallel)
+
+    sweep_dir = os.path.join(args.output_dir, name)
+    os.makedirs(os.path.join(sweep_dir, "logs"), exist_ok=True)
+    runs = []
+    for i, params in enumerate(combinations):
+        run_name = f"{name}_{i:03d}"
+        options = dict(TRAIN_DEFAULTS, **spec.get("base", {}))
+        options.update(params)
+        options.update({
+            "name": run_name,
+            "model_dir": os.path.join(sweep_dir, "runs"),
+            "results_file": os.path.join(sweep_dir, "results", f"{run_name}.json"),
+        })
+        options.setdefault("wandb", run_name)
+        if options.get("distributed"):
+            raise ValueError("sweep runs are single-process, remove 'distributed' from the spec")
+        runs.append({
+            "name": run_name,
+            "params": params,
+            "options": options,
+            "log_file": os.path.join(sweep_dir, "logs", f"{run_name}.log"),
+        })
+
+    print(f"Sweep {name}: {len(runs)} runs ({method}), {max_parallel} in parallel with {threads_per_run} threads each")
+    if args.dry_run:
+        for run in runs:
+            print(" ".join(["python", "train.py"] + to_cli_args(run["options"])))
+        return
+
+    prepare_shared_data(runs, sweep_dir, spec.get("image_cache", True), spec.get("cache_size"))
+    for run in runs:
+        if os.path.exists(run["options"]["results_file"]):
+            os.remove(run["options"]["results_file"])  # 이전 sweep 의 결과를 새 결과로 착각하지 않도록
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        list(executor.map(lambda run: launch(run, threads_per_run), runs))
+
+    monitor = runs[0]["options"]["monitor"] if runs else "off"
+    rows, columns = collect_results(runs, list(parameters), monitor, os.path.join(sweep_dir, "results.csv"))
+    print_table(rows, columns)
+    print(f"Results saved to {os.path.join(sweep_dir, 'results.csv')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="grid / random search over train.py arguments. "
+                    "runs share one dataset manifest and decoded image cache, and are summarized in results.csv"
+    )
+    parser.add_argument("spec", type=str, help="sweep spec json (see sweep_example.json)")
+    parser.add_argument(
+        "--output_dir", type=str, default="./sweeps", help="sweep outputs are saved at {output_dir}/{name}"
+    )
+    parser.add_argument(
+        "--max_parallel", type=int, default=None, help="number of concurrent runs (default: spec or 1)"
+    )
+    parser.add_argument(
+        "--threads_per_run",
+        type=int,
+        default=None,
+        help="OMP/MKL threads of each run (default: spec or cpu_count // max_parallel)",
+    )
+    parser.add_argument("--dry_run", action="store_true", help="print the train.py commands without running them")
+    args = parser.parse_args()
+
+    main(args)
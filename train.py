@@ -1,18 +1,29 @@
 import argparse
 import collections
+import json
+
+# --exec_profile 의 OpenMP / MKL thread 수와 CPU affinity 는 torch 를 import 하기 전에 적용해야 합니다
+import execution_profile
+EXECUTION_PROFILE = execution_profile.configure("train") if __name__ == "__main__" else None
+
 import torch
 import numpy as np
 import os
 import random
-from importlib import import_module
-from torch.utils.data import DataLoader
-import data_loader.data_sets as module_data_set
-import data_loader.augmentations as module_augmentation
-import data_loader.data_loaders as module_data_loader
-import model.loss as module_loss
-import model.model as module_arch
-from trainer import Trainer
-from utils import prepare_device
+from PIL import Image
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
+import data_loader.samplers as module_sampler
+from data_loader.schedules import ResizeSchedule, UnfreezeSchedule
+from data_loader.shm_cache import SharedImageCache
+from data_loader.teacher_logits import TeacherLogits, WithTeacherLogits
+from data_loader.transform_cache import LRUCache, SharedTensorCache
+from model.weights import file_sha256, load_trained_model
+from trainer import Trainer, MultiHeadExperimentTrainer, HeadVariant, DistillationTrainer
+from trainer.background_validation import parse_cpus
+from utils import prepare_device, init_distributed, cleanup_distributed
+from utils.autotune import BatchSizeTuner
+from utils.registry import AUGMENTATIONS, CRITERIA, DATASETS, MODELS, OPTIMIZERS
 from torch.optim.lr_scheduler import StepLR
 
 
@@ -27,35 +38,250 @@ def seed_everything(seed):
     random.seed(seed)
 
 
+def load_head_variants(value):
+    """
+    --head_variants 값(json 문자열 또는 json 파일 경로)을 variant 설정 목록으로 읽는다.
+    각 항목은 name 과 선택적으로 criterion, optimizer, lr, hidden 을 가진다.
+    """
+    if os.path.exists(value):
+        with open(value, "r", encoding="utf-8") as f:
+            value = f.read()
+    variants = json.loads(value)
+    for i, variant in enumerate(variants):
+        variant.setdefault("name", f"head{i}")
+    names = [variant["name"] for variant in variants]
+    if len(set(names)) != len(names):
+        raise ValueError(f"head variant names should be unique, {names}")
+    return variants
+
+
+def build_head_experiment(config, num_classes, device, **trainer_kwargs):
+    """
+    공유 backbone 에 --head_variants 의 head set 들을 붙인 모델과
+    MultiHeadExperimentTrainer 를 만든다.
+    """
+    if config.distributed:
+        raise ValueError("--head_variants does not support --distributed")
+    if not config.multi_head:
+        raise ValueError("--head_variants trains mask / gender / age head sets, use --multi_head True")
+    if config.background_validation:
+        raise ValueError("--head_variants validates every variant in process and does not support "
+                         "--background_validation")
+
+    specs = load_head_variants(config.head_variants)
+    model = MODELS.get("SharedBackboneMultiHead")(
+        num_classes=num_classes,
+        head_hiddens=[spec.get("hidden", (512, 128)) for spec in specs],
+    ).to(device)
+    if config.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    variants = []
+    for spec, head in zip(specs, model.heads):
+        optimizer_module = OPTIMIZERS.get(spec.get("optimizer", config.optimizer))
+        optimizer = optimizer_module(head.parameters(), lr=spec.get("lr", config.lr))
+        variants.append(HeadVariant(
+            spec["name"],
+            head,
+            criterion=CRITERIA.get(spec.get("criterion", config.criterion))(),
+            optimizer=optimizer,
+            lr_scheduler=StepLR(optimizer, config.lr_decay_step, gamma=0.5),
+            device=device,
+        ))
+    print(f"Training {len(variants)} head variants on a shared efficientnet_b0 backbone: "
+          f"{', '.join(spec['name'] for spec in specs)}")
+    return MultiHeadExperimentTrainer(model, variants, config=config, device=device,
+                                      vectorize=config.vectorize_heads, **trainer_kwargs)
+
+
+def load_teacher_logits(config, dataset, transform, device, input_transform=None):
+    """
+    --teacher_path 의 teacher 로 모든 샘플의 logit 을 한 번 계산해서 저장하고,
+    같은 조건이면 저장된 파일을 읽는다.
+    teacher 는 random 변환 없는 검증용 변환(`val_pipeline`)을 거친 이미지를 본다.
+    --uint8_transport 이면 `input_transform` 이 device 에서 정규화한다.
+    """
+    header = {
+        "teacher": file_sha256(config.teacher_path),
+        "teacher_model": config.teacher_model,
+        "resize": list(config.resize),
+        "augmentation": config.augmentation,
+        "sample_key": dataset.sample_key,
+    }
+    path = config.teacher_logits
+    if path is None:
+        path = f"{os.path.splitext(config.teacher_path)[0]}_logits_{config.resize[0]}x{config.resize[1]}.npy"
+    if TeacherLogits.exists(path, header):
+        print(f"Using cached teacher logits {path}")
+        return TeacherLogits(path)
+
+    print(f"Computing {config.teacher_model} teacher logits of {len(dataset)} samples into {path} ...")
+    teacher = load_trained_model(MODELS.get(config.teacher_model), config.teacher_path, device,
+                                 num_classes=dataset.num_classes)
+    if config.channels_last:
+        teacher = teacher.to(memory_format=torch.channels_last)
+    samples = dataset.subset(np.arange(len(dataset)), transform.val_pipeline())
+    return TeacherLogits.build(path, teacher, samples, header, batch_size=config.valid_batch_size, device=device,
+                               input_transform=input_transform)
+
+
+def make_transform_cache(config, max_mb, prefix, indices):
+    """
+    --val_cache_mb / --train_cache_mb 의 prefix 결과 캐시를 만든다.
+
+    DataLoader worker 가 있으면 worker 마다 따로 캐시를 갖지 않도록
+    shared memory 의 `SharedTensorCache` 를,
+    없으면 학습 프로세스 안의 `LRUCache` 를 사용한다.
+
+    Args:
+        max_mb (float): 캐시 상한 (MiB). 0 이면 캐시하지 않음
+        prefix (callable): 캐시할 결정적인 변환
+        indices (array): 캐시에 들어갈 샘플 인덱스
+    """
+    if max_mb <= 0:
+        return None
+    if config.num_workers == 0:
+        return LRUCache(int(max_mb * 2 ** 20))
+    return SharedTensorCache(int(np.max(indices)) + 1, prefix_example(prefix), int(max_mb * 2 ** 20))
+
+
+def prefix_example(prefix):
+    """
+    prefix 결과 하나
+    (prefix 는 Resize 로 끝나므로 모양과 dtype 은 입력 이미지 크기와 상관없다)
+    """
+    return prefix(Image.new("RGB", (384, 512)))
+
+
 def main(data_dir, model_dir, config):
     seed_everything(config.seed)
 
     # settings
     use_cuda = torch.cuda.is_available()
     device = torch.device("cuda" if use_cuda else "cpu")
+    if config.distributed:
+        # torchrun 으로 실행된 프로세스마다 gloo 로 process group 을 만들고 CPU 에서 학습합니다
+        rank, world_size, local_rank = init_distributed(backend="gloo")
+        use_cuda = False
+        device = torch.device("cpu")
+        print(f"[rank {rank}/{world_size}] distributed training with gloo backend")
 
     # setup data_set instance
-    dataset_module = getattr(module_data_set, config.dataset)  # default: MaskSplitByProfileDataset
+    dataset_module = DATASETS.get(config.dataset)  # default: MaskSplitByProfileDataset
     dataset = dataset_module(
         data_dir=data_dir,
         multi_head=config.multi_head,
-        use_caution=config.use_caution_data
+        use_caution=config.use_caution_data,
+        val_ratio=config.val_ratio,
+        n_splits=config.n_splits,
+        fold=config.fold,
+        seed=config.seed,
+        split_file=config.split_file,
+        manifest=config.manifest,
+        image_cache=config.image_cache,
     )
     num_classes = dataset.num_classes
     dataset_mean = dataset.mean
     dataset_std = dataset.std
 
+    if config.background_validation and config.distributed:
+        raise ValueError("--background_validation does not support --distributed")
+    if config.unfreeze_schedule is not None and (config.distributed or config.head_variants is not None):
+        raise ValueError("--unfreeze_schedule supports neither --distributed nor --head_variants")
+    if config.grad_checkpointing and config.unfreeze_schedule is None:
+        raise ValueError("--grad_checkpointing recomputes the unfrozen backbone blocks, use --unfreeze_schedule")
+
+    # DataLoader worker 들이 디코딩한 이미지를 함께 쓰는 shared memory 캐시
+    shared_cache = None
+    if config.shared_cache_mb > 0:
+        if not hasattr(dataset, "set_shared_cache") or config.image_cache is not None:
+            raise ValueError("--shared_cache_mb needs a map-style dataset that decodes images (no --image_cache)")
+        cache_size = config.shared_cache_size
+        if cache_size is None:
+            with Image.open(dataset.image_paths[0]) as image:
+                cache_size = (image.height, image.width)
+        shared_cache = SharedImageCache(
+            len(dataset), cache_size, config.shared_cache_mb * 2 ** 20, eviction=config.shared_cache_eviction
+        )
+        dataset.set_shared_cache(shared_cache)
+
     # setup augmentation instance
-    augmentation_module = getattr(module_augmentation, config.augmentation)  # default: MaskSplitByProfileDataset
+    augmentation_module = AUGMENTATIONS.get(config.augmentation)  # default: BaseAugmentation
     transform = augmentation_module(
         resize=config.resize,
         mean=dataset.mean,
         std=dataset.std,
+        uint8=config.uint8_transport,
     )
     dataset.set_transform(transform)
 
+    # --uint8_transport: worker 는 uint8 이미지를 넘기고,
+    # 정규화는 batch 단위로 device 에서 한 번에 합니다
+    input_transform = None
+    if config.uint8_transport:
+        from data_loader.augmentations import DeviceNormalize
+        input_transform = DeviceNormalize(dataset.mean, dataset.std, channels_last=config.channels_last)
+    elif config.channels_last:
+        raise ValueError("--channels_last converts the batches in the device normalization, use --uint8_transport")
+
     # setup data_loader instances
     train_set, valid_set = dataset.split_dataset()
+    # shard 를 순서대로 읽는 streaming 데이터셋은 sampler 대신 shuffle buffer 로 섞습니다
+    streaming = isinstance(dataset, IterableDataset)
+    if streaming and (config.sampler is not None or config.distributed or config.teacher_path is not None):
+        raise ValueError(f"{config.dataset} streams shards and supports none of --sampler, --distributed "
+                         "and --teacher_path")
+
+    # 실행 프로파일: 코어를 연산 thread 와 DataLoader worker 에 나눠 고정
+    # (auto 는 처음 한 번 여기서 측정)
+    profile = EXECUTION_PROFILE
+    if profile is not None and config.distributed:
+        raise ValueError("--exec_profile pins one process per host and does not support --distributed")
+    if isinstance(profile, execution_profile.AutoProfile):
+        probe_set = None if streaming else dataset.subset(train_set.indices, transform.train_pipeline())
+        profile = profile.tune(
+            MODELS.get(config.model),
+            config.resize,
+            config.batch_size,
+            load_sample=None if probe_set is None else lambda index: probe_set[index % len(probe_set)],
+            num_classes=num_classes,
+        )
+    worker_init_fn = None
+    if profile is not None:
+        print(f"Execution profile: {profile}")
+        config.num_workers = profile.workers
+        worker_init_fn = profile.worker_init_fn
+        if config.background_validation and config.valid_cpus:
+            # 검증 프로세스는 프로파일이 연산 thread / worker 에 배정한 코어와
+            # 겹치지 않아야 합니다
+            overlap = parse_cpus(config.valid_cpus) & set(profile.compute_cpus + profile.worker_cpus)
+            if overlap:
+                raise ValueError(f"--valid_cpus {config.valid_cpus} overlaps CPUs {sorted(overlap)} of the execution "
+                                 f"profile (compute {profile.compute_cpus}, workers {profile.worker_cpus})")
+
+    # 학습 / 검증 batch 크기를 이 host 에서 측정한 처리량으로 정합니다
+    # (model, resize, host 별로 캐시)
+    if config.autotune:
+        if config.distributed:
+            raise ValueError("--autotune probes a single process and does not support --distributed")
+        tuner = BatchSizeTuner(
+            device,
+            memory_limit_mb=config.autotune_memory_mb,
+            cache_path=config.autotune_cache,
+            max_batch_size=config.autotune_max_batch_size,
+        )
+        model_module = MODELS.get(config.model)
+        config.batch_size = tuner.tune(config.model, model_module, config.resize, "train", num_classes=num_classes)
+        config.valid_batch_size = tuner.tune(config.model, model_module, config.resize, "eval",
+                                             num_classes=num_classes)
+
+    # distillation: teacher 의 soft target 은 한 번만 계산해서 파일로 저장하고
+    # 학습 batch 에 붙여서 사용
+    teacher_logits = None
+    if config.teacher_path is not None:
+        if config.head_variants is not None:
+            raise ValueError("--teacher_path does not support --head_variants")
+        teacher_logits = load_teacher_logits(config, dataset, transform, device, input_transform)
     # train_loader_module = getattr(module_data_loader, config.dataloader)
     # train_data_loader = train_loader_module(dataset=train_set,
     #                                         batch_size=config.batch_size,
@@ -70,50 +296,186 @@ def main(data_dir, model_dir, config):
     #                                         shuffle=False,
     #                                         pin_memory=use_cuda,
     #                                         drop_last=True)
-    train_dataloader = DataLoader(
-        dataset=train_set,
-        batch_size=args.batch_size,
-        num_workers=0,
-        shuffle=True,
-        pin_memory=use_cuda,
-        drop_last=True,
+    sampler = None
+    if config.sampler is not None:
+        sampler_options = {"seed": config.seed}
+        if config.sampler == "loss_aware":
+            if config.distributed:
+                raise ValueError("--sampler loss_aware keeps per-process losses and does not support --distributed")
+            sampler_options.update(
+                floor=config.loss_floor, staleness=config.loss_staleness, momentum=config.loss_momentum
+            )
+        sampler = module_sampler.create_sampler(config.sampler, train_set, **sampler_options)
+    elif config.distributed:
+        sampler = DistributedSampler(train_set, shuffle=True, seed=config.seed, drop_last=True)
+
+    train_subset_options = {"shuffle": True} if streaming else {}
+
+    # 검증은 random 변환 없이 prefix 결과를 캐시하는 별도 pipeline 으로
+    # (두 번째 epoch 부터 디코딩 없음)
+    transform_caches = {"val": make_transform_cache(config, config.val_cache_mb, transform.prefix, valid_set.indices)}
+    valid_set = dataset.subset(valid_set.indices, transform.val_pipeline(transform_caches["val"]))
+
+    # 해상도별 augmentation 은 한 번만 만들고
+    # progressive resizing 의 같은 해상도 구간에서 재사용
+    train_transforms = {tuple(config.resize): transform}
+    # 해상도별 prefix 캐시도 유지해서 이전 해상도로 돌아오면 다시 쓰고,
+    # 모든 해상도의 캐시 상한 합이 --train_cache_mb 를 넘을 때만
+    # 가장 오래 쓰지 않은 해상도의 캐시부터 닫는다. resize -> (캐시, 상한 bytes)
+    train_caches = collections.OrderedDict()
+
+    def train_cache_for(resize):
+        if resize in train_caches:
+            train_caches.move_to_end(resize)
+            return train_caches[resize][0]
+        if config.train_cache_mb <= 0:
+            return None
+        budget = config.train_cache_mb * 2 ** 20
+        prefix = train_transforms[resize].prefix
+        needed = min(budget, prefix_example(prefix).nbytes * len(train_set.indices))
+        while train_caches and budget - sum(nbytes for _, nbytes in train_caches.values()) < needed:
+            cache, _ = train_caches.pop(next(iter(train_caches)))
+            if isinstance(cache, SharedTensorCache):
+                cache.close()
+        cache = make_transform_cache(config, needed / 2 ** 20, prefix, train_set.indices)
+        train_caches[resize] = (cache, needed)
+        return cache
+
+    def build_train_dataloader(resize, batch_size):
+        resize = tuple(resize)
+        if resize not in train_transforms:
+            train_transforms[resize] = augmentation_module(
+                resize=resize,
+                mean=dataset.mean,
+                std=dataset.std,
+                uint8=config.uint8_transport,
+            )
+        train_cache = train_cache_for(resize)
+        train_subset = dataset.subset(train_set.indices, train_transforms[resize].train_pipeline(train_cache),
+                                      **train_subset_options)
+        if teacher_logits is not None:
+            train_subset = WithTeacherLogits(train_subset, teacher_logits.logits)
+        return DataLoader(
+            dataset=train_subset,
+            batch_size=batch_size,
+            num_workers=config.num_workers,
+            persistent_workers=config.num_workers > 0,
+            worker_init_fn=worker_init_fn,
+            shuffle=sampler is None and not streaming,
+            sampler=sampler,
+            pin_memory=use_cuda,
+            drop_last=True,
+        )
+
+    resize_schedule = None
+    if config.resize_schedule is not None:
+        resize_schedule = ResizeSchedule.parse(
+            config.resize_schedule,
+            final_size=config.resize,
+            batch_size=config.batch_size,
+            max_batch_size=config.max_batch_size,
+        )
+    # 스케줄이 있으면 첫 dataloader 를 첫 구간의 해상도로 만든다
+    # (Trainer 는 이 구간에서 시작하므로 다시 만들지 않음)
+    train_dataloader = build_train_dataloader(
+        *(resize_schedule.phase(1) if resize_schedule is not None else (config.resize, config.batch_size))
     )
     valid_dataloader = DataLoader(
         dataset=valid_set,
-        batch_size=args.valid_batch_size,
-        num_workers=0,
+        batch_size=config.valid_batch_size,
+        num_workers=config.num_workers,
+        persistent_workers=config.num_workers > 0,
+        worker_init_fn=worker_init_fn,
         shuffle=False,
+        sampler=module_sampler.ShardSampler(valid_set) if config.distributed else None,
         pin_memory=use_cuda,
-        drop_last=True,
+        drop_last=False,  # 검증은 모든 샘플을 봅니다
     )
 
-    # build model architecture, then print to console
-    model_module = getattr(module_arch, config.model)
-    model = model_module(num_classes=num_classes).to(device)
-    model = torch.nn.DataParallel(model)
+    if config.head_variants is not None:
+        trainer = build_head_experiment(config, num_classes, device,
+                                        train_dataloader=train_dataloader,
+                                        train_dataloader_fn=build_train_dataloader,
+                                        resize_schedule=resize_schedule,
+                                        valid_dataloader=valid_dataloader,
+                                        dataset_mean=dataset_mean,
+                                        dataset_std=dataset_std,
+                                        shared_cache=shared_cache,
+                                        input_transform=input_transform)
+    else:
+        # build model architecture, then print to console
+        model_module = MODELS.get(config.model)
+        model = model_module(num_classes=num_classes).to(device)
+        if config.channels_last:
+            model = model.to(memory_format=torch.channels_last)
 
-    # get function handles of loss and metrics
-    criterion = module_loss.create_criterion(config.criterion)
+        # partial unfreeze: backbone 은 뒤쪽 block 부터 스케줄에 따라 학습에 포함되고,
+        # 낮은 learning rate 를 씁니다
+        unfreeze_schedule = None
+        param_groups = [{"params": [p for p in model.parameters() if p.requires_grad]}]
+        if config.unfreeze_schedule is not None:
+            if not hasattr(model, "set_trainable_blocks"):
+                raise ValueError(f"{config.model} has no backbone blocks to unfreeze, --unfreeze_schedule needs "
+                                 "e.g. EfficientNetB0MultiHead")
+            unfreeze_schedule = UnfreezeSchedule.parse(config.unfreeze_schedule)
+            model.set_grad_checkpointing(config.grad_checkpointing)
+            # optimizer 는 backbone 파라미터를 모두 갖고,
+            # 아직 고정된 (grad 가 없는) 파라미터는 step 에서 건너뜁니다
+            backbone_params = set(model.model.parameters())
+            param_groups = [
+                {"params": [p for p in model.parameters() if p.requires_grad and p not in backbone_params]},
+                {"params": list(model.model.parameters()), "lr": config.lr * config.backbone_lr_scale},
+            ]
+        if config.distributed:
+            model = DistributedDataParallel(model)
+            # 파라미터는 rank 0 에서 broadcast 되었으므로 augmentation 난수만 rank 별로 다르게
+            seed_everything(config.seed + rank)
+        else:
+            model = torch.nn.DataParallel(model)
 
-    # build optimizer, learning rate scheduler. delete every lines containing lr_scheduler for disabling scheduler
-    trainable_params = filter(lambda p: p.requires_grad, model.parameters())
-    optimizer_module = getattr(import_module("torch.optim"), config.optimizer)  # default: Adam
-    optimizer = optimizer_module(
-        trainable_params,
-        lr=config.lr,
-    )
-    lr_scheduler = StepLR(optimizer, args.lr_decay_step, gamma=0.5)
+        # get function handles of loss and metrics
+        criterion = CRITERIA.get(config.criterion)()
+
+        # build optimizer, learning rate scheduler. delete every lines containing lr_scheduler for disabling scheduler
+        optimizer_module = OPTIMIZERS.get(config.optimizer)  # default: Adam
+        optimizer = optimizer_module(
+            param_groups,
+            lr=config.lr,
+        )
+        lr_scheduler = StepLR(optimizer, args.lr_decay_step, gamma=0.5)
+
+        trainer_kwargs = {}
+        trainer_module = Trainer
+        if teacher_logits is not None:
+            trainer_module = DistillationTrainer
+            trainer_kwargs = {"alpha": config.distill_alpha, "temperature": config.distill_temperature}
+        trainer = trainer_module(model, criterion, optimizer,
+                                 config=config,
+                                 device=device,
+                                 train_dataloader=train_dataloader,
+                                 train_dataloader_fn=build_train_dataloader,
+                                 resize_schedule=resize_schedule,
+                                 valid_dataloader=valid_dataloader,
+                                 dataset_mean = dataset_mean,
+                                 dataset_std = dataset_std,
+                                 lr_scheduler=lr_scheduler,
+                                 shared_cache=shared_cache,
+                                 input_transform=input_transform,
+                                 unfreeze_schedule=unfreeze_schedule,
+                                 **trainer_kwargs)
 
-    trainer = Trainer(model, criterion, optimizer,
-                      config=config,
-                      device=device,
-                      train_dataloader=train_dataloader,
-                      valid_dataloader=valid_dataloader,
-                      dataset_mean = dataset_mean,
-                      dataset_std = dataset_std,
-                      lr_scheduler=lr_scheduler)
+    try:
+        trainer.train()
+        trainer.save_results(config.results_file)
+    finally:
+        if shared_cache is not None:
+            shared_cache.close()
+        for cache in list(transform_caches.values()) + [cache for cache, _ in train_caches.values()]:
+            if isinstance(cache, SharedTensorCache):
+                cache.close()
 
-    trainer.train()
+    if config.distributed:
+        cleanup_distributed()
 
 
 if __name__ == '__main__':
@@ -144,6 +506,31 @@ if __name__ == '__main__':
         default="MaskDataLoader",
         help="dataloader type (default: MaskDataLoader)"
     )
+    parser.add_argument(
+        "--sampler",
+        type=str,
+        default=None,
+        help="training sampler type: class_balanced, sqrt_balanced, task_balanced, loss_aware "
+             "(default: None, uniform shuffle)",
+    )
+    parser.add_argument(
+        "--loss_floor",
+        type=float,
+        default=0.1,
+        help="loss_aware sampler: minimum sampling weight relative to the mean tracked loss (default: 0.1)",
+    )
+    parser.add_argument(
+        "--loss_staleness",
+        type=int,
+        default=3,
+        help="loss_aware sampler: samples whose loss is older than this many epochs are revisited (default: 3)",
+    )
+    parser.add_argument(
+        "--loss_momentum",
+        type=float,
+        default=0.5,
+        help="loss_aware sampler: moving average weight of the previous per-sample loss (default: 0.5)",
+    )
     parser.add_argument(
         "--resize",
         nargs=2,
@@ -151,6 +538,85 @@ if __name__ == '__main__':
         default=[128, 96],
         help="resize size for image when training",
     )
+    parser.add_argument(
+        "--val_cache_mb",
+        type=int,
+        default=1024,
+        help="memory bound of the cache for deterministic validation transforms in MiB, shared by all dataloader "
+             "workers (default: 1024, 0 disables)",
+    )
+    parser.add_argument(
+        "--train_cache_mb",
+        type=int,
+        default=0,
+        help="memory bound of the cache for the deterministic prefix of training transforms in MiB, shared by all "
+             "dataloader workers (default: 0, disabled)",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=0,
+        help="dataloader worker processes for training and validation (default: 0)",
+    )
+    parser.add_argument(
+        "--uint8_transport",
+        action="store_true",
+        help="dataloader workers emit uint8 images and the batches are normalized on the compute device "
+             "(4x fewer bytes through the worker queues and host-to-device copies)",
+    )
+    parser.add_argument(
+        "--channels_last",
+        action="store_true",
+        help="with --uint8_transport, normalize the batches into channels_last memory format and convert the "
+             "model to it",
+    )
+    parser.add_argument(
+        "--exec_profile",
+        type=str,
+        default="none",
+        help="partition of the CPU cores between compute threads and dataloader workers, pinned and applied "
+             "before torch is imported: none, threads=12,workers=4[,interop=2][,pin=0] (overrides --num_workers) "
+             "or auto (measures a few partitions once per host, model and resize) (default: none)",
+    )
+    parser.add_argument(
+        "--exec_profile_cache",
+        type=str,
+        default=None,
+        help="json file of --exec_profile auto results (default: ~/.cache/mask_execution_profile.json)",
+    )
+    parser.add_argument(
+        "--shared_cache_mb",
+        type=int,
+        default=0,
+        help="byte budget in MiB of the decoded-image cache shared by all dataloader workers (default: 0, disabled)",
+    )
+    parser.add_argument(
+        "--shared_cache_size",
+        nargs=2,
+        type=int,
+        default=None,
+        help="height width the images are pre-resized to before caching (default: None, size of the first image)",
+    )
+    parser.add_argument(
+        "--shared_cache_eviction",
+        type=str,
+        default="clock",
+        choices=["clock", "fifo"],
+        help="slot replacement policy when the shared cache is full (default: clock)",
+    )
+    parser.add_argument(
+        "--resize_schedule",
+        type=str,
+        default=None,
+        help="progressive resizing as \"start_epoch:height,width;...\", the last phase must be --resize "
+             "(e.g. \"1:64,48;6:96,72;11:128,96\", default: None, fixed --resize)",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=None,
+        help="upper bound of the batch size scaled up for low-resolution phases (default: None)",
+    )
     parser.add_argument(
         "--batch_size",
         type=int,
@@ -163,9 +629,73 @@ if __name__ == '__main__':
         default=1000,
         help="input batch size for validing (default: 1000)",
     )
+    parser.add_argument(
+        "--background_validation",
+        action="store_true",
+        help="validate a snapshot of the weights in a separate process while the next epoch trains; "
+             "checkpoints, early stopping and logs follow the results in epoch order",
+    )
+    parser.add_argument(
+        "--valid_cpus",
+        type=str,
+        default=None,
+        help="CPUs of the background validation process, e.g. \"6,7\" or \"6-7\" "
+             "(training is pinned to the others, default: None, share every CPU)",
+    )
+    parser.add_argument(
+        "--valid_max_pending",
+        type=int,
+        default=2,
+        help="weight snapshots waiting for background validation before training blocks (default: 2)",
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="replace --batch_size and --valid_batch_size by the batch sizes with the highest measured "
+             "samples/sec on this host (cached per model, resize and host)",
+    )
+    parser.add_argument(
+        "--autotune_memory_mb",
+        type=float,
+        default=None,
+        help="memory ceiling of the autotune probes in MiB "
+             "(default: 90%% of the GPU memory, or half of the physical memory on CPU)",
+    )
+    parser.add_argument(
+        "--autotune_max_batch_size",
+        type=int,
+        default=1024,
+        help="largest batch size probed by --autotune (default: 1024)",
+    )
+    parser.add_argument(
+        "--autotune_cache",
+        type=str,
+        default=None,
+        help="json file of autotune results (default: ~/.cache/mask_autotune.json)",
+    )
     parser.add_argument(
         "--model", type=str, default="EfficientNetB0MultiHead", help="model type (default: EfficientNetB0MultiHead)"
     )
+    parser.add_argument(
+        "--unfreeze_schedule",
+        type=str,
+        default=None,
+        help="trains the last backbone blocks of the model from the given epochs as \"start_epoch:blocks;...\" "
+             "with blocks a count or all (e.g. \"1:0;4:2;8:all\", EfficientNetB0MultiHead only, "
+             "default: None, frozen backbone)",
+    )
+    parser.add_argument(
+        "--backbone_lr_scale",
+        type=float,
+        default=0.1,
+        help="learning rate of the unfrozen backbone blocks relative to --lr (default: 0.1)",
+    )
+    parser.add_argument(
+        "--grad_checkpointing",
+        action="store_true",
+        help="with --unfreeze_schedule, recompute the activations of the unfrozen backbone blocks in the backward "
+             "pass instead of storing them",
+    )
     parser.add_argument(
         "--optimizer", type=str, default="Adam", help="optimizer type (default: Adam)"
     )
@@ -178,6 +708,67 @@ if __name__ == '__main__':
         default=0.2,
         help="ratio for validaton (default: 0.2)",
     )
+    parser.add_argument(
+        "--n_splits",
+        type=int,
+        default=None,
+        help="number of profile-level stratified folds (default: round(1 / val_ratio))",
+    )
+    parser.add_argument(
+        "--fold",
+        type=int,
+        default=0,
+        help="fold index used for validation (default: 0)",
+    )
+    parser.add_argument(
+        "--split_file",
+        type=str,
+        default=None,
+        help="json path to save/reuse the profile fold split with its seed (default: None)",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="npz path to save/reuse the dataset sample table instead of walking data_dir (default: None)",
+    )
+    parser.add_argument(
+        "--image_cache",
+        type=str,
+        default=None,
+        help="decoded uint8 image cache built by sweep.py from the same manifest (default: None, decode jpg)",
+    )
+    parser.add_argument(
+        "--teacher_path",
+        type=str,
+        default=None,
+        help="checkpoint of a trained teacher; trains --model as a distilled student on its soft targets "
+             "(default: None, no distillation)",
+    )
+    parser.add_argument(
+        "--teacher_model",
+        type=str,
+        default="EfficientNetB0MultiHead",
+        help="model type of the teacher checkpoint (default: EfficientNetB0MultiHead)",
+    )
+    parser.add_argument(
+        "--teacher_logits",
+        type=str,
+        default=None,
+        help="npy path of the cached teacher logits (default: next to --teacher_path)",
+    )
+    parser.add_argument(
+        "--distill_alpha",
+        type=float,
+        default=0.9,
+        help="weight of the soft target loss, 1 - alpha weights the criterion on hard labels (default: 0.9)",
+    )
+    parser.add_argument(
+        "--distill_temperature",
+        type=float,
+        default=4.0,
+        help="softmax temperature of the soft targets (default: 4.0)",
+    )
     parser.add_argument(
         "--criterion",
         type=str,
@@ -190,6 +781,55 @@ if __name__ == '__main__':
         default=20,
         help="learning rate scheduler deacy step (default: 20)",
     )
+    parser.add_argument(
+        "--monitor",
+        type=str,
+        default="max val_f1",
+        help="metric to select best.pth, \"<min|max> <metric>\" or off "
+             "(e.g. \"min val_loss\", \"max val_acc\", \"max val_age_f1\", default: \"max val_f1\")",
+    )
+    parser.add_argument(
+        "--target",
+        type=float,
+        default=None,
+        help="value of the monitored metric whose first reaching epoch is saved as epochs_to_target "
+             "in results.json (default: None)",
+    )
+    parser.add_argument(
+        "--early_stop",
+        type=int,
+        default=0,
+        help="stop when the monitored metric does not improve for this many epochs (default: 0, disabled)",
+    )
+    parser.add_argument(
+        "--min_delta",
+        type=float,
+        default=0.0,
+        help="minimum change of the monitored metric that counts as an improvement (default: 0.0)",
+    )
+    parser.add_argument(
+        "--time_budget",
+        type=float,
+        default=None,
+        help="wall-clock budget in seconds; no epoch is started that is expected to exceed it (default: None)",
+    )
+    parser.add_argument(
+        "--sample_budget",
+        type=int,
+        default=None,
+        help="stop after the epoch in which this many training samples have been seen (default: None)",
+    )
+    parser.add_argument(
+        "--restore_best",
+        action="store_true",
+        help="load the best monitored weights back into the model when training ends",
+    )
+    parser.add_argument(
+        "--results_file",
+        type=str,
+        default=None,
+        help="extra json path for the final metrics, also saved as results.json in the run directory",
+    )
     parser.add_argument(
         "--log_interval",
         type=int,
@@ -216,6 +856,28 @@ if __name__ == '__main__':
         help="성별 판별이 어려운 데이터(EDA-오류처럼 보이는 데이터) 사용 여부"
     )
 
+    parser.add_argument(
+        "--head_variants",
+        type=str,
+        default=None,
+        help="json list (or json file) of head sets trained together on one frozen efficientnet_b0 backbone, "
+             "e.g. '[{\"name\": \"ce\", \"criterion\": \"cross_entropy\"}, "
+             "{\"name\": \"f1\", \"criterion\": \"f1\", \"lr\": 3e-4, \"hidden\": [256]}]' "
+             "(default: None, --model is trained)",
+    )
+    parser.add_argument(
+        "--vectorize_heads",
+        action="store_true",
+        help="evaluate the --head_variants head sets together with torch.func.vmap (same hidden widths required)",
+    )
+
+    parser.add_argument(
+        "--distributed",
+        action="store_true",
+        help="DistributedDataParallel on CPU with the gloo backend. launch with torchrun "
+             "(e.g. torchrun --nproc_per_node 4 train.py --distributed ...), --batch_size is per process",
+    )
+
     # Container environment
     parser.add_argument(
         "--data_dir",
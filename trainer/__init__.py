@@ -1 +1,3 @@
 from .trainer import *
+from .multi_head_trainer import *
+from .distillation_trainer import *
@@ -0,0 +1,175 @@
+import collections
+import copy
+import os
+import queue
+import time
+import traceback
+
+import torch
+from torch.utils.data import DataLoader
+
+import model.metric as module_metric
+from utils import unwrap_model
+
+
+def parse_cpus(spec):
+    """
+    Parse a CPU list such as "6,7" or "4-7" (the format of taskset -c)
+
+    :return: set of CPU ids
+    """
+    cpus = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _validation_worker(model, dataset, batch_size, num_workers, criterion, multi_head, cpus, jobs, results,
+                       input_transform=None):
+    """
+    Loop of the validation process: load each weight snapshot, evaluate it and send the log back, in job order
+    """
+    from trainer.trainer import evaluate
+
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(len(cpus))
+    dataloader = DataLoader(
+        dataset, batch_size=batch_size, num_workers=num_workers, persistent_workers=num_workers > 0, shuffle=False
+    )
+    metrics = module_metric.MultiTaskMetrics(num_classes=18, topk=(3,))
+    parent = os.getppid()
+    while True:
+        try:
+            job = jobs.get(timeout=5.0)
+        except queue.Empty:
+            if os.getppid() != parent:  # the training process died without closing the validator
+                return
+            continue
+        if job is None:
+            return
+        epoch, state_dict = job
+        try:
+            start = time.time()
+            model.load_state_dict(state_dict)
+            del state_dict
+            log, sample = evaluate(model, dataloader, criterion, multi_head, metrics, input_transform=input_transform)
+            results.put((epoch, log, sample, time.time() - start, None))
+        except Exception:
+            results.put((epoch, None, None, 0.0, traceback.format_exc()))
+
+
+class BackgroundValidator:
+    """
+    Validates snapshots of the model weights in a separate process while training continues
+
+    The process is spawned once with a copy of the model, the validation dataset and the criterion, and keeps its
+    own dataloader (and its workers' caches) for the whole run. After each epoch the trainer submits a CPU copy of
+    the weights; the process evaluates the snapshots one by one, so the results come back in epoch order.
+    A snapshot is kept until its result arrives, so checkpoints are saved from the weights that were validated.
+    At most `max_pending` snapshots are in flight; submitting more blocks on the oldest result.
+
+    With `cpus`, the validation process is pinned to those CPUs and sets its torch thread count to match. If the
+    training process is allowed on some of them, it is pinned to the remaining ones and its thread count is lowered
+    to at most one per remaining CPU; a thread count set before (e.g. by an execution profile) is otherwise kept.
+    """
+    def __init__(self, model, dataloader, criterion, multi_head, cpus=None, max_pending=2, on_result=None,
+                 input_transform=None):
+        """
+        :param model: the trained model (copied to the validation process once, without its training state)
+        :param dataloader: the validation DataLoader; its dataset, batch_size and num_workers are reused
+        :param criterion: loss function of the validation loss
+        :param multi_head: True if the model returns (mask, gender, age) outputs
+        :param cpus: set of CPU ids for the validation process, or None to share every CPU
+        :param max_pending: snapshots in flight before submit blocks
+        :param on_result: called with (epoch, val log, sample) of each result, returns the val log to keep
+        :param input_transform: applied to the input batches in the validation process (e.g. DeviceNormalize)
+        """
+        context = torch.multiprocessing.get_context("spawn")
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.max_pending = max_pending
+        self.on_result = on_result
+        self.pending = collections.OrderedDict()  # epoch -> (train log, state_dict)
+        self.process = context.Process(
+            target=_validation_worker,
+            args=(
+                copy.deepcopy(unwrap_model(model)).cpu(),
+                dataloader.dataset,
+                dataloader.batch_size,
+                dataloader.num_workers,
+                criterion,
+                multi_head,
+                cpus,
+                self.jobs,
+                self.results,
+                copy.deepcopy(input_transform).cpu() if input_transform is not None else None,
+            ),
+            daemon=False,  # the process starts its own dataloader workers
+        )
+        self.process.start()
+
+        if cpus:
+            affinity = os.sched_getaffinity(0)
+            train_cpus = affinity - set(cpus)
+            if not train_cpus:
+                print(f"Background validation on CPUs {sorted(cpus)}, no CPU left for training, sharing them")
+            else:
+                if train_cpus != affinity:
+                    os.sched_setaffinity(0, train_cpus)
+                    torch.set_num_threads(min(torch.get_num_threads(), len(train_cpus)))
+                print(f"Background validation on CPUs {sorted(cpus)}, training on CPUs {sorted(train_cpus)} "
+                      f"with {torch.get_num_threads()} threads")
+
+    def submit(self, epoch, train_log, model):
+        """
+        Queue a snapshot of the current weights for validation
+
+        :param epoch: the epoch that just finished
+        :param train_log: its training log, merged with the validation log when the result arrives
+        :param model: the model whose weights are copied
+        """
+        state_dict = {
+            key: value.detach().to("cpu", copy=True) for key, value in unwrap_model(model).state_dict().items()
+        }
+        self.pending[epoch] = (train_log, state_dict)
+        self.jobs.put((epoch, state_dict))
+
+    def _get(self, block):
+        while True:
+            try:
+                return self.results.get(timeout=1.0 if block else 0.0)
+            except queue.Empty:
+                if not block:
+                    return None
+                if not self.process.is_alive():
+                    raise RuntimeError(f"background validation process exited with code {self.process.exitcode}")
+
+    def collect(self, block=False):
+        """
+        Yield the finished validations in epoch order
+
+        :param block: wait for every pending snapshot (at the end of training)
+        :return: generator of (epoch, train log updated with the validation log, validated state_dict)
+        """
+        while self.pending:
+            must_wait = block or len(self.pending) > self.max_pending
+            result = self._get(must_wait)
+            if result is None:
+                break
+            epoch, log, sample, elapsed, error = result
+            if error is not None:
+                raise RuntimeError(f"validation of epoch {epoch} failed in the background process:\n{error}")
+            train_log, state_dict = self.pending.pop(epoch)
+            print(f"[Val] epoch {epoch} validated in the background ({elapsed:.1f}s)")
+            if self.on_result is not None:
+                log = self.on_result(epoch, log, sample)
+            yield epoch, dict(train_log, **log), state_dict
+
+    def close(self):
+        if self.process.is_alive():
+            self.jobs.put(None)
+            self.process.join(timeout=60)
+        if self.process.is_alive():
+            self.process.terminate()
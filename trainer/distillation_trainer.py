@@ -0,0 +1,57 @@
+import torch
+import torch.nn.functional as F
+
+from data_loader.teacher_logits import TeacherLogits
+from trainer.trainer import Trainer
+from utils import MetricTracker
+
+
+def distillation_loss(student_logits, teacher_logits, temperature):
+    """
+    Hinton et al. soft target loss: KL(teacher || student) of the temperature-softened distributions,
+    scaled by T^2 so that its gradient magnitude does not depend on the temperature
+    """
+    return F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=-1),
+        F.log_softmax(teacher_logits / temperature, dim=-1),
+        reduction="batchmean",
+        log_target=True,
+    ) * temperature ** 2
+
+
+class DistillationTrainer(Trainer):
+    """
+    Trains a small multi-head student on the cached soft targets of a trained teacher
+
+    The train batches carry the teacher logits of every sample as a sixth tensor (see WithTeacherLogits).
+    Every head is trained on alpha * soft target loss + (1 - alpha) * criterion on the hard labels.
+    Validation and checkpoints are those of Trainer, so the student is saved in the same multi-head format.
+    """
+    def __init__(self, model, criterion, optimizer, config, alpha=0.9, temperature=4.0, **kwargs):
+        super().__init__(model, criterion, optimizer, config, **kwargs)
+        if not self.config.multi_head:
+            raise ValueError("distillation trains mask / gender / age heads, use --multi_head True")
+        self.alpha = alpha
+        self.temperature = temperature
+        self.train_metrics = MetricTracker("loss", "acc", "soft_loss", "hard_loss", device=self.device)
+
+    def _compute_loss(self, outs, batch):
+        """
+        alpha * soft target loss + (1 - alpha) * criterion on the hard labels, summed over the heads
+
+        The two terms are also tracked in train_metrics, so the log lines show their running averages.
+
+        :param outs: the (mask, gender, age) logits of the student
+        :param batch: the train batch on the device, (inputs, labels, mask, gender, age, teacher logits)
+        :return: the scalar loss to backpropagate
+        """
+        targets = batch[2:5]
+        teacher_outs = torch.split(batch[5], TeacherLogits.head_sizes, dim=-1)
+        soft_loss = sum(
+            distillation_loss(out, teacher_out, self.temperature) for out, teacher_out in zip(outs, teacher_outs)
+        )
+        hard_loss = sum(self.criterion(out, target) for out, target in zip(outs, targets))
+        self.train_metrics.update_many(
+            {"soft_loss": soft_loss.detach(), "hard_loss": hard_loss.detach()}, n=batch[0].size(0)
+        )
+        return self.alpha * soft_loss + (1 - self.alpha) * hard_loss
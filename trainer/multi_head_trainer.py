@@ -0,0 +1,311 @@
+import os
+
+import numpy as np
+import torch
+from torch.func import functional_call, vmap
+
+import model.metric as module_metric
+from model.loss import per_sample_loss
+from trainer.trainer import Trainer
+from utils import MetricTracker, unwrap_model
+from utils.registry import LazyModule
+
+wandb = LazyModule("wandb")
+
+
+class HeadVariant:
+    """
+    One head set of a SharedBackboneMultiHead together with its own criterion, optimizer and lr scheduler
+    """
+    def __init__(self, name, head, criterion, optimizer, lr_scheduler=None, device=None):
+        self.name = name
+        self.head = head
+        self.criterion = criterion
+        self.optimizer = optimizer
+        self.lr_scheduler = lr_scheduler
+        self.train_metrics = MetricTracker("loss", "acc", device=device)
+        self.valid_metrics = module_metric.MultiTaskMetrics(num_classes=18, topk=(3,), device=device)
+
+
+class MultiHeadExperimentTrainer(Trainer):
+    """
+    Trains several head variants on one shared frozen backbone in a single pass over the data
+
+    The backbone forward runs once per batch and every variant is trained on the same features with its own
+    criterion and optimizer. With vectorize=True the head sets (which then must share one architecture) are
+    evaluated together with torch.func.vmap over their stacked parameters.
+    Each variant is monitored and checkpointed separately under {save_dir}/{variant}/, and training stops
+    early only when no variant has improved for early_stop epochs.
+    """
+    def __init__(self, model, variants, config, device=None, train_dataloader=None, valid_dataloader=None,
+                 dataset_mean=None, dataset_std=None, train_dataloader_fn=None, resize_schedule=None,
+                 vectorize=False, shared_cache=None, input_transform=None):
+        super().__init__(model, None, None, config,
+                         device=device,
+                         train_dataloader=train_dataloader,
+                         valid_dataloader=valid_dataloader,
+                         dataset_mean=dataset_mean,
+                         dataset_std=dataset_std,
+                         train_dataloader_fn=train_dataloader_fn,
+                         resize_schedule=resize_schedule,
+                         shared_cache=shared_cache,
+                         input_transform=input_transform)
+        self.net = unwrap_model(model)
+        self.variants = variants
+        # every variant keeps its own best.pth, so the whole-model restore of BaseTrainer does not apply
+        self.restore_best = False
+        self.variant_best = {variant.name: self.mnt_best for variant in variants}
+        self.variant_best_log = {variant.name: None for variant in variants}
+        self.variant_improved = set()
+        self.epoch_logs = {}
+
+        self.vectorize = vectorize
+        if vectorize:
+            self._check_vectorizable()
+            self._head_params = [dict(variant.head.named_parameters()) for variant in variants]
+            self._head_buffers = [dict(variant.head.named_buffers()) for variant in variants]
+
+        if self.is_main:
+            for variant in variants:
+                os.makedirs(os.path.join(self.save_dir, variant.name), exist_ok=True)
+
+    def _check_vectorizable(self):
+        shapes = [
+            [(name, tuple(param.shape)) for name, param in variant.head.state_dict().items()]
+            for variant in self.variants
+        ]
+        if any(shape != shapes[0] for shape in shapes[1:]):
+            raise ValueError("vectorized head variants must share the same head architecture (hidden widths)")
+
+    def _forward_heads(self, features):
+        """
+        :return: list of (mask, gender, age) outputs, one per variant
+        """
+        if not self.vectorize:
+            return [variant.head(features) for variant in self.variants]
+
+        # torch.stack keeps the autograd graph, so gradients flow back to every variant's own parameters
+        params = {name: torch.stack([p[name] for p in self._head_params]) for name in self._head_params[0]}
+        buffers = {name: torch.stack([b[name] for b in self._head_buffers]) for name in self._head_buffers[0]}
+        template = self.variants[0].head
+
+        def forward(head_params, head_buffers, x):
+            return functional_call(template, (head_params, head_buffers), (x,))
+
+        outputs = vmap(forward, in_dims=(0, 0, None))(params, buffers, features)
+
+        if template.training:
+            # batch norm updated the stacked copies of the running statistics
+            with torch.no_grad():
+                for name, stacked in buffers.items():
+                    for head_buffers, value in zip(self._head_buffers, stacked.unbind(0)):
+                        head_buffers[name].copy_(value)
+        return [tuple(output[i] for output in outputs) for i in range(len(self.variants))]
+
+    def _variant_loss(self, variant, outs, targets):
+        return sum(variant.criterion(out, target) for out, target in zip(outs, targets))
+
+    def _train_epoch(self, epoch):
+        """
+        Training logic for an epoch, all variants on the same batches
+
+        :param epoch: Integer, current training epoch.
+        """
+        self.model.train()
+        for variant in self.variants:
+            variant.train_metrics.reset()
+
+        if self.resize_schedule is not None:
+            self._set_resize_phase(epoch)
+
+        sampler = getattr(self.train_dataloader, "sampler", None)
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(epoch)
+        elif hasattr(self.train_dataloader.dataset, "set_epoch"):  # streaming dataset shuffles by itself
+            self.train_dataloader.dataset.set_epoch(epoch)
+
+        for idx, train_batch in enumerate(self.train_dataloader):
+            inputs, labels, mask, gender, age = [tensor.to(self.device) for tensor in train_batch]
+            inputs = self._transform_inputs(inputs)
+            targets = (mask, gender, age)
+
+            for variant in self.variants:
+                variant.optimizer.zero_grad()
+
+            features = self.net.features(inputs)
+            total_loss = 0
+            variant_outs = self._forward_heads(features)
+            for variant, outs in zip(self.variants, variant_outs):
+                loss = self._variant_loss(variant, outs, targets)
+                total_loss = total_loss + loss
+                preds = torch.argmax(outs[0], dim=-1) * 6 + torch.argmax(outs[1], dim=-1) * 3 \
+                    + torch.argmax(outs[2], dim=-1)
+                variant.train_metrics.update_many(
+                    {"loss": loss.detach(), "acc": (preds == labels).float().mean()}, n=labels.size(0)
+                )
+
+            # the head sets share no parameters, so one backward gives every variant its own gradients
+            total_loss.backward()
+            for variant in self.variants:
+                variant.optimizer.step()
+
+            if hasattr(sampler, "update"):  # the loss-aware sampler tracks the per-sample loss averaged over variants
+                with torch.no_grad():
+                    sample_losses = sum(
+                        per_sample_loss(variant.criterion, out.detach(), target)
+                        for variant, outs in zip(self.variants, variant_outs)
+                        for out, target in zip(outs, targets)
+                    ) / len(self.variants)
+                sampler.update(idx * self.train_dataloader.batch_size, sample_losses)
+            self.samples_seen += labels.size(0)
+
+            if (idx + 1) % self.config.log_interval == 0:
+                summary = []
+                for variant in self.variants:
+                    window = variant.train_metrics.window_result()
+                    variant.train_metrics.reset_window()
+                    summary.append(f"{variant.name} loss {window['loss']:4.4} acc {window['acc']:4.2%}")
+                    step = epoch * len(self.train_dataloader) + idx
+                    self.logger.add_scalar(f"Train/{variant.name}/loss", window["loss"], step)
+                    self.logger.add_scalar(f"Train/{variant.name}/accuracy", window["acc"], step)
+                    wandb.log({f"{variant.name}/Train loss": window["loss"],
+                               f"{variant.name}/Train acc": window["acc"]})
+                print(f"Epoch[{epoch}/{self.config.epochs}]({idx + 1}/{len(self.train_dataloader)}) || "
+                      + " || ".join(summary))
+
+        self._log_cache_stats("Train", epoch)
+        if hasattr(sampler, "update"):
+            print(f"[Train] {sampler}")
+        for variant in self.variants:
+            if variant.lr_scheduler is not None:
+                variant.lr_scheduler.step()
+
+        self.epoch_logs = {
+            variant.name: dict(
+                {f"train_{key}": value for key, value in variant.train_metrics.result().items()}, epoch=epoch
+            )
+            for variant in self.variants
+        }
+        if self.do_validation:
+            for name, log in self._valid_epoch(epoch).items():
+                self.epoch_logs[name].update(log)
+        return {f"{name}/{key}": value for name, log in self.epoch_logs.items() for key, value in log.items()}
+
+    def _valid_epoch(self, epoch):
+        """
+        Validate every variant after training an epoch
+
+        :param epoch: Integer, current training epoch.
+        :return: dict variant name -> log dict with val_loss and the scalar metrics of MultiTaskMetrics
+        """
+        self.model.eval()
+        for variant in self.variants:
+            variant.valid_metrics.reset()
+        val_loss_total = torch.zeros(len(self.variants), dtype=torch.float64, device=self.device)
+        val_samples = 0
+
+        with torch.no_grad():
+            print("Calculating validation results...")
+            for val_batch in self.valid_dataloader:
+                inputs, labels, mask, gender, age = [tensor.to(self.device) for tensor in val_batch]
+                features = self.net.features(self._transform_inputs(inputs))
+                for i, (variant, outs) in enumerate(zip(self.variants, self._forward_heads(features))):
+                    val_loss_total[i] += self._variant_loss(variant, outs, (mask, gender, age)) * labels.size(0)
+                    variant.valid_metrics.update(outs, labels)
+                val_samples += labels.size(0)
+
+        self._log_cache_stats("Val", epoch)
+        logs = {}
+        for variant, loss_total in zip(self.variants, val_loss_total.tolist()):
+            log = {"val_loss": loss_total / max(val_samples, 1)}
+            log.update(module_metric.scalar_metrics(variant.valid_metrics.compute(), prefix="val_"))
+            logs[variant.name] = log
+
+            self.logger.add_scalar(f"Val/{variant.name}/loss", log["val_loss"], epoch)
+            self.logger.add_scalar(f"Val/{variant.name}/accuracy", log["val_acc"], epoch)
+            self.logger.add_scalar(f"Val/{variant.name}/f1", log["val_f1"], epoch)
+            wandb.log({f"{variant.name}/Valid loss": log["val_loss"],
+                       f"{variant.name}/Valid acc": log["val_acc"],
+                       f"{variant.name}/Valid f1": log["val_f1"]})
+
+        self._print_variant_table(logs)
+        return logs
+
+    def _print_variant_table(self, logs):
+        keys = ["val_loss", "val_acc", "val_f1", "val_mask_f1", "val_gender_f1", "val_age_f1"]
+        width = max(len(name) for name in logs)
+        print(f"[Val] {'variant'.ljust(width)}  " + "  ".join(key[4:].rjust(9) for key in keys))
+        for name, log in logs.items():
+            print(f"[Val] {name.ljust(width)}  " + "  ".join(f"{log[key]:9.4f}" for key in keys))
+        print()
+
+    def _update_monitor(self, log):
+        """
+        Check the monitored metric of every variant
+
+        :return: True if any variant improved; the improved variants are kept in self.variant_improved
+        """
+        self.variant_improved = set()
+        if self.mnt_mode == "off":
+            return False
+        for name, variant_log in self.epoch_logs.items():
+            if self.mnt_metric not in variant_log:
+                print(f"Warning: Metric '{self.mnt_metric}' is not found. "
+                      "Model performance monitoring is disabled.")
+                self.mnt_mode = "off"
+                return False
+            value = variant_log[self.mnt_metric]
+            best = self.variant_best[name]
+            if (self.mnt_mode == "min" and value < best - self.min_delta) or \
+               (self.mnt_mode == "max" and value > best + self.min_delta):
+                self.variant_best[name] = value
+                self.variant_best_log[name] = dict(variant_log)
+                self.variant_improved.add(name)
+
+        values = list(self.variant_best.values())
+        self.mnt_best = min(values) if self.mnt_mode == "min" else max(values)
+        return bool(self.variant_improved)
+
+    def _check_target(self, epoch, log):
+        """
+        The target counts as reached as soon as any variant reaches it
+        """
+        values = [variant_log[self.mnt_metric] for variant_log in self.epoch_logs.values()
+                  if self.mnt_metric in variant_log]
+        if values:
+            pick = min if self.mnt_mode == "min" else max
+            super()._check_target(epoch, {self.mnt_metric: pick(values)})
+
+    def _save_checkpoint(self, epoch, save_best=False, state_dict=None):
+        """
+        Saving {variant}/last.pth every epoch, and {variant}/best.pth for the variants that improved.
+        The state dicts load directly into EfficientNetB0MultiHead.
+
+        :param epoch: current epoch number
+        :param save_best: if True, at least one variant improved
+        :param state_dict: unused, the variants are always validated in process and saved from the model
+        """
+        for index, variant in enumerate(self.variants):
+            state_dict = self.net.variant_state_dict(index)
+            variant_dir = os.path.join(self.save_dir, variant.name)
+            if variant.name in self.variant_improved:
+                print(f"New best {variant.name} for {self.mnt_metric} : {self.variant_best[variant.name]:4.4}! "
+                      "saving the best model..")
+                torch.save(state_dict, os.path.join(variant_dir, "best.pth"))
+            torch.save(state_dict, os.path.join(variant_dir, "last.pth"))
+
+    def results(self):
+        """
+        Summary of the run with the best log of every variant. "best" is the best variant's log.
+        """
+        results = super().results()
+        results["variants"] = {
+            name: {"best": self.variant_best_log[name], "last": self.epoch_logs.get(name)}
+            for name in self.variant_best
+        }
+        if self.mnt_mode != "off":
+            pick = np.argmin if self.mnt_mode == "min" else np.argmax
+            names = list(self.variant_best)
+            best_name = names[int(pick([self.variant_best[name] for name in names]))]
+            results["best"] = dict(self.variant_best_log[best_name] or {}, variant=best_name)
+        return results
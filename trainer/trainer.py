@@ -5,12 +5,63 @@ import random
 import glob
 import re
 import json
-import wandb
 from pathlib import Path
-from torchvision.utils import make_grid
 from base.base_trainer import BaseTrainer
-import matplotlib.pyplot as plt
-from torch.utils.tensorboard import SummaryWriter
+import model.metric as module_metric
+from model.loss import per_sample_loss
+from trainer.background_validation import BackgroundValidator, parse_cpus
+from utils import MetricTracker, all_reduce_sum, get_world_size, is_distributed, unwrap_model
+from utils.registry import LazyModule
+
+# wandb, matplotlib, tensorboard take seconds to import, so they are loaded where they are first used
+wandb = LazyModule("wandb")
+
+
+def evaluate(model, dataloader, criterion, multi_head, metrics, device=None, n_samples=16, input_transform=None):
+    """
+    Run the model over every batch of a validation dataloader
+
+    :param multi_head: True if the model returns (mask, gender, age) outputs and the batches carry their labels
+    :param metrics: MultiTaskMetrics to accumulate into, reset first
+    :param n_samples: number of images of the first batch returned for the results figure
+    :param input_transform: applied to the input batch on the device (e.g. DeviceNormalize for uint8 batches)
+    :return: (log dict with the sample-weighted val_loss and the scalar metrics prefixed with "val_",
+        (inputs, labels, preds) CPU tensors of the first n_samples images).
+        In distributed training the loss and metrics are all-reduced over every rank's validation shard.
+    """
+    model.eval()
+    metrics.reset()
+    loss_total = torch.zeros(2, dtype=torch.float64, device=device)  # 샘플 loss 합, 샘플 수
+    sample = None
+
+    with torch.no_grad():
+        for val_batch in dataloader:
+            if multi_head:
+                inputs, labels, mask, gender, age = [tensor.to(device) for tensor in val_batch]
+                if input_transform is not None:
+                    inputs = input_transform(inputs)
+                outs = model(inputs)
+                loss = sum(criterion(out, target) for out, target in zip(outs, (mask, gender, age)))
+            else:
+                inputs, labels = [tensor.to(device) for tensor in val_batch]
+                if input_transform is not None:
+                    inputs = input_transform(inputs)
+                outs = model(inputs)
+                loss = criterion(outs, labels)
+
+            preds = metrics.update(outs, labels)
+            # 마지막 batch 가 작아도 모든 샘플이 같은 가중치를 갖도록
+            # batch 평균 loss 에 샘플 수를 곱해서 누적
+            loss_total[0] += loss.detach() * labels.size(0)
+            loss_total[1] += labels.size(0)
+            if sample is None:
+                sample = tuple(tensor[:n_samples].cpu() for tensor in (inputs, labels, preds))
+
+    result = metrics.compute()
+    loss_sum, samples = all_reduce_sum(loss_total).tolist()
+    log = {"val_loss": loss_sum / samples}
+    log.update(module_metric.scalar_metrics(result, prefix="val_"))
+    return log, sample
 
 
 class Trainer(BaseTrainer):
@@ -19,7 +70,9 @@ class Trainer(BaseTrainer):
     """
     def __init__(self, model, criterion, optimizer, config, 
                  device=None, train_dataloader=None, valid_dataloader=None, 
-                 dataset_mean=None, dataset_std=None, lr_scheduler=None):
+                 dataset_mean=None, dataset_std=None, lr_scheduler=None,
+                 train_dataloader_fn=None, resize_schedule=None, shared_cache=None, input_transform=None,
+                 unfreeze_schedule=None):
         super().__init__(model, criterion, optimizer, config)
         self.device = device
         self.train_dataloader = train_dataloader
@@ -28,11 +81,46 @@ class Trainer(BaseTrainer):
         self.dataset_std = dataset_std
         self.do_validation = self.valid_dataloader is not None
         self.lr_scheduler = lr_scheduler
+        self.train_dataloader_fn = train_dataloader_fn  # (resize, batch_size) -> DataLoader
+        self.resize_schedule = resize_schedule
+        # train_dataloader is built for the schedule's phase at start_epoch, so it is not rebuilt for epoch 1
+        self.resize_phase = resize_schedule.phase(self.start_epoch) if resize_schedule is not None else None
+        self.unfreeze_schedule = unfreeze_schedule  # UnfreezeSchedule of a model with set_trainable_blocks
+        self.unfreeze_phase = None
+        self.shared_cache = shared_cache  # SharedImageCache filled by the dataloader workers
+        # applied to every input batch on the device, e.g. DeviceNormalize when the dataloader yields uint8 images
+        self.input_transform = input_transform.to(device) if input_transform is not None else None
         self.best_val_acc = 0
+        self.best_val_f1 = 0.0
         self.best_val_loss = np.inf
+        self.train_metrics = MetricTracker("loss", "acc", device=self.device)
+        self.valid_metrics = module_metric.MultiTaskMetrics(num_classes=18, topk=(3,), device=self.device)
+
+        # 검증을 별도 프로세스에서 weight snapshot 으로 실행하고,
+        # 학습은 기다리지 않고 다음 epoch 으로 넘어갑니다
+        if self.do_validation and getattr(self.config, "background_validation", False):
+            if is_distributed():
+                raise ValueError("background validation does not support distributed training")
+            valid_cpus = getattr(self.config, "valid_cpus", None)
+            self.validator = BackgroundValidator(
+                self.model,
+                self.valid_dataloader,
+                self.criterion,
+                self.config.multi_head,
+                cpus=parse_cpus(valid_cpus) if valid_cpus else None,
+                max_pending=getattr(self.config, "valid_max_pending", 2),
+                on_result=self._log_validation,
+                input_transform=self.input_transform,
+            )
+            self.do_validation = False
+
+        # 분산 학습에서는 rank 0 만 로그와 checkpoint 를 남깁니다
+        if not self.is_main:
+            return
 
         self.save_dir = self.increment_path(os.path.join(self.config.model_dir, self.config.name))
         # logging with tensorboard
+        from torch.utils.tensorboard import SummaryWriter
         self.logger = SummaryWriter(log_dir=self.save_dir)
         with open(os.path.join(self.save_dir, "config.json"), "w", encoding="utf-8") as f:
             json.dump(vars(config), f, ensure_ascii=False, indent=4)
@@ -73,51 +161,73 @@ class Trainer(BaseTrainer):
         :param epoch: Integer, current training epoch.
         """
         self.model.train()
-        loss_value = 0
-        matches = 0
-        
+        self.train_metrics.reset()
+
+        if self.resize_schedule is not None:
+            self._set_resize_phase(epoch)
+        if self.unfreeze_schedule is not None:
+            self._set_unfreeze_phase(epoch)
+
+        sampler = getattr(self.train_dataloader, "sampler", None)
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(epoch)
+        elif hasattr(self.train_dataloader.dataset, "set_epoch"):  # streaming dataset shuffles by itself
+            self.train_dataloader.dataset.set_epoch(epoch)
+
         for idx, train_batch in enumerate(self.train_dataloader):
             self.optimizer.zero_grad()
 
+            train_batch = [tensor.to(self.device) for tensor in train_batch]
             if self.config.multi_head:
-                inputs, labels, mask, gender, age = train_batch
-                inputs = inputs.to(self.device)
-                labels = labels.to(self.device)
-                mask = mask.to(self.device)
-                gender = gender.to(self.device)
-                age = age.to(self.device)
+                inputs, labels, mask, gender, age = train_batch[:5]
+                inputs = self._transform_inputs(inputs)
 
                 outs = self.model(inputs)
                 pred_mask, pred_gender, pred_age = outs
 
-                loss_mask = self.criterion(pred_mask, mask)
-                loss_gender = self.criterion(pred_gender, gender)
-                loss_age = self.criterion(pred_age, age)
-                loss = loss_mask + loss_gender + loss_age
+                loss = self._compute_loss(outs, train_batch)
                 preds = torch.argmax(pred_mask, dim=-1) * 6 + torch.argmax(pred_gender, dim=-1) * 3 + torch.argmax(pred_age, dim=-1)
 
             else:
-                inputs, labels = train_batch
-                inputs = inputs.to(self.device)
-                labels = labels.to(self.device)
+                inputs, labels = train_batch[:2]
+                inputs = self._transform_inputs(inputs)
 
                 outs = self.model(inputs)
-                loss = self.criterion(outs, labels)
+                loss = self._compute_loss(outs, train_batch)
 
                 preds = torch.argmax(outs, dim=-1)
 
             loss.backward()
             self.optimizer.step()
+
+            # loss-aware sampler 는 샘플별 loss 로 다음 epoch 의 확률을 정함
+            if hasattr(sampler, "update"):
+                with torch.no_grad():
+                    if self.config.multi_head:
+                        sample_losses = sum(
+                            per_sample_loss(self.criterion, out.detach(), target)
+                            for out, target in zip(outs, (mask, gender, age))
+                        )
+                    else:
+                        sample_losses = per_sample_loss(self.criterion, outs.detach(), labels)
+                sampler.update(idx * self.train_dataloader.batch_size, sample_losses)
             
-            loss_value += loss.item()
-            matches += (preds == labels).sum().item()
-            if (idx + 1) % self.config.log_interval == 0:
-                train_loss = loss_value / self.config.log_interval
-                train_acc = matches / self.config.batch_size / self.config.log_interval
+            self.samples_seen += labels.size(0) * get_world_size()
+            self.train_metrics.update_many(
+                {"loss": loss.detach(), "acc": (preds == labels).float().mean()}, n=labels.size(0)
+            )
+            if (idx + 1) % self.config.log_interval == 0 and self.is_main:
+                window = self.train_metrics.window_result()
+                self.train_metrics.reset_window()
+                train_loss = window["loss"]
+                train_acc = window["acc"]
                 current_lr = self.get_lr(self.optimizer)
+                # _compute_loss 가 train_metrics 에 기록한 loss 항목들 (예: distillation 의 soft / hard loss)
+                terms = ", ".join(f"{key} {value:4.4}" for key, value in window.items() if key not in ("loss", "acc"))
                 print(
                     f"Epoch[{epoch}/{self.config.epochs}]({idx + 1}/{len(self.train_dataloader)}) || "
-                    f"training loss {train_loss:4.4} || training accuracy {train_acc:4.2%} || lr {current_lr}"
+                    f"training loss {train_loss:4.4}{f' ({terms})' if terms else ''} || "
+                    f"training accuracy {train_acc:4.2%} || lr {current_lr}"
                 )
 
                 # tensorboard: 학습 단계에서 Loss, Accuracy 로그 저장
@@ -128,113 +238,213 @@ class Trainer(BaseTrainer):
                     "Train/accuracy", train_acc, epoch * len(self.train_dataloader) + idx
                 )
 
-                loss_value = 0
-                matches = 0   
-
                 # wandb: 학습 단계에서 Loss, Accuracy 로그 저장
                 wandb.log({
                     "Train loss": train_loss,
                     "Train acc" : train_acc
                 })
 
+        self._log_cache_stats("Train", epoch)
+        if hasattr(sampler, "update") and self.is_main:
+            print(f"[Train] {sampler}")
         if self.lr_scheduler is not None:
             self.lr_scheduler.step()
 
+        log = {f"train_{key}": value for key, value in self.train_metrics.result().items()}
         if self.do_validation:
-            self._valid_epoch(epoch)
+            log.update(self._valid_epoch(epoch))
+        return log
+
+    def _compute_loss(self, outs, batch):
+        """
+        Loss of a train batch, the hook subclasses override to train on other targets
+
+        :param outs: model outputs, the (mask, gender, age) logits of a multi-head model
+        :param batch: the train batch on the device, (inputs, labels, mask, gender, age, ...) or (inputs, labels)
+        :return: the scalar loss to backpropagate
+        """
+        if self.config.multi_head:
+            mask, gender, age = batch[2:5]
+            loss_mask = self.criterion(outs[0], mask)
+            loss_gender = self.criterion(outs[1], gender)
+            loss_age = self.criterion(outs[2], age)
+            return loss_mask + loss_gender + loss_age
+        return self.criterion(outs, batch[1])
+
+    def _transform_inputs(self, inputs):
+        """
+        Apply the input transform (if any) to an input batch that is already on the device
+
+        :param inputs: input batch on self.device
+        :return: the batch the model takes
+        """
+        return inputs if self.input_transform is None else self.input_transform(inputs)
 
+    def _log_cache_stats(self, phase, epoch):
+        """
+        Print and log the hit rate of the shared image cache for the pass that just finished, then reset it
+
+        :param phase: "Train" or "Val"
+        :param epoch: Integer, current training epoch.
+        """
+        if self.shared_cache is None:
+            return
+        if self.is_main:
+            stats = self.shared_cache.stats()
+            print(f"[{phase}] shared image cache: {self.shared_cache} "
+                  f"({stats['hits']} hits, {stats['misses']} misses)")
+            self.logger.add_scalar(f"Cache/{phase.lower()}_hit_rate", stats["hit_rate"], epoch)
+        self.shared_cache.reset_stats()
+
+    def _set_resize_phase(self, epoch):
+        """
+        Rebuild the train dataloader when the progressive resizing schedule enters a new phase
+
+        :param epoch: Integer, current training epoch.
+        """
+        phase = self.resize_schedule.phase(epoch)
+        if phase == self.resize_phase:
+            return
+        resize, batch_size = phase
+        if self.is_main:
+            print(f"Progressive resizing: epoch {epoch} trains at resize {list(resize)} with batch size {batch_size}")
+        self.train_dataloader = self.train_dataloader_fn(resize, batch_size)
+        self.resize_phase = phase
+
+    def _set_unfreeze_phase(self, epoch):
+        """
+        Change the trainable backbone blocks when the unfreeze schedule enters a new phase
+
+        The optimizer already holds every backbone parameter, and parameters without gradients are skipped by
+        its step, so only requires_grad and the train / eval mode of the blocks change.
+
+        :param epoch: Integer, current training epoch.
+        """
+        phase = self.unfreeze_schedule.phase(epoch)
+        if phase == self.unfreeze_phase:
+            return
+        model = unwrap_model(self.model)
+        blocks = model.set_trainable_blocks(phase)
+        if self.is_main:
+            trainable = sum(param.numel() for param in model.model.parameters() if param.requires_grad)
+            print(f"Unfreeze schedule: epoch {epoch} trains the last {blocks} backbone blocks "
+                  f"({trainable} backbone parameters)")
+        self.unfreeze_phase = phase
 
     def _valid_epoch(self, epoch):
         """
         Validate after training an epoch
 
         :param epoch: Integer, current training epoch.
+        :return: A log dict with val_loss and every scalar metric of MultiTaskMetrics, prefixed with "val_".
+            In distributed training the metrics are all-reduced over every rank's validation shard.
         """
-        
-        self.model.eval()
-        
-        with torch.no_grad():
+        # 검증 shard 는 rank 마다 batch 수가 다를 수 있으므로 DDP 의 collective 없이 forward 합니다
+        model = unwrap_model(self.model) if is_distributed() else self.model
+        if self.is_main:
             print("Calculating validation results...")
-            val_loss_items = []
-            val_acc_items = []
-            figure = None
-
-            for val_batch in self.valid_dataloader:
-                if self.config.multi_head:
-                    inputs, labels, mask, gender, age = val_batch
-                    inputs = inputs.to(self.device)
-                    labels = labels.to(self.device)
-                    mask = mask.to(self.device)
-                    gender = gender.to(self.device)
-                    age = age.to(self.device)
-
-                    outs = self.model(inputs)
-                    pred_mask, pred_gender, pred_age = outs
-
-                    loss_mask = self.criterion(pred_mask, mask)
-                    loss_gender = self.criterion(pred_gender, gender)
-                    loss_age = self.criterion(pred_age, age)
-                    loss_item = (loss_mask + loss_gender + loss_age).item()
-                    preds = torch.argmax(pred_mask, dim=-1) * 6 + torch.argmax(pred_gender, dim=-1) * 3 + torch.argmax(pred_age, dim=-1)
-
-                else:
-                    inputs, labels = val_batch
-                    inputs = inputs.to(self.device)
-                    labels = labels.to(self.device)
-
-                    outs = self.model(inputs)
-                    preds = torch.argmax(outs, dim=-1)
-
-                    loss_item = self.criterion(outs, labels).item()
-
-                acc_item = (labels == preds).sum().item()
-                val_loss_items.append(loss_item)
-                val_acc_items.append(acc_item)
-
-                if figure is None:
-                    inputs_np = (
-                        torch.clone(inputs).detach().cpu().permute(0, 2, 3, 1).numpy()
-                    )
-                    inputs_np = self.denormalize_image(
-                        inputs_np, self.dataset_mean, self.dataset_std
-                    )
-                    figure = self.grid_image(
-                        inputs_np,
-                        labels,
-                        preds,
-                        n=16,
-                        shuffle=self.config.dataset != "MaskSplitByProfileDataset",
-                    )
+        log, sample = evaluate(
+            model, self.valid_dataloader, self.criterion, self.config.multi_head, self.valid_metrics, self.device,
+            input_transform=self.input_transform,
+        )
+
+        self._log_cache_stats("Val", epoch)
+        cache = getattr(getattr(self.valid_dataloader.dataset, "transform", None), "cache", None)
+        if cache is not None and self.is_main:
+            print(f"[Val] transform cache: {cache}")
+            cache.reset_stats()
+        return self._log_validation(epoch, log, sample)
+
+    def _log_validation(self, epoch, log, sample):
+        """
+        Print the validation results of an epoch and log them to tensorboard / wandb on the main process
 
-            val_loss = np.sum(val_loss_items) / len(self.valid_dataloader)
-            val_acc = np.sum(val_acc_items) / (len(self.valid_dataloader) * self.config.valid_batch_size)
-            self.best_val_loss = min(self.best_val_loss, val_loss)
-            if val_acc > self.best_val_acc:
-                print(
-                    f"New best model for val accuracy : {val_acc:4.2%}! saving the best model.."
-                )
-                
-                torch.save(self.model.module.state_dict(), f"{self.save_dir}/best.pth")
-            if val_acc > self.best_val_acc:
-                self.best_val_acc = val_acc
-            torch.save(self.model.module.state_dict(), f"{self.save_dir}/last.pth")
+        :param epoch: Integer, the validated epoch.
+        :param log: A log dict returned from evaluate
+        :param sample: (inputs, labels, preds) of the first validation batch, drawn as the results figure
+        :return: the log dict
+        """
+        if not self.is_main:
+            return log
+
+        val_loss = log["val_loss"]
+        self.best_val_loss = min(self.best_val_loss, val_loss)
+        self.best_val_acc = max(self.best_val_acc, log["val_acc"])
+        self.best_val_f1 = max(self.best_val_f1, log["val_f1"])
+        print(
+            f"[Val] acc : {log['val_acc']:4.2%}, f1: {log['val_f1']:4.4}, loss: {val_loss:4.2} || "
+            f"best acc : {self.best_val_acc:4.2%}, best f1: {self.best_val_f1:4.4}, "
+            f"best loss: {self.best_val_loss:4.2}"
+        )
+        print(
+            f"[Val] mask f1 : {log['val_mask_f1']:4.4}, gender f1 : {log['val_gender_f1']:4.4}, "
+            f"age f1 : {log['val_age_f1']:4.4}"
+        )
+
+        inputs, labels, preds = sample
+        inputs_np = self.denormalize_image(
+            inputs.permute(0, 2, 3, 1).numpy(), self.dataset_mean, self.dataset_std
+        )
+        figure = self.grid_image(
+            inputs_np,
+            labels,
+            preds,
+            n=len(inputs_np),
+            shuffle=self.config.dataset != "MaskSplitByProfileDataset",
+        )
+
+        # tensorboard: 검증 단계에서 Loss, Accuracy, F1 로그 저장
+        self.logger.add_scalar("Val/loss", val_loss, epoch)
+        self.logger.add_scalar("Val/accuracy", log["val_acc"], epoch)
+        self.logger.add_scalar("Val/f1", log["val_f1"], epoch)
+        for head in module_metric.MultiTaskMetrics.heads:
+            self.logger.add_scalar(f"Val/{head}_f1", log[f"val_{head}_f1"], epoch)
+        self.logger.add_figure("results", figure, epoch)
+        print()
+
+        # wandb: 검증 단계에서 Loss, Accuracy, F1 로그 저장
+        wandb.log({
+            "Valid loss": val_loss,
+            "Valid acc" : log["val_acc"],
+            "Valid f1" : log["val_f1"],
+            "results": wandb.Image(figure),
+        })
+        return log
+
+    def _save_checkpoint(self, epoch, save_best=False, state_dict=None):
+        """
+        Saving last.pth every epoch, and best.pth if the monitored metric improved
+
+        :param epoch: current epoch number
+        :param save_best: if True, also save the checkpoint as best.pth
+        :param state_dict: weights of the epoch if they are no longer the model's (background validation)
+        """
+        if not self.is_main:
+            return
+        if state_dict is None:
+            state_dict = unwrap_model(self.model).state_dict()
+        if save_best:
             print(
-                f"[Val] acc : {val_acc:4.2%}, loss: {val_loss:4.2} || "
-                f"best acc : {self.best_val_acc:4.2%}, best loss: {self.best_val_loss:4.2}"
+                f"New best model for {self.mnt_metric} : {self.mnt_best:4.4}! saving the best model.."
             )
+            torch.save(state_dict, f"{self.save_dir}/best.pth")
+        torch.save(state_dict, f"{self.save_dir}/last.pth")
 
-            # tensorboard: 검증 단계에서 Loss, Accuracy 로그 저장
-            self.logger.add_scalar("Val/loss", val_loss, epoch)
-            self.logger.add_scalar("Val/accuracy", val_acc, epoch)
-            self.logger.add_figure("results", figure, epoch)
-            print()
+    def save_results(self, path=None):
+        """
+        Write the summary of the finished run to results.json in the save directory
 
-            # wandb: 검증 단계에서 Loss, Accuracy 로그 저장
-            wandb.log({
-                "Valid loss": val_loss,
-                "Valid acc" : val_acc,
-                "results": wandb.Image(figure),
-            })
+        :param path: optional extra path to write the same summary to (e.g. a file collected by sweep.py)
+        """
+        if not self.is_main:
+            return
+        results = dict(self.results(), save_dir=self.save_dir)
+        for result_path in filter(None, [os.path.join(self.save_dir, "results.json"), path]):
+            dirname = os.path.dirname(result_path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with open(result_path, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=4)
 
     def _progress(self, batch_idx):
         base = '[{}/{} ({:.0f}%)]'
@@ -263,6 +473,8 @@ class Trainer(BaseTrainer):
         return mask_label, gender_label, age_label
 
     def grid_image(self, np_images, gts, preds, n=16, shuffle=False):
+        import matplotlib.pyplot as plt
+
         batch_size = np_images.shape[0]
         assert n <= batch_size
 
@@ -0,0 +1,207 @@
+import inspect
+import json
+import os
+import resource
+import socket
+import time
+
+import torch
+
+__all__ = ["BatchSizeTuner"]
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "mask_autotune.json")
+
+
+def _is_oom(error):
+    return "out of memory" in str(error)
+
+
+def _proc_status_mb(field):
+    """A memory field of /proc/self/status (e.g. VmRSS, VmHWM) in MiB"""
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 2 ** 10  # kB
+    raise KeyError(field)
+
+
+class BatchSizeTuner:
+    """
+    Picks the batch size with the highest measured samples/sec for a model, input size and host
+
+    Powers of two are probed in increasing order with random inputs: forward + backward for "train",
+    a no_grad forward for "eval". Probing stops at the first batch size that runs out of memory, exceeds the
+    memory ceiling, or is clearly slower than the best one so far (past the throughput peak). The smallest batch
+    size within `tolerance` of the best throughput wins, since larger ones only add memory and, in training,
+    fewer updates per epoch.
+    The memory ceiling applies to peak allocated memory on CUDA and to the peak resident set size of the
+    process on CPU, and defaults to 90% of the device memory or half of the physical memory. Optimizer state is
+    not part of the probe, so leave some margin when the model is large.
+    Each probe measures its own peak: the CUDA peak statistics are reset before it, and on CPU the peak RSS
+    (VmHWM) is reset to the current RSS through /proc/self/clear_refs, so earlier probes (e.g. the train tune
+    before the eval tune) do not inflate it.
+
+    Results are cached in a json file per (model, mode, resize, host, memory ceiling), so later runs on the same
+    host skip the probe.
+    """
+    def __init__(self, device, memory_limit_mb=None, cache_path=None, max_batch_size=1024, steps=3, tolerance=0.05):
+        """
+        :param device: torch.device the probes (and the real run) execute on
+        :param memory_limit_mb: memory ceiling in MiB, None for the default of the device
+        :param cache_path: json cache file (default: ~/.cache/mask_autotune.json)
+        :param max_batch_size: largest batch size probed
+        :param steps: timed steps per batch size, after one warmup step
+        :param tolerance: relative throughput loss accepted for a smaller batch size
+        """
+        self.device = torch.device(device)
+        self.memory_limit_mb = memory_limit_mb or self.default_memory_limit_mb()
+        self.cache_path = cache_path or DEFAULT_CACHE
+        self.candidates = [2 ** i for i in range(3, max_batch_size.bit_length()) if 2 ** i <= max_batch_size]
+        self.steps = steps
+        self.tolerance = tolerance
+        self._warned = False
+
+    def default_memory_limit_mb(self):
+        if self.device.type == "cuda":
+            return 0.9 * torch.cuda.get_device_properties(self.device).total_memory / 2 ** 20
+        return 0.5 * os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2 ** 20
+
+    def host(self):
+        if self.device.type == "cuda":
+            return f"{socket.gethostname()}/{torch.cuda.get_device_name(self.device)}"
+        return f"{socket.gethostname()}/cpu{os.cpu_count()}x{torch.get_num_threads()}threads"
+
+    def read_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_cache(self, key, entry):
+        cache = self.read_cache()
+        cache[key] = entry
+        dirname = os.path.dirname(self.cache_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=4)
+        os.replace(tmp_path, self.cache_path)
+
+    def reset_peak_memory(self):
+        """
+        Start the peak memory measurement of a probe
+
+        :return: True if the peak was reset; False on CPU hosts without a resettable peak RSS
+        """
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
+            return True
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")  # resets VmHWM to the current RSS (Linux >= 4.0)
+        except OSError:
+            return False
+        return True
+
+    def peak_memory_mb(self, reset=True, maxrss_before=None):
+        """
+        :param reset: whether reset_peak_memory succeeded before the probe
+        :param maxrss_before: ru_maxrss in MiB before the probe, used when the peak RSS could not be reset
+        :return: peak memory of the probe in MiB
+        """
+        if self.device.type == "cuda":
+            return torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+        if reset:
+            return _proc_status_mb("VmHWM")
+        # the lifetime peak only belongs to this probe if the probe raised it, otherwise fall back to the
+        # current RSS (a lower bound of the probe's peak)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10  # KiB on Linux
+        return maxrss if maxrss > maxrss_before else _proc_status_mb("VmRSS")
+
+    def measure(self, model, batch_size, resize, mode):
+        """
+        :return: (samples/sec, peak memory in MiB) of `steps` steps at batch_size
+        """
+        inputs = torch.randn(batch_size, 3, *resize, device=self.device)
+        maxrss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+        reset = self.reset_peak_memory()
+        if not reset and not self._warned:
+            print("Autotune: the peak RSS cannot be reset on this host, CPU peaks of later probes are approximate")
+            self._warned = True
+        model.train(mode == "train")
+        for step in range(1 + self.steps):
+            if step == 1:
+                if self.device.type == "cuda":
+                    torch.cuda.synchronize(self.device)
+                start = time.perf_counter()
+            if mode == "train":
+                outs = model(inputs)
+                outs = outs if isinstance(outs, (tuple, list)) else (outs,)
+                sum(out.float().mean() for out in outs).backward()
+                model.zero_grad(set_to_none=True)
+            else:
+                with torch.no_grad():
+                    model(inputs)
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        samples_per_sec = batch_size * self.steps / (time.perf_counter() - start)
+        return samples_per_sec, self.peak_memory_mb(reset, maxrss_before)
+
+    def tune(self, name, model_module, resize, mode, **model_kwargs):
+        """
+        Return the cached or freshly probed best batch size
+
+        :param name: model name, part of the cache key
+        :param model_module: model class, instantiated without pretrained weights for the probe
+        :param resize: (height, width) of the inputs
+        :param mode: "train" or "eval"
+        :param model_kwargs: keyword arguments of the model constructor (e.g. num_classes)
+        :return: Integer batch size
+        """
+        if mode not in ("train", "eval"):
+            raise ValueError(f"mode should be train or eval, got {mode}")
+        key = f"{name}|{mode}|{resize[0]}x{resize[1]}|{self.host()}|{self.memory_limit_mb:.0f}MiB"
+        entry = self.read_cache().get(key)
+        if entry is not None:
+            print(f"Autotune {mode}: batch size {entry['batch_size']} "
+                  f"({entry['samples_per_sec']:.1f} samples/s, cached in {self.cache_path})")
+            return entry["batch_size"]
+
+        if "pretrained" in inspect.signature(model_module).parameters:
+            model_kwargs.setdefault("pretrained", False)
+        model = model_module(**model_kwargs).to(self.device)
+        probes = {}
+        for batch_size in self.candidates:
+            try:
+                samples_per_sec, peak_mb = self.measure(model, batch_size, resize, mode)
+            except RuntimeError as e:
+                if not _is_oom(e):
+                    raise
+                if self.device.type == "cuda":
+                    torch.cuda.empty_cache()
+                print(f"Autotune {mode}: batch size {batch_size} runs out of memory")
+                break
+            print(f"Autotune {mode}: batch size {batch_size:5d} {samples_per_sec:9.1f} samples/s, "
+                  f"peak {peak_mb:8.0f} MiB")
+            if peak_mb > self.memory_limit_mb:
+                break
+            probes[batch_size] = (samples_per_sec, peak_mb)
+            if samples_per_sec < 0.8 * max(sps for sps, _ in probes.values()):
+                break
+        del model
+        if not probes:
+            raise RuntimeError(f"batch size {self.candidates[0]} of {name} does not fit in "
+                               f"{self.memory_limit_mb:.0f} MiB at resize {list(resize)}")
+
+        best = max(sps for sps, _ in probes.values())
+        batch_size = min(size for size, (sps, _) in probes.items() if sps >= (1 - self.tolerance) * best)
+        samples_per_sec, peak_mb = probes[batch_size]
+        self.write_cache(key, {
+            "batch_size": batch_size,
+            "samples_per_sec": samples_per_sec,
+            "peak_mb": peak_mb,
+            "probes": {str(size): sps for size, (sps, _) in probes.items()},
+        })
+        print(f"Autotune {mode}: batch size {batch_size} ({samples_per_sec:.1f} samples/s)")
+        return batch_size
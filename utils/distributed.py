@@ -0,0 +1,69 @@
+import os
+
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend="gloo"):
+    """
+    setup torch.distributed from the environment variables set by torchrun (RANK, WORLD_SIZE, LOCAL_RANK).
+    gloo is used by default so training also runs on CPU-only hosts.
+
+    :return: (rank, world_size, local_rank)
+    """
+    rank = int(os.environ.get("RANK", 0))
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend, rank=rank, world_size=world_size)
+    return rank, world_size, local_rank
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def all_reduce_sum(tensor):
+    """
+    sum a tensor over every process in place (no-op without torch.distributed)
+    """
+    if is_distributed() and get_world_size() > 1:
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def any_process(flag):
+    """
+    True on every process if the flag is True on any process, so that all ranks take the same branch
+    """
+    if not is_distributed() or get_world_size() == 1:
+        return bool(flag)
+    tensor = torch.tensor([1 if flag else 0], dtype=torch.long)
+    dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return bool(tensor.item())
+
+
+def unwrap_model(model):
+    """
+    return the underlying model of DataParallel / DistributedDataParallel wrappers
+    """
+    return model.module if isinstance(
+        model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)
+    ) else model
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+__all__ = ["PredictionCache", "prediction_context"]
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "mask_predictions.sqlite")
+
+
+def prediction_context(**settings):
+    """
+    short digest of everything besides the image that changes a prediction
+    (checkpoint hash, model, resize, TTA policy, ...)
+    """
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+class PredictionCache:
+    """
+    Content-addressed on-disk cache of predictions, stored in one sqlite file
+
+    Predictions are keyed by (context, sha256 of the image bytes), so renamed, reordered or re-listed images hit
+    the cache, while a new checkpoint, resize or TTA policy (a new context) misses. Each entry keeps the predicted
+    class and the float32 logits.
+    File hashes are cached by (path, size, mtime), so unchanged files are not read again on later runs.
+
+    The database runs in WAL mode with a busy timeout, so concurrent inference runs can read and write the same
+    cache; entries are immutable and inserted with INSERT OR IGNORE, so racing writers are harmless.
+    """
+    def __init__(self, path=None, timeout=60.0):
+        """
+        :param path: sqlite file path, created if missing (default: ~/.cache/mask_predictions.sqlite)
+        :param timeout: seconds to wait for a concurrent writer's lock
+        """
+        path = path or DEFAULT_CACHE
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "context TEXT NOT NULL, image BLOB NOT NULL, label INTEGER NOT NULL, logits BLOB NOT NULL, "
+                "PRIMARY KEY (context, image)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest BLOB NOT NULL)"
+            )
+        self.hits = 0
+        self.misses = 0
+
+    def file_digests(self, paths, chunk_size=2 ** 20):
+        """
+        :param paths: file paths
+        :return: list of 32-byte sha256 digests of the file contents, in the order of paths
+        """
+        stats = [os.stat(path) for path in paths]
+        known = {}
+        for start in range(0, len(paths), 500):
+            chunk = [os.path.abspath(path) for path in paths[start:start + 500]]
+            rows = self.connection.execute(
+                f"SELECT path, size, mtime_ns, digest FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk
+            )
+            known.update((path, (size, mtime_ns, digest)) for path, size, mtime_ns, digest in rows)
+
+        digests, updates = [], []
+        for path, stat in zip(paths, stats):
+            path = os.path.abspath(path)
+            entry = known.get(path)
+            if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                digests.append(entry[2])
+                continue
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(chunk_size), b""):
+                    digest.update(block)
+            digests.append(digest.digest())
+            updates.append((path, stat.st_size, stat.st_mtime_ns, digests[-1]))
+        if updates:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", updates)
+        return digests
+
+    def get_many(self, context, digests):
+        """
+        :return: dict digest -> (label, logits np.ndarray) for the digests found in the cache. hits / misses
+            count every requested digest
+        """
+        found = {}
+        unique = list(dict.fromkeys(digests))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT image, label, logits FROM predictions WHERE context = ? "
+                f"AND image IN ({','.join('?' * len(chunk))})",
+                [context] + chunk,
+            )
+            found.update((image, (label, np.frombuffer(logits, dtype=np.float32))) for image, label, logits in rows)
+        hits = sum(digest in found for digest in digests)
+        self.hits += hits
+        self.misses += len(digests) - hits
+        return found
+
+    def put_many(self, context, digests, labels, logits):
+        """
+        :param digests: image digests
+        :param labels: predicted classes
+        :param logits: (N, C) array of logits
+        """
+        logits = np.ascontiguousarray(logits, dtype=np.float32)
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO predictions VALUES (?, ?, ?, ?)",
+                [(context, digest, int(label), row.tobytes()) for digest, label, row in zip(digests, labels, logits)],
+            )
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self.connection.close()
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}({self.path}, hit rate {self.hit_rate:.1%}, "
+                f"{self.hits} hits, {self.misses} misses)")
@@ -0,0 +1,127 @@
+import importlib
+
+__all__ = ["Registry", "LazyModule", "import_string", "DATASETS", "AUGMENTATIONS", "MODELS", "CRITERIA", "OPTIMIZERS"]
+
+
+def import_string(path):
+    """
+    "package.module:attr" 경로의 객체를 import 한다.
+    """
+    module_name, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+class LazyModule:
+    """
+    처음 속성에 접근할 때 import 되는 모듈
+
+    import 에 몇 초씩 걸리는 선택 의존성 (wandb 등) 은
+    모듈 맨 위에 ``wandb = LazyModule("wandb")`` 로 선언해두면
+    실제로 사용하는 코드 경로에서만 import 비용을 냅니다.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<{self.__class__.__name__} {self._name} ({state})>"
+
+
+class Registry:
+    """
+    데이터셋, augmentation, 모델, 손실 함수, optimizer 의 이름으로 구현을 찾는 클래스
+
+    구현이 있는 모듈은 registry 를 만들 때가 아니라 처음 찾을 때 import 합니다.
+    이름은 아래 순서로 찾습니다.
+        1. ``register`` 로 등록한 객체 또는 "package.module:attr" 경로 (다른 모듈의 plugin)
+        2. 기본 모듈의 entrypoint dict ``table``, table 이 없으면 기본 모듈의 클래스
+        3. 이름 자체가 "package.module:attr" 경로이면 그 객체 (명령행에서 바로 지정한 plugin)
+    """
+    def __init__(self, kind, module=None, table=None):
+        """
+        Args:
+            kind (str): 등록되는 대상의 종류 (에러 메시지에 사용, 예: "model")
+            module (str): 이름을 찾을 기본 모듈
+            table (str): 기본 모듈의 {이름: 구현} dict 이름.
+                None 이면 기본 모듈의 클래스에서 찾는다.
+        """
+        self.kind = kind
+        self.module = module
+        self.table = table
+        self._entries = {}
+
+    def register(self, name, target=None):
+        """
+        구현을 등록한다. target 없이 호출하면 decorator 로 동작한다.
+
+        Args:
+            name (str): 등록할 이름
+            target: 구현 또는 처음 찾을 때 import 할 "package.module:attr" 경로
+        """
+        if target is None:
+            def decorator(obj):
+                self._entries[name] = obj
+                return obj
+            return decorator
+        self._entries[name] = target
+        return target
+
+    def _lookup(self):
+        """기본 모듈에서 찾을 수 있는 {이름: 구현}. table 이 없으면 모듈의 public 클래스만"""
+        module = importlib.import_module(self.module)
+        if self.table is not None:
+            return getattr(module, self.table)
+        return {
+            name: value for name, value in vars(module).items()
+            if not name.startswith("_") and isinstance(value, type)
+        }
+
+    def get(self, name):
+        """
+        이름으로 등록된 구현을 반환한다. 처음 찾을 때 구현이 있는 모듈을 import 한다.
+        """
+        if name in self._entries:
+            entry = self._entries[name]
+            if isinstance(entry, str):
+                entry = self._entries[name] = import_string(entry)
+            return entry
+        if self.module is not None:
+            lookup = self._lookup()
+            if name in lookup:
+                return lookup[name]
+        if ":" in name:
+            return import_string(name)
+        raise ValueError(f"Unknown {self.kind} '{name}'. available: {', '.join(self.names())}")
+
+    def __contains__(self, name):
+        try:
+            self.get(name)
+        except (ValueError, ImportError, AttributeError):
+            return False
+        return True
+
+    def names(self):
+        """
+        등록된 이름과 기본 모듈에서 찾을 수 있는 이름을 정렬해서 반환한다.
+        (기본 모듈을 import 함)
+        """
+        names = set(self._entries)
+        if self.module is not None:
+            names.update(self._lookup())
+        return sorted(names)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.kind}, module={self.module})"
+
+
+DATASETS = Registry("dataset", "data_loader.data_sets")
+AUGMENTATIONS = Registry("augmentation", "data_loader.augmentations")
+MODELS = Registry("model", "model.model")
+CRITERIA = Registry("criterion", "model.loss", table="_criterion_entrypoints")
+OPTIMIZERS = Registry("optimizer", "torch.optim")
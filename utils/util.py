@@ -1,6 +1,6 @@
 import json
+import numpy as np
 import torch
-import pandas as pd
 from pathlib import Path
 from itertools import repeat
 from collections import OrderedDict
@@ -44,24 +44,95 @@ def prepare_device(n_gpu_use):
     return device, list_ids
 
 class MetricTracker:
-    def __init__(self, *keys, writer=None):
+    """
+    Running averages of scalar metrics, backed by preallocated arrays
+
+    Totals and counts live in numpy arrays (or torch tensors on ``device``), so ``update`` never
+    touches pandas or Python objects per key. When ``device`` is given, tensor values are
+    accumulated on that device without a host sync and ``result`` copies everything in one transfer.
+    A second set of accumulators holds the values since the last ``reset_window`` for log intervals.
+    """
+    def __init__(self, *keys, writer=None, device=None):
         self.writer = writer
-        self._data = pd.DataFrame(index=keys, columns=['total', 'counts', 'average'])
+        self.keys = list(keys)
+        self._index = {key: i for i, key in enumerate(self.keys)}
+        self._index_cache = {}
+        self.device = device
+        if device is None:
+            self._data = np.zeros((4, len(self.keys)), dtype=np.float64)
+        else:
+            self._data = torch.zeros((4, len(self.keys)), dtype=torch.float64, device=device)
+        # rows: total, counts, window total, window counts
         self.reset()
 
     def reset(self):
-        for col in self._data.columns:
-            self._data[col].values[:] = 0
+        self._data[:] = 0
+
+    def reset_window(self):
+        self._data[2:] = 0
 
     def update(self, key, value, n=1):
         if self.writer is not None:
             self.writer.add_scalar(key, value)
-        self._data.total[key] += value * n
-        self._data.counts[key] += n
-        self._data.average[key] = self._data.total[key] / self._data.counts[key]
+        i = self._index[key]
+        if torch.is_tensor(value):
+            value = value.detach()
+            if self.device is None:
+                value = value.item()
+        self._data[0, i] += value * n
+        self._data[1, i] += n
+        self._data[2, i] += value * n
+        self._data[3, i] += n
+
+    def update_many(self, values, n=1):
+        """
+        Update several keys at once
+
+        :param values: dict of key -> float or 0-dim tensor
+        :param n: number of samples the values were averaged over
+        """
+        if self.writer is not None:
+            for key, value in values.items():
+                self.writer.add_scalar(key, value)
+        index = self._key_index(tuple(values))
+        if self.device is None:
+            batch = [(v.item() if torch.is_tensor(v) else v) * n for v in values.values()]
+            counts = [n] * len(batch)
+            self._data[:, index] += np.array([batch, counts, batch, counts])
+        else:
+            batch = torch.stack([
+                v.detach() if torch.is_tensor(v) else torch.tensor(v) for v in values.values()
+            ]).to(self._data.device, torch.float64) * n
+            counts = torch.full_like(batch, n)
+            update = torch.stack([batch, counts, batch, counts])
+            if isinstance(index, slice):
+                self._data[:, index] += update
+            else:
+                self._data.index_add_(1, index, update)
+
+    def _key_index(self, keys):
+        if keys not in self._index_cache:
+            index = [self._index[key] for key in keys]
+            if index == list(range(index[0], index[-1] + 1)):
+                index = slice(index[0], index[-1] + 1)  # contiguous keys are updated through a view
+            elif self.device is not None:
+                index = torch.tensor(index, device=self.device)
+            self._index_cache[keys] = index
+        return self._index_cache[keys]
+
+    def _snapshot(self):
+        data = self._data if self.device is None else self._data.cpu().numpy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return data[0] / data[1], data[2] / data[3]
 
     def avg(self, key):
-        return self._data.average[key]
+        return float(self._snapshot()[0][self._index[key]])
+
+    def window_avg(self, key):
+        return float(self._snapshot()[1][self._index[key]])
 
     def result(self):
-        return dict(self._data.average)
+        return dict(zip(self.keys, self._snapshot()[0].tolist()))
+
+    def window_result(self):
+        return dict(zip(self.keys, self._snapshot()[1].tolist()))